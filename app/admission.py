@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limiter whose limit adapts to the observed latency using an
+    additive increase / multiplicative decrease (AIMD) policy.
+
+    Every request that completes within latency_target_ms while the limiter
+    is in use grows the limit by roughly one per limit completed requests.
+    A request slower than the target shrinks the limit by the backoff ratio,
+    down to min_limit. The limit shrinks at most once per round trip: other
+    slow requests completing within the latency of the request that shrank
+    it belong to the same burst and are ignored.
+
+    :param str name: the name of the class of endpoints being limited.
+    :param int initial_limit: the concurrency limit to start with.
+    :param int min_limit: the limit never goes below this value.
+    :param int max_limit: the limit never goes above this value.
+    :param float latency_target_ms: the latency above which the limiter
+     considers the endpoints overloaded.
+    :param float backoff: ratio applied to the limit on a slow request.
+    """
+
+    def __init__(self, name, initial_limit=20, min_limit=1, max_limit=200,
+                 latency_target_ms=200, backoff=0.9):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_ms = latency_target_ms
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._no_decrease_until = 0.0
+
+    @property
+    def limit(self):
+        """
+        The current concurrency limit.
+        """
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """
+        The number of requests currently admitted.
+        """
+        return self._in_flight
+
+    def try_acquire(self):
+        """
+        Admits a request if the limit allows it.
+
+        :return: True if the request was admitted, False if it must be shed.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._in_flight >= int(self._limit):
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self, latency_ms):
+        """
+        Releases an admitted request and adapts the limit with its latency.
+
+        :param float latency_ms: the time the request took to complete.
+        """
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+
+            if latency_ms > self.latency_target_ms:
+                now = time.monotonic()
+                if now >= self._no_decrease_until:
+                    self._limit = max(
+                        self._limit * self.backoff, self.min_limit)
+                    self._no_decrease_until = now + latency_ms / 1000
+            elif in_flight * 2 >= self._limit:
+                # Only grow when the current limit is actually being used.
+                self._limit = min(
+                    self._limit + 1 / self._limit, self.max_limit)
+
+
+class AdmissionController:
+    """
+    Keeps one AdaptiveLimiter per class of endpoints, so an overloaded class
+    (such as the bcrypt heavy login) sheds its own load without starving the
+    others.
+
+    :param dict classes_settings: the AdaptiveLimiter arguments of each class
+     of endpoints, keyed by class name.
+    :param dict endpoint_classes: the class of each endpoint, keyed by flask
+     endpoint name.
+    :param str default_class: the class of endpoints not in endpoint_classes.
+    """
+
+    def __init__(self, classes_settings, endpoint_classes, default_class):
+        self.limiters = {
+            name: AdaptiveLimiter(name, **settings)
+            for name, settings in classes_settings.items()
+        }
+        self.endpoint_classes = endpoint_classes
+        self.default_class = default_class
+
+    def get_limiter(self, endpoint):
+        """
+        Returns the limiter of the class the endpoint belongs to.
+
+        :param str endpoint: the flask endpoint name.
+        """
+        endpoint_class = self.endpoint_classes.get(
+            endpoint, self.default_class)
+        return self.limiters[endpoint_class]
+
+    def admit(self, endpoint):
+        """
+        Tries to admit a request to the given endpoint.
+
+        :param str endpoint: the flask endpoint name.
+
+        :return: a slot to hand back to release() once the request completes,
+         or None if the request must be shed.
+        """
+        limiter = self.get_limiter(endpoint)
+        if not limiter.try_acquire():
+            logging.warning(
+                'Shedding request to %s, limit %s reached for class %s',
+                endpoint, limiter.limit, limiter.name)
+            return None
+        return limiter, time.monotonic()
+
+    def release(self, slot):
+        """
+        Releases a slot returned by admit().
+
+        :param tuple slot: the slot to release.
+        """
+        limiter, started_at = slot
+        limiter.release((time.monotonic() - started_at) * 1000)
@@ -1,11 +1,70 @@
 from functools import wraps
 from http import HTTPStatus
 
-import jwt
 from flask import request, current_app
 
+from app import tracing
 from app.app import HTTPException
 
+# Endpoints that skip the request middlewares (tracing, logging, admission
+# control, latency budget and schema validation), meant for cheap and
+# frequent health checks.
+UNMONITORED_ENDPOINTS = ('health.liveness', 'health.readiness')
+
+# Endpoints answering with a long-lived stream. They skip admission control
+# and the latency budget, which are meant for short requests, and can not be
+# dispatched by /batch.
+STREAMING_ENDPOINTS = ('catalog.get_catalog_events',)
+
+# Latency budget in milliseconds of each endpoint. The budget left when a
+# database operation starts is passed down to MongoDB, operations that can
+# not complete in time are aborted and the request fails with 504.
+DEFAULT_LATENCY_BUDGET_MS = 2000
+LATENCY_BUDGETS_MS = {
+    # bcrypt hashing is slow on purpose
+    'authentication.authenticate': 3000,
+    'authentication.get_user': 500,
+
+    'cart.get_cart': 1000,
+    'cart.create_cart': 2000,
+    'cart.delete_cart_item': 1000,
+    'cart.delete_cart': 1000,
+    'cart.add_cart_items': 2000,
+
+    'catalog.get_catalog': 2000,
+    'catalog.get_item': 500,
+    'catalog.create_catalog': 10000,
+    'catalog.get_import_job': 500,
+
+    # Each sub-request runs with its own budget, cut to what is left of the
+    # budget of the batch
+    'batch.batch': 5000,
+
+    'metrics.get_metrics': 500,
+    'metrics.get_queries': 500,
+}
+
+# Endpoints are grouped in classes for admission control, each class has its
+# own adaptive concurrency limit so a storm on one class (e.g. logins) can not
+# starve the others. The settings are the AdaptiveLimiter arguments.
+DEFAULT_ENDPOINT_CLASS = 'default'
+ENDPOINT_CLASSES = {
+    'authentication.authenticate': 'login',
+    'catalog.get_catalog': 'catalog_read',
+    'catalog.get_item': 'catalog_read',
+}
+ENDPOINT_CLASSES_SETTINGS = {
+    'login': {
+        'initial_limit': 4, 'max_limit': 16, 'latency_target_ms': 800,
+    },
+    'catalog_read': {
+        'initial_limit': 50, 'max_limit': 400, 'latency_target_ms': 100,
+    },
+    'default': {
+        'initial_limit': 20, 'max_limit': 200, 'latency_target_ms': 250,
+    },
+}
+
 
 def authenticated(func):
     """
@@ -16,30 +75,62 @@ def authenticated(func):
 
     @wraps(func)
     def wrapper(*args,  **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            raise HTTPException(
-                reason='Token was not found in request headers',
-                status_code=HTTPStatus.UNAUTHORIZED
-            )
-        if token.lower().startswith('bearer '):
-            token = token[len('bearer '):]
+        # Imported on first use, jwt pulls cryptography which is slow to load
+        import jwt
 
-        try:
-            payload = jwt.decode(
-                token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            request.user = payload['user']
+        with tracing.span('authenticated'):
+            token = request.headers.get('Authorization')
+            if not token:
+                raise HTTPException(
+                    reason='Token was not found in request headers',
+                    status_code=HTTPStatus.UNAUTHORIZED
+                )
+            if token.lower().startswith('bearer '):
+                token = token[len('bearer '):]
 
-        except jwt.ExpiredSignatureError:
-            raise HTTPException(
-                reason='Token has expired', status_code=HTTPStatus.UNAUTHORIZED
-            )
+            try:
+                payload = jwt.decode(
+                    token, current_app.config['SECRET_KEY'],
+                    algorithms=['HS256'])
+                request.user = payload['user']
 
-        except jwt.DecodeError:
+            except jwt.ExpiredSignatureError:
+                raise HTTPException(
+                    reason='Token has expired',
+                    status_code=HTTPStatus.UNAUTHORIZED
+                )
+
+            except jwt.DecodeError:
+                raise HTTPException(
+                    reason='Token is invalid',
+                    status_code=HTTPStatus.UNAUTHORIZED
+                )
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def admin_only(func):
+    """
+    Decorator for flask endpoints reserved to the users listed in the
+    ADMIN_USERS setting, e.g. the ones exposing internal metrics. Other
+    users get a 403, requests without a valid token a 401.
+    """
+
+    @wraps(func)
+    @authenticated
+    def wrapper(*args, **kwargs):
+        admin_users = {
+            user.strip()
+            for user in current_app.config['ADMIN_USERS'].split(',')
+            if user.strip()
+        }
+        if request.user not in admin_users:
             raise HTTPException(
-                reason='Token is invalid', status_code=HTTPStatus.UNAUTHORIZED
+                reason='Only admin users can access this endpoint',
+                status_code=HTTPStatus.FORBIDDEN
             )
-
         return func(*args, **kwargs)
 
     return wrapper
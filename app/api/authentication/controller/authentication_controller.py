@@ -2,14 +2,14 @@ import logging
 import datetime
 from http import HTTPStatus
 
-import jwt
-import bcrypt
 from flask import current_app
 
 from app.app import HTTPException
+from app.tracing import traced
 from app.api.authentication.dao import authentication_dao
 
 
+@traced()
 def generate_token(user):
     """
     Generates a new JWT token for the given user. Tokens are set to expire in
@@ -17,6 +17,9 @@ def generate_token(user):
 
     :param str user: the user email.
     """
+    # Imported here to keep jwt out of the app startup
+    import jwt
+
     expiration_time = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
     payload = {
         'user': user,
@@ -28,6 +31,7 @@ def generate_token(user):
     return token
 
 
+@traced()
 def login_user(user, password):
     """
     Performs user authentication. If user is not found, it will create a new
@@ -36,6 +40,9 @@ def login_user(user, password):
     :param str user: the user email.
     :param str password: the plain text that represents the user password.
     """
+    # Imported here to keep bcrypt out of the app startup
+    import bcrypt
+
     user_doc = authentication_dao.get_user(user)
     if user_doc:
         logging.info('User found, checking password...')
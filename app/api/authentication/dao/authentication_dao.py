@@ -1,9 +1,6 @@
-import bcrypt
-
-from app.db import DatabaseManager
+from app import sharding
 
 COLLECTION_NAME = "users"
-db = DatabaseManager()
 
 
 def get_user(user):
@@ -12,6 +9,7 @@ def get_user(user):
 
     :param str user: the user email to search.
     """
+    db = sharding.get_database(user, COLLECTION_NAME)
     query = {'user': user}
     user = db.find_one(COLLECTION_NAME, query)
     return user
@@ -24,8 +22,12 @@ def store_user(user, password):
     :param str user: the user email to store.
     :param str password: the user password to store.
     """
+    # Imported here to keep bcrypt out of the app startup
+    import bcrypt
+
     salt = bcrypt.gensalt()
     hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
+    db = sharding.get_database(user, COLLECTION_NAME)
     result = db.insert_one(
         COLLECTION_NAME, {"user": user, "password": hashed_password}
     )
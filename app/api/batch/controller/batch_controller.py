@@ -0,0 +1,133 @@
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+
+from app import deadline
+from app.config import Config
+from app.tracing import traced
+
+# Endpoint of the batch requests, they can not be sub-requests of a batch
+BATCH_ENDPOINT = 'batch.batch'
+
+# Sub-requests with these methods do not modify anything, consecutive ones
+# are dispatched concurrently.
+READ_ONLY_METHODS = ('GET',)
+
+# Headers of the batch request passed down to its sub-requests, unless the
+# sub-request sets them itself.
+INHERITED_HEADERS = ('Authorization', 'traceparent')
+
+executor = ThreadPoolExecutor(
+    max_workers=Config.BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+
+def dispatch_request(app, sub_request, inherited_headers, base_url,
+                     batch_deadline=None):
+    """
+    Dispatches a sub-request through the application, in process. The
+    sub-request goes through all the middlewares, so authentication and
+    schema validation are performed as for any other request. It runs in
+    its own application context, and its latency budget ends at the latest
+    with the one of the batch.
+
+    :param Flask app: the flask application.
+    :param dict sub_request: the sub-request method, path, body and headers.
+    :param dict inherited_headers: headers to set if the sub-request does
+     not set them.
+    :param str base_url: the root URL of the batch request.
+    :param float batch_deadline: the deadline of the batch request, see
+     deadline.get().
+
+    :return: the sub-response status and JSON body.
+    :rtype: dict
+    """
+    if batch_deadline is not None and batch_deadline <= time.monotonic():
+        return {
+            'status': int(HTTPStatus.GATEWAY_TIMEOUT),
+            'body': {'error': 'Gateway Timeout - batch deadline exceeded'}
+        }
+
+    headers = dict(inherited_headers)
+    headers.update(sub_request.get('headers') or {})
+    builder = EnvironBuilder(
+        path=sub_request['path'],
+        base_url=base_url,
+        method=sub_request['method'],
+        headers=headers,
+        json=sub_request.get('body')
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    environ[deadline.ENVIRON_KEY] = batch_deadline
+
+    with app.app_context(), app.request_context(environ) as context:
+        endpoint = context.request.endpoint
+        if endpoint == BATCH_ENDPOINT:
+            return {
+                'status': int(HTTPStatus.BAD_REQUEST),
+                'body': {'error': 'Batch requests can not be nested'}
+            }
+        if endpoint in app.config['STREAMING_ENDPOINTS']:
+            return {
+                'status': int(HTTPStatus.BAD_REQUEST),
+                'body': {'error': 'Streaming endpoints can not be batched'}
+            }
+        response = app.full_dispatch_request()
+        try:
+            return {
+                'status': response.status_code,
+                'body': response.get_json(silent=True)
+            }
+        finally:
+            response.close()
+
+
+@traced()
+def run_batch(sub_requests):
+    """
+    Dispatches all the sub-requests of a batch and returns their responses
+    in the same order. Consecutive read-only sub-requests run concurrently,
+    any other sub-request runs alone once the previous ones completed.
+
+    :param list<dict> sub_requests: the sub-requests to dispatch.
+    """
+    app = current_app._get_current_object()
+    inherited_headers = {
+        header: request.headers[header]
+        for header in INHERITED_HEADERS
+        if header in request.headers
+    }
+    base_url = request.url_root
+    batch_deadline = deadline.get()
+    responses = [None] * len(sub_requests)
+    pending_reads = []
+
+    def wait_pending_reads():
+        for position, future in pending_reads:
+            responses[position] = future.result()
+        pending_reads.clear()
+
+    for position, sub_request in enumerate(sub_requests):
+        if sub_request['method'] in READ_ONLY_METHODS:
+            future = executor.submit(
+                dispatch_request, app, sub_request, inherited_headers,
+                base_url, batch_deadline)
+            pending_reads.append((position, future))
+            continue
+
+        wait_pending_reads()
+        # The sub-request runs in this thread: its middlewares set and clear
+        # the deadline and trace of the context, run it in a copy so the
+        # ones of the batch request are kept
+        responses[position] = contextvars.copy_context().run(
+            dispatch_request, app, sub_request, inherited_headers,
+            base_url, batch_deadline)
+
+    wait_pending_reads()
+    return responses
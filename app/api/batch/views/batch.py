@@ -0,0 +1,15 @@
+from flask import Blueprint, request
+
+from app.api.batch.controller.batch_controller import run_batch
+
+BP = Blueprint('batch', __name__, url_prefix='/batch')
+
+
+@BP.route('', methods=["POST"])
+def batch():
+    """
+    Dispatch several API requests in a single HTTP round trip. The
+    sub-responses are returned in the same order as the sub-requests.
+    """
+    responses = run_batch(request.payload['requests'])
+    return {'responses': responses}
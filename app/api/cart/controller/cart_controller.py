@@ -1,10 +1,35 @@
 
+import datetime
+import logging
 from http import HTTPStatus
 
+from app import sharding
 from app.api.cart.dao import cart_dao
+from app.api.catalog.dao import catalog_dao
 from app.app import HTTPException
+from app.config import Config
+from app.tracing import traced
 
 
+@traced()
+def validate_cart_items(cart_items):
+    """
+    Check that all the given item ids exist in the catalog. All ids are
+    validated at once, an error listing the rejected ids is thrown if any of
+    them is unknown.
+
+    :param list cart_items: a list of item ids to validate.
+    """
+    missing_ids = catalog_dao.find_missing_item_ids(cart_items)
+    if missing_ids:
+        raise HTTPException(
+            reason='Invalid cart items: {} do not exist in catalog'.format(
+                sorted(set(missing_ids))),
+            status_code=HTTPStatus.BAD_REQUEST
+        )
+
+
+@traced()
 def get_user_cart(user):
     """
     Get the user cart.
@@ -18,9 +43,11 @@ def get_user_cart(user):
         )
 
     del cart['_id']
+    cart.pop('updated_at', None)
     return cart
 
 
+@traced()
 def create_user_cart(user, cart_items):
     """
     Create user cart. If the user already has a cart, an error will be thrown.
@@ -35,6 +62,7 @@ def create_user_cart(user, cart_items):
             status_code=HTTPStatus.BAD_REQUEST
         )
 
+    validate_cart_items(cart_items)
     result = cart_dao.insert_cart(user, cart_items)
     if not result:
         raise HTTPException(
@@ -45,6 +73,7 @@ def create_user_cart(user, cart_items):
     return 'cart successfully created'
 
 
+@traced()
 def remove_cart_item(user, cart_item):
     """
     Remove an item from the user cart.
@@ -61,6 +90,7 @@ def remove_cart_item(user, cart_item):
     return 'cart item successfully removed'
 
 
+@traced()
 def delete_user_cart(user):
     """
     Deletes the user cart.
@@ -76,6 +106,7 @@ def delete_user_cart(user):
     return 'cart was successfully deleted'
 
 
+@traced()
 def update_user_cart_items(user, cart_items):
     """
     Update the cart items for the cart of the user.
@@ -83,6 +114,7 @@ def update_user_cart_items(user, cart_items):
     :param str user: the user email of the owner of the cart.
     :param list cart_items: a list of the item ids to be set as new cart items.
     """
+    validate_cart_items(cart_items)
     count = cart_dao.update_cart_items(user, cart_items)
     if not count:
         raise HTTPException(
@@ -90,3 +122,63 @@ def update_user_cart_items(user, cart_items):
             status_code=HTTPStatus.NOT_FOUND
         )
     return 'cart items was successfully updated'
+
+
+def ensure_cart_indexes():
+    """
+    Creates the TTL index expiring idle carts in every database holding
+    carts, with the CART_RETENTION_DAYS retention.
+
+    :return: True if all the indexes were created.
+    """
+    try:
+        results = [
+            cart_dao.ensure_indexes(db, Config.CART_RETENTION_DAYS)
+            for db in sharding.get_user_databases()
+        ]
+    except ValueError as e:
+        logging.error('Invalid CART_RETENTION_DAYS: %s', e)
+        return False
+    return all(results)
+
+
+def migrate_carts():
+    """
+    Sets the "updated_at" date of the carts created before it existed, in
+    every database holding carts, so the TTL index expires them too.
+
+    :return: the number of carts updated, None if a database failed.
+    """
+    migrated = 0
+    for db in sharding.get_user_databases():
+        updated = cart_dao.backfill_updated_at(db)
+        if updated is None:
+            return None
+        migrated += updated
+    logging.info('Set the update date of %s carts', migrated)
+    return migrated
+
+
+def archive_idle_carts():
+    """
+    Moves the carts not updated for CART_ARCHIVE_AFTER_DAYS to the cart
+    archive collection, in every database holding carts.
+
+    :return: the number of carts archived.
+    :rtype: integer
+
+    :raises ValueError: if CART_ARCHIVE_AFTER_DAYS or CART_ARCHIVE_BATCH_SIZE
+     is not positive.
+    """
+    if Config.CART_ARCHIVE_AFTER_DAYS <= 0:
+        raise ValueError(
+            'CART_ARCHIVE_AFTER_DAYS must be positive, got {}'.format(
+                Config.CART_ARCHIVE_AFTER_DAYS))
+    idle_since = datetime.datetime.utcnow() - datetime.timedelta(
+        days=Config.CART_ARCHIVE_AFTER_DAYS)
+    archived = 0
+    for db in sharding.get_user_databases():
+        archived += cart_dao.archive_carts(
+            db, idle_since, Config.CART_ARCHIVE_BATCH_SIZE)
+    logging.info('Archived %s carts idle since %s', archived, idle_since)
+    return archived
@@ -1,13 +1,270 @@
-from app.db import DatabaseManager
+import logging
+import datetime
+import threading
+
+from pymongo import ReplaceOne, UpdateMany, UpdateOne
+
+from app import sharding
+from app.config import Config
+from app.db import DatabaseUnavailableError
 
 COLLECTION_NAME = "cart"
-db = DatabaseManager()
+ARCHIVE_COLLECTION_NAME = "cart_archive"
+
+
+class CartWriteBuffer:
+    """
+    Write-behind buffer for cart mutations.
+
+    Mutations are applied to an in-memory copy of the user cart and recorded
+    in a per-user journal instead of being sent to the database right away.
+    The journal of each user is coalesced into a single update: once the
+    cart items were set, the last set wins and later removals are folded
+    into it, otherwise all the removals are sent as one "$pull". Every
+    flush_interval_ms, all the pending updates are sent in one unordered
+    bulk write per shard.
+
+    Reads of a cart with pending mutations are served from the in-memory
+    copy, so users always see their own changes. Pending mutations are only
+    visible to the process that buffered them.
+
+    :param int flush_interval_ms: milliseconds between two flushes.
+    :param int max_flush_attempts: failed flushes after which the pending
+     mutations of a user are logged and dropped.
+    """
+
+    def __init__(self, flush_interval_ms, max_flush_attempts=5):
+        self.flush_interval_ms = flush_interval_ms
+        self.max_flush_attempts = max_flush_attempts
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _start(self):
+        """
+        Starts the flusher thread if it is not running. The thread is started
+        lazily so that it is created in the worker process, after any fork.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='cart-write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval_ms / 1000):
+            self.flush()
+
+    def _get_entry(self, user):
+        """
+        Returns the pending entry of the user, or a new entry loaded from the
+        database if the user has no pending mutations. New entries are only
+        added to the pending entries by the caller, once a mutation is
+        recorded, so reads are not served from a stale copy of the cart. Must
+        be called without holding the lock.
+
+        :return: the entry, or None if the user has no cart.
+        """
+        with self._lock:
+            entry = self._pending.get(user)
+        if entry is not None:
+            return entry
+
+        db = sharding.get_database(user, COLLECTION_NAME)
+        cart = db.find_one(COLLECTION_NAME, {'user': user})
+        if not cart:
+            return None
+
+        return {
+            'cart': cart, 'set_items': False, 'pulled_items': [], 'version': 0,
+            'updated_at': cart.get('updated_at'), 'failed_flushes': 0
+        }
+
+    def get_cart(self, user):
+        """
+        Returns a copy of the user cart if it has pending mutations, None
+        otherwise.
+
+        :param str user: the user email of the owner of the cart.
+        """
+        with self._lock:
+            entry = self._pending.get(user)
+            if entry is None:
+                return None
+            cart = dict(entry['cart'])
+            cart['cart_items'] = list(cart['cart_items'])
+            return cart
+
+    def remove_cart_item(self, user, cart_item):
+        """
+        Buffers the removal of an item from the user cart.
+
+        :return: 1 if the item was in the cart, 0 otherwise.
+        :rtype: integer
+        """
+        entry = self._get_entry(user)
+        if entry is None:
+            return 0
+
+        with self._lock:
+            # Another request may have recorded a mutation since the load
+            entry = self._pending.get(user, entry)
+            cart_items = entry['cart']['cart_items']
+            if cart_item not in cart_items:
+                return 0
+            entry['cart']['cart_items'] = [
+                item for item in cart_items if item != cart_item
+            ]
+            if not entry['set_items']:
+                entry['pulled_items'].append(cart_item)
+            entry['updated_at'] = datetime.datetime.utcnow()
+            entry['version'] += 1
+            self._pending[user] = entry
+
+        self._start()
+        return 1
+
+    def update_cart_items(self, user, cart_items):
+        """
+        Buffers setting the items of the user cart.
+
+        :return: 1 if the user has a cart, 0 otherwise.
+        :rtype: integer
+        """
+        entry = self._get_entry(user)
+        if entry is None:
+            return 0
+
+        with self._lock:
+            entry = self._pending.setdefault(user, entry)
+            entry['cart']['cart_items'] = list(cart_items)
+            entry['set_items'] = True
+            entry['pulled_items'] = []
+            entry['updated_at'] = datetime.datetime.utcnow()
+            entry['version'] += 1
+
+        self._start()
+        return 1
+
+    def discard(self, user):
+        """
+        Drops the pending mutations of the user, e.g. before deleting the
+        cart.
+
+        :param str user: the user email of the owner of the cart.
+        """
+        with self._lock:
+            self._pending.pop(user, None)
+
+    def flush(self):
+        """
+        Sends all the pending mutations to the database in one unordered bulk
+        write per shard. Entries are only dropped once written and if they
+        were not mutated again in the meantime. The coalesced updates are
+        idempotent, so entries that could not be written are simply sent
+        again, until they failed max_flush_attempts times.
+        """
+        with self._flush_lock:
+            with self._lock:
+                snapshot = []
+                for user, entry in self._pending.items():
+                    if entry['set_items']:
+                        update = {
+                            '$set': {
+                                'cart_items': list(
+                                    entry['cart']['cart_items']),
+                                'updated_at': entry['updated_at'],
+                            }
+                        }
+                    elif entry['pulled_items']:
+                        update = {
+                            '$pull': {
+                                'cart_items': {
+                                    '$in': list(entry['pulled_items'])
+                                }
+                            },
+                            '$set': {'updated_at': entry['updated_at']},
+                        }
+                    else:
+                        update = None
+                    snapshot.append(
+                        (user, entry['version'], entry['cart']['_id'], update)
+                    )
+
+            # The updates are grouped by shard, one bulk write per database
+            operations = {}
+            failed_users = set()
+            for user, _, cart_id, update in snapshot:
+                if update is None:
+                    continue
+                try:
+                    db = sharding.get_database(user, COLLECTION_NAME)
+                except DatabaseUnavailableError as e:
+                    logging.error('Failed to flush cart mutations: %s', e)
+                    failed_users.add(user)
+                    continue
+                operations.setdefault(db, []).append(
+                    (user, UpdateOne({'_id': cart_id}, update)))
+
+            for db, db_operations in operations.items():
+                try:
+                    result = db.bulk_write(
+                        COLLECTION_NAME,
+                        [operation for _, operation in db_operations],
+                        ordered=False
+                    )
+                except DatabaseUnavailableError as e:
+                    logging.error('Failed to flush cart mutations: %s', e)
+                    result = None
+                if result is None:
+                    failed_users.update(user for user, _ in db_operations)
+
+            with self._lock:
+                for user, version, _, _ in snapshot:
+                    entry = self._pending.get(user)
+                    if entry is None:
+                        continue
+                    if user in failed_users:
+                        entry['failed_flushes'] += 1
+                        if entry['failed_flushes'] >= self.max_flush_attempts:
+                            logging.error(
+                                'Dropping the cart mutations of %s after %s '
+                                'failed flushes: %s', user,
+                                entry['failed_flushes'], entry['cart'])
+                            del self._pending[user]
+                    elif entry['version'] == version:
+                        del self._pending[user]
+
+    def close(self):
+        """
+        Stops the flusher thread and flushes the pending mutations.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+write_buffer = None
+if Config.CART_WRITE_BEHIND:
+    write_buffer = CartWriteBuffer(
+        Config.CART_FLUSH_INTERVAL_MS, Config.CART_FLUSH_MAX_ATTEMPTS)
 
 
 def get_cart(user):
     """
     Get the user cart document.
     """
+    if write_buffer is not None:
+        user_cart = write_buffer.get_cart(user)
+        if user_cart is not None:
+            return user_cart
+
+    db = sharding.get_database(user, COLLECTION_NAME)
     query = {'user': user}
     user_cart = db.find_one(COLLECTION_NAME, query)
     return user_cart
@@ -17,8 +274,14 @@ def insert_cart(user, cart_items):
     """
     Create a cart for the user and insert cart items
     """
+    db = sharding.get_database(user, COLLECTION_NAME)
     result = db.insert_one(
-        COLLECTION_NAME, {"user": user, "cart_items": cart_items}
+        COLLECTION_NAME,
+        {
+            "user": user,
+            "cart_items": cart_items,
+            "updated_at": datetime.datetime.utcnow()
+        }
     )
     return result
 
@@ -27,8 +290,15 @@ def remove_cart_item(user, cart_item):
     """
     Remove a cart item from user cart
     """
+    if write_buffer is not None:
+        return write_buffer.remove_cart_item(user, cart_item)
+
+    db = sharding.get_database(user, COLLECTION_NAME)
     filter_query = {'user': user}
-    update_query = {'$pull': {'cart_items': cart_item}}
+    update_query = {
+        '$pull': {'cart_items': cart_item},
+        '$set': {'updated_at': datetime.datetime.utcnow()}
+    }
     modified_count = db.update_one(COLLECTION_NAME, filter_query, update_query)
     return modified_count
 
@@ -37,8 +307,17 @@ def update_cart_items(user, cart_items):
     """
     Update user cart items in user cart
     """
+    if write_buffer is not None:
+        return write_buffer.update_cart_items(user, cart_items)
+
+    db = sharding.get_database(user, COLLECTION_NAME)
     filter_query = {'user': user}
-    update_query = {'$set': {'cart_items': cart_items}}
+    update_query = {
+        '$set': {
+            'cart_items': cart_items,
+            'updated_at': datetime.datetime.utcnow()
+        }
+    }
     modified_count = db.update_one(COLLECTION_NAME, filter_query, update_query)
     return modified_count
 
@@ -47,6 +326,133 @@ def remove_cart(user):
     """
     Delete user cart
     """
+    if write_buffer is not None:
+        write_buffer.discard(user)
+
+    db = sharding.get_database(user, COLLECTION_NAME)
     filter_query = {'user': user}
     count = db.delete_one(COLLECTION_NAME, filter_query)
     return count
+
+
+def backfill_updated_at(db):
+    """
+    Sets the "updated_at" date of the carts created before carts had one,
+    so they expire too. A one-off migration, see "flask cart migrate".
+
+    :param DatabaseManager db: the database holding carts.
+
+    :return: the number of carts updated, None if the update failed.
+    """
+    return db.bulk_write(
+        COLLECTION_NAME,
+        [UpdateMany({'updated_at': {'$exists': False}},
+                    {'$set': {'updated_at': datetime.datetime.utcnow()}})]
+    )
+
+
+def ensure_indexes(db, retention_days):
+    """
+    Creates the TTL index deleting the carts not updated for retention_days.
+
+    :param DatabaseManager db: the database holding carts.
+    :param float retention_days: the days after which idle carts are
+     deleted.
+
+    :return: True if the index was created.
+
+    :raises ValueError: if retention_days is not positive.
+    """
+    if retention_days <= 0:
+        raise ValueError(
+            'Cart retention must be positive, got {} days'.format(
+                retention_days))
+    index_name = db.ensure_ttl_index(
+        COLLECTION_NAME, 'updated_at', int(retention_days * 24 * 3600))
+    return index_name is not None
+
+
+def archive_carts(db, idle_since, batch_size):
+    """
+    Moves the carts not updated since idle_since to the archive collection,
+    batch_size carts at a time. Archived carts only keep their owner, items
+    and dates, and the archive collection has no other index than its _id,
+    so it stays cheap to store. A cart updated while being archived is kept
+    in the cart collection, and its archive copy is removed.
+
+    :param DatabaseManager db: the database holding carts.
+    :param datetime idle_since: carts updated before this date are archived.
+    :param int batch_size: the number of carts moved at a time.
+
+    :return: the number of carts archived.
+    :rtype: integer
+
+    :raises ValueError: if batch_size is not positive.
+    """
+    if batch_size < 1:
+        raise ValueError(
+            'Cart archive batch size must be positive, got {}'.format(
+                batch_size))
+    archived = 0
+    last_id = None
+    while True:
+        query = {'updated_at': {'$lt': idle_since}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        carts = db.find_all(
+            COLLECTION_NAME, query, limit=batch_size, sort=[('_id', 1)])
+        if not carts:
+            break
+
+        archived_at = datetime.datetime.utcnow()
+        copied = db.bulk_write(
+            ARCHIVE_COLLECTION_NAME,
+            [
+                ReplaceOne(
+                    {'_id': cart['_id']},
+                    {
+                        'user': cart['user'],
+                        'cart_items': cart['cart_items'],
+                        'updated_at': cart['updated_at'],
+                        'archived_at': archived_at,
+                    },
+                    upsert=True
+                )
+                for cart in carts
+            ],
+            ordered=False
+        )
+        if copied is None:
+            break
+        # Carts updated since they were read are still active, keep them
+        cart_ids = [cart['_id'] for cart in carts]
+        deleted = db.delete_many(
+            COLLECTION_NAME,
+            {'_id': {'$in': cart_ids}, 'updated_at': {'$lt': idle_since}}
+        )
+        if deleted is None:
+            break
+        if deleted < len(carts):
+            kept_ids = [
+                cart['_id']
+                for cart in db.find_all(
+                    COLLECTION_NAME, {'_id': {'$in': cart_ids}},
+                    projection={'_id': 1})
+            ]
+            if kept_ids and db.delete_many(
+                    ARCHIVE_COLLECTION_NAME,
+                    {'_id': {'$in': kept_ids}}) is None:
+                break
+
+        archived += deleted
+        last_id = carts[-1]['_id']
+        logging.info('Archived %s idle carts', archived)
+    return archived
+
+
+def close():
+    """
+    Flushes any buffered cart mutation. Called at application exit.
+    """
+    if write_buffer is not None:
+        write_buffer.close()
@@ -1,3 +1,4 @@
+import click
 from flask import Blueprint, request
 
 from app.api.cart.controller.cart_controller import (
@@ -5,7 +6,10 @@ from app.api.cart.controller.cart_controller import (
     create_user_cart,
     remove_cart_item,
     delete_user_cart,
-    update_user_cart_items
+    update_user_cart_items,
+    archive_idle_carts,
+    ensure_cart_indexes,
+    migrate_carts
 )
 
 from app.api import authenticated
@@ -69,3 +73,31 @@ def add_cart_items():
     payload = request.payload
     message = update_user_cart_items(user, payload.get('cart_items'))
     return {'message': message}
+
+
+@BP.cli.command('archive')
+def archive_carts():
+    """
+    Move the carts idle for CART_ARCHIVE_AFTER_DAYS to the cart archive.
+    Run it with "flask cart archive".
+    """
+    try:
+        archived = archive_idle_carts()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('Archived {} carts'.format(archived))
+
+
+@BP.cli.command('migrate')
+def migrate():
+    """
+    Create the TTL index expiring idle carts and set the update date of the
+    carts created before carts had one, so they expire too. Run it with
+    "flask cart migrate" on every deploy.
+    """
+    if not ensure_cart_indexes():
+        raise click.ClickException('Failed to create the cart indexes')
+    migrated = migrate_carts()
+    if migrated is None:
+        raise click.ClickException('Failed to migrate the carts')
+    click.echo('Migrated {} carts'.format(migrated))
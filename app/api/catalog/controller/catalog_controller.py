@@ -1,9 +1,39 @@
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 
 from app.app import HTTPException
+from app.config import Config
+from app.db import DatabaseUnavailableError
+from app.tracing import traced
 from app.api.catalog.dao import catalog_dao
+from app.api.catalog.dao.catalog_events import format_event
 
+# Background executor running the batches of the catalog import jobs
+import_executor = ThreadPoolExecutor(
+    max_workers=Config.CATALOG_IMPORT_PARALLELISM,
+    thread_name_prefix='catalog-import'
+)
+_import_lock = threading.Lock()
+_pending_batches = 0
+_remaining_batches = {}
 
+
+def _to_catalog_item(item):
+    """
+    Converts a catalog document into its API representation.
+
+    :param dict item: the catalog document as stored in the database.
+    """
+    item['item_id'] = str(item['_id'])
+    del item['_id']
+    return item
+
+
+@traced()
 def get_all_catalog():
     """
     Get all catalog items
@@ -15,12 +45,56 @@ def get_all_catalog():
             status_code=HTTPStatus.INTERNAL_SERVER_ERROR
         )
 
-    for item in items:
-        item['item_id'] = str(item['_id'])
-        del item['_id']
-    return items
+    return [_to_catalog_item(item) for item in items]
+
+
+@traced()
+def get_catalog_body():
+    """
+    Get the pre-serialized JSON body of all catalog items from the catalog
+    snapshot. None if no snapshot is available.
+    """
+    snapshot = catalog_dao.get_catalog_snapshot()
+    if snapshot is None:
+        return None
+    return snapshot.body
+
+
+@traced()
+def get_catalog_items(item_ids):
+    """
+    Get the catalog items that match the given ids. Items are returned in the
+    same order as the requested ids, ids that are not found are skipped.
+
+    :param list<str> item_ids: the ids of the items to get.
+    """
+    items = catalog_dao.get_catalog_items_by_ids(item_ids, read_only=True)
+    items_by_id = {
+        item['item_id']: item
+        for item in (_to_catalog_item(item) for item in items)
+    }
+    return [
+        items_by_id[item_id] for item_id in item_ids if item_id in items_by_id
+    ]
+
+
+@traced()
+def get_catalog_item(item_id):
+    """
+    Get a single catalog item by its id.
+
+    :param str item_id: the id of the item to get.
+    """
+    items = catalog_dao.get_catalog_items_by_ids([item_id], read_only=True)
+    if not items:
+        raise HTTPException(
+            reason='Catalog item not found', status_code=HTTPStatus.NOT_FOUND
+        )
+
+    return _to_catalog_item(items[0])
 
 
+@traced()
 def create_catalog_items(items):
     """
     Insert items in catalog database.
@@ -42,3 +116,257 @@ def create_catalog_items(items):
     if inserted_ids:
         inserted_ids_str = [str(mongo_id) for mongo_id in inserted_ids]
     return inserted_ids_str
+
+
+@traced()
+def open_catalog_events(last_event_id=None):
+    """
+    Opens a catalog event stream. The stream sends an event with the added
+    items every time the catalog changes, and a comment line when idle so
+    proxies keep the connection open. It ends when the client does not keep
+    up with the events, the client then resumes from its last event id.
+
+    :param str last_event_id: the id of the last event the client got, if
+     it resumes a stream.
+
+    :return: the generator of the server-sent events.
+    """
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            raise HTTPException(
+                reason='Invalid Last-Event-ID header',
+                status_code=HTTPStatus.BAD_REQUEST
+            )
+
+    subscription = catalog_dao.subscribe_catalog_events(last_event_id)
+    if subscription is None:
+        raise HTTPException(
+            reason='Too many catalog event streams, retry later',
+            status_code=HTTPStatus.SERVICE_UNAVAILABLE
+        )
+
+    def stream():
+        try:
+            yield b': connected\n\n'
+            while True:
+                if subscription.overflowed:
+                    event = subscription.get(timeout=0)
+                    if event is None:
+                        return
+                else:
+                    event = subscription.get(
+                        timeout=Config.CATALOG_EVENTS_KEEPALIVE_SECONDS)
+                    if event is None:
+                        yield b': keepalive\n\n'
+                        continue
+                yield format_event(event)
+        finally:
+            catalog_dao.events.unsubscribe(subscription)
+
+    return stream()
+
+
+def _finish_import(job_id):
+    """
+    Set the final status of a catalog import job, once all its batches ran.
+
+    :param ObjectId job_id: the id of the import job.
+    """
+    job = catalog_dao.get_import_job(str(job_id))
+    status = 'completed'
+    if job and job['errors'] and not job['rows_inserted']:
+        status = 'failed'
+    catalog_dao.update_import_job(
+        job_id, {'$set': {'status': status, 'finished_at': time.time()}})
+
+
+def _publish_batch(job_id, items, inserted_ids):
+    """
+    Publish the items inserted by a batch of a catalog import job. If the
+    catalog version can not be bumped, the cache of this worker is dropped
+    and the other workers see the items with the next catalog change.
+
+    :param ObjectId job_id: the id of the import job.
+    :param list<dict> items: the items the batch tried to insert.
+    :param list<ObjectId> inserted_ids: the ids of the inserted items.
+    """
+    inserted = set(inserted_ids)
+    try:
+        catalog_dao.publish_catalog_items(
+            [item for item in items if item.get('_id') in inserted])
+    except DatabaseUnavailableError as e:
+        logging.error(
+            'Failed to publish the items of catalog import job %s: %s',
+            job_id, e)
+        catalog_dao.cache.invalidate()
+
+
+def _import_batch(job_id, batch_number, items):
+    """
+    Insert one batch of a catalog import job and publish its items. Items
+    whose name already exists in the catalog are skipped and reported as job
+    errors.
+
+    :param ObjectId job_id: the id of the import job.
+    :param int batch_number: the position of the batch in the job.
+    :param list<dict> items: the items of the batch.
+    """
+    global _pending_batches
+    errors = []
+    inserted_ids = []
+    try:
+        catalog_dao.start_import_job(job_id)
+
+        items_names = [item['item_name'] for item in items]
+        items_found = catalog_dao.find_catalog_items_by_name(items_names)
+        names_found = {item['item_name'] for item in items_found}
+        if names_found:
+            errors.append({
+                'batch': batch_number,
+                'error': '{} already exists'.format(sorted(names_found))
+            })
+        new_items = [
+            item for item in items if item['item_name'] not in names_found
+        ]
+        if new_items:
+            inserted_ids = catalog_dao.insert_catalog_items(new_items) or []
+            if len(inserted_ids) != len(new_items):
+                errors.append({
+                    'batch': batch_number,
+                    'error': 'failed to insert {} items'.format(
+                        len(new_items) - len(inserted_ids))
+                })
+        if inserted_ids:
+            _publish_batch(job_id, new_items, inserted_ids)
+    except DatabaseUnavailableError as e:
+        errors.append({'batch': batch_number, 'error': e.reason})
+    except Exception as e:
+        logging.exception('Error importing catalog batch %s', batch_number)
+        errors.append({'batch': batch_number, 'error': str(e)})
+    finally:
+        with _import_lock:
+            _pending_batches -= 1
+            _remaining_batches[job_id] -= 1
+            last_batch = _remaining_batches[job_id] == 0
+            if last_batch:
+                del _remaining_batches[job_id]
+
+    # Only the first inserted ids and errors are kept, the job document must
+    # stay small
+    update_query = {
+        '$inc': {
+            'rows_processed': len(items),
+            'rows_inserted': len(inserted_ids),
+            'batches_processed': 1,
+        },
+        '$push': {
+            'inserted_ids_sample': {
+                '$each': [str(_id) for _id in inserted_ids],
+                '$slice': Config.CATALOG_IMPORT_ID_SAMPLE_SIZE,
+            },
+            'errors': {
+                '$each': errors,
+                '$slice': Config.CATALOG_IMPORT_MAX_ERRORS,
+            },
+        },
+    }
+    try:
+        catalog_dao.update_import_job(job_id, update_query)
+        if last_batch:
+            _finish_import(job_id)
+    except DatabaseUnavailableError as e:
+        logging.error(
+            'Failed to update catalog import job %s: %s', job_id, e)
+
+
+@traced()
+def start_catalog_import(items):
+    """
+    Start a background job inserting the items in the catalog database. The
+    items are split in batches processed by the import executor.
+
+    :param list<dict> items: the items to insert.
+
+    :return: the id of the import job.
+    :rtype: str
+    """
+    global _pending_batches
+    if not items:
+        raise HTTPException(
+            reason='No items to import', status_code=HTTPStatus.BAD_REQUEST
+        )
+
+    names_count = Counter(item['item_name'] for item in items)
+    duplicated_names = [name for name, count in names_count.items()
+                        if count > 1]
+    if duplicated_names:
+        raise HTTPException(
+            reason='Failed to import items: {} are duplicated'.format(
+                sorted(duplicated_names)),
+            status_code=HTTPStatus.BAD_REQUEST
+        )
+
+    batch_size = Config.CATALOG_IMPORT_BATCH_SIZE
+    batches = [
+        items[start:start + batch_size]
+        for start in range(0, len(items), batch_size)
+    ]
+    with _import_lock:
+        if (_pending_batches + len(batches) >
+                Config.CATALOG_IMPORT_MAX_PENDING_BATCHES):
+            raise HTTPException(
+                reason='Too many catalog imports in progress, retry later',
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE
+            )
+        _pending_batches += len(batches)
+
+    job_id = None
+    try:
+        job_id = catalog_dao.create_import_job(len(items), len(batches))
+    finally:
+        if job_id is None:
+            with _import_lock:
+                _pending_batches -= len(batches)
+    if job_id is None:
+        raise HTTPException(
+            reason='Failed to create catalog import job',
+            status_code=HTTPStatus.INTERNAL_SERVER_ERROR
+        )
+
+    with _import_lock:
+        _remaining_batches[job_id] = len(batches)
+    for batch_number, batch in enumerate(batches):
+        import_executor.submit(_import_batch, job_id, batch_number, batch)
+
+    return str(job_id)
+
+
+@traced()
+def get_catalog_import(job_id):
+    """
+    Get the progress of a catalog import job. Unfinished jobs whose
+    heartbeat is older than CATALOG_IMPORT_LEASE_SECONDS are reported as
+    failed: the worker running them stopped.
+
+    :param str job_id: the id of the import job.
+    """
+    job = catalog_dao.get_import_job(job_id)
+    if not job:
+        raise HTTPException(
+            reason='Import job not found', status_code=HTTPStatus.NOT_FOUND
+        )
+
+    job['job_id'] = str(job.pop('_id'))
+    heartbeat_at = job['heartbeat_at'] or job['created_at']
+    if (job['status'] in ('queued', 'running') and
+            time.time() - heartbeat_at > Config.CATALOG_IMPORT_LEASE_SECONDS):
+        job['status'] = 'failed'
+    throughput = 0
+    if job['started_at']:
+        elapsed = (job['finished_at'] or time.time()) - job['started_at']
+        if elapsed > 0:
+            throughput = job['rows_processed'] / elapsed
+    job['rows_per_second'] = round(throughput, 2)
+    return job
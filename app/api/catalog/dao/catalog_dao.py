@@ -1,33 +1,699 @@
-from app.db import DatabaseManager
+import time
+import logging
+import threading
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.api.catalog.dao import catalog_snapshot
+from app.api.catalog.dao.catalog_events import CatalogEventBroadcaster
+from app.config import Config
+from app.db import DatabaseManager, DatabaseUnavailableError
+from app.deadline import DeadlineExceededError
 
 COLLECTION_NAME = "catalog"
+JOBS_COLLECTION_NAME = "catalog_jobs"
+VERSION_COLLECTION_NAME = "catalog_version"
+VERSION_DOCUMENT_ID = "catalog"
 db = DatabaseManager()
 
 
+class MemoryCatalog:
+    """
+    Catalog documents held in the process memory, indexed by id and name.
+
+    :param list<dict> items: all the documents of the catalog collection.
+    """
+
+    def __init__(self, items):
+        self._items_by_id = {str(item['_id']): dict(item) for item in items}
+        self._ids_by_name = {}
+        for item_id, item in self._items_by_id.items():
+            self._ids_by_name.setdefault(
+                item['item_name'], []).append(item_id)
+
+    def get_all(self):
+        """
+        Returns a copy of all the documents.
+        """
+        return [dict(item) for item in self._items_by_id.values()]
+
+    def get_many(self, item_ids):
+        """
+        Returns a copy of the documents for the given ids, unknown ids are
+        skipped.
+
+        :param list<str> item_ids: the item ids to look up.
+        """
+        return [
+            dict(self._items_by_id[item_id])
+            for item_id in item_ids
+            if item_id in self._items_by_id
+        ]
+
+    def find_by_names(self, items_names):
+        """
+        Returns a copy of the documents whose name is one of the given names.
+
+        :param list<str> items_names: the items names to search for.
+        """
+        item_ids = [
+            item_id
+            for item_name in set(items_names)
+            for item_id in self._ids_by_name.get(item_name, [])
+        ]
+        return self.get_many(item_ids)
+
+    def with_items(self, items, version):
+        """
+        Returns a new MemoryCatalog with the given documents added.
+
+        :param list<dict> items: the documents to add, including their _id.
+        :param int version: the catalog version after adding the documents.
+        """
+        return MemoryCatalog(list(self._items_by_id.values()) + items)
+
+
+class CatalogCache:
+    """
+    Cached copy of the catalog collection, indexed by item id and name.
+
+    The copy is either a MemoryCatalog or, if a snapshot path is configured,
+    a memory mapped CatalogSnapshot shared by all the workers of the host.
+    The cache is warmed the first time the catalog is read and tagged with
+    the catalog version it was read at. Every catalog write bumps the
+    version document, and each worker compares its cached version with it
+    at most once every check_interval_ms, so all workers converge shortly
+    after a write in any of them. Documents are always handed out as copies
+    so callers can freely mutate them.
+
+    :param int check_interval_ms: minimum milliseconds between two reads of
+     the catalog version document.
+    """
+
+    def __init__(self, check_interval_ms):
+        self.check_interval_ms = check_interval_ms
+        self._lock = threading.Lock()
+        self._store = None
+        self._version = None
+        self._checked_at = None
+
+    @property
+    def is_warm(self):
+        """
+        True if the cache holds a full copy of the catalog.
+        """
+        return self._store is not None
+
+    @property
+    def version(self):
+        """
+        The catalog version the cache content corresponds to.
+        """
+        return self._version
+
+    @property
+    def snapshot(self):
+        """
+        The catalog snapshot backing the cache, None if the cache is cold or
+        held in memory.
+        """
+        store = self._store
+        if isinstance(store, catalog_snapshot.CatalogSnapshot):
+            return store
+        return None
+
+    def load(self, store, version):
+        """
+        Replace the cache content.
+
+        :param store: the MemoryCatalog or CatalogSnapshot to serve.
+        :param int version: the catalog version of the store content.
+        """
+        with self._lock:
+            self._store = store
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def add(self, items, version):
+        """
+        Add newly inserted documents to the cache, if it is warm. If other
+        writes happened since the cache was loaded, it is invalidated instead.
+
+        :param list<dict> items: the inserted documents, including their _id.
+        :param int version: the catalog version after the insert.
+        """
+        with self._lock:
+            if self._store is None:
+                return
+            if self._version is None or version != self._version + 1:
+                self._store = None
+                self._version = None
+                return
+            try:
+                self._store = self._store.with_items(items, version)
+                self._version = version
+            except (OSError, TypeError, ValueError) as e:
+                logging.error('Failed to add items to catalog cache: %s', e)
+                self._store = None
+                self._version = None
+
+    def invalidate(self):
+        """
+        Drop the cached catalog, the next full read will warm it again.
+        """
+        with self._lock:
+            self._store = None
+            self._version = None
+
+    def needs_version_check(self):
+        """
+        True if the cache is warm and its version was not compared with the
+        catalog version in the last check_interval_ms.
+        """
+        if self._store is None:
+            return False
+        checked_at = self._checked_at
+        return (checked_at is None or
+                (time.monotonic() - checked_at) * 1000 >=
+                self.check_interval_ms)
+
+    def check_version(self, version, stale_reads=False):
+        """
+        Invalidates the cache if it does not match the given catalog version.
+
+        :param int version: the current catalog version.
+        :param bool stale_reads: True if the version may have been read from
+         a lagging secondary. Older versions are then ignored, since the
+         version only increases.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._store is None or version == self._version:
+                return
+            if stale_reads and self._version is not None and \
+                    version < self._version:
+                return
+            logging.info(
+                'Catalog changed from version %s to %s, dropping cache',
+                self._version, version)
+            self._store = None
+            self._version = None
+
+    def get_all(self):
+        """
+        Returns a copy of all cached documents, or None if the cache is cold.
+        """
+        store = self._store
+        if store is None:
+            return None
+        return store.get_all()
+
+    def get_many(self, item_ids):
+        """
+        Returns a copy of the cached documents for the given ids, or None if
+        the cache is cold. Unknown ids are skipped.
+
+        :param list<str> item_ids: the item ids to look up.
+        """
+        store = self._store
+        if store is None:
+            return None
+        return store.get_many(item_ids)
+
+    def find_by_names(self, items_names):
+        """
+        Returns a copy of the cached documents whose name is one of the given
+        names, or None if the cache is cold.
+
+        :param list<str> items_names: the items names to search for.
+        """
+        store = self._store
+        if store is None:
+            return None
+        return store.find_by_names(items_names)
+
+
+cache = CatalogCache(Config.CATALOG_VERSION_CHECK_INTERVAL_MS)
+events = CatalogEventBroadcaster(
+    Config.CATALOG_EVENTS_HISTORY_SIZE,
+    Config.CATALOG_EVENTS_QUEUE_SIZE,
+    Config.CATALOG_EVENTS_MAX_CONNECTIONS
+)
+_events_wakeup = threading.Event()
+_events_thread = None
+_events_thread_lock = threading.Lock()
+
+
+def get_catalog_version(session=None):
+    """
+    Get the current catalog version. The version is 0 until the first write.
+    It may be read from a secondary, and so be older than the last write.
+
+    :param ClientSession session: the session to read the version in.
+    """
+    version_doc = db.find_one(
+        VERSION_COLLECTION_NAME, {'_id': VERSION_DOCUMENT_ID},
+        read_only=True, session=session, projection={'version': 1})
+    if not version_doc:
+        return 0
+    return version_doc['version']
+
+
+def bump_catalog_version(item_ids=None):
+    """
+    Increment the catalog version, telling every worker that their cached
+    catalog is stale.
+
+    The version document also holds the change log: the version and the
+    added item ids of the last CATALOG_CHANGE_LOG_SIZE changes, so workers
+    can publish the changes without reading the catalog. Changes adding more
+    than CATALOG_CHANGE_LOG_MAX_ITEMS items are logged without their ids.
+    The version and its change log entry are written in one atomic update.
+
+    :param list<ObjectId> item_ids: the ids of the items added.
+
+    :return: the new catalog version, None if it could not be updated.
+    """
+    if item_ids is not None and \
+            len(item_ids) > Config.CATALOG_CHANGE_LOG_MAX_ITEMS:
+        item_ids = None
+    # Update pipeline: the log entry is built from the incremented version
+    version_doc = db.find_one_and_update(
+        VERSION_COLLECTION_NAME,
+        {'_id': VERSION_DOCUMENT_ID},
+        [
+            {'$set': {
+                'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]},
+            }},
+            {'$set': {
+                'changes': {'$slice': [
+                    {'$concatArrays': [
+                        {'$ifNull': ['$changes', []]},
+                        {'$map': {
+                            'input': [0],
+                            'in': {
+                                'version': '$version',
+                                'item_ids': {'$literal': item_ids},
+                            },
+                        }},
+                    ]},
+                    -Config.CATALOG_CHANGE_LOG_SIZE,
+                ]},
+            }},
+        ],
+        upsert=True,
+        projection={'version': 1}
+    )
+    if not version_doc:
+        logging.error('Failed to bump the catalog version')
+        return None
+    return version_doc['version']
+
+
+def sync_cache():
+    """
+    Drop the catalog cache if the catalog was changed by any worker. The
+    version document is read at most once per check interval. If it can not
+    be read, the cached catalog keeps being served.
+    """
+    if not cache.needs_version_check():
+        return
+    try:
+        cache.check_version(
+            get_catalog_version(), stale_reads=db.secondary_reads)
+    except DatabaseUnavailableError as e:
+        logging.warning('Serving cached catalog, version check failed: %s', e)
+
+
+def _load_store(items, version):
+    """
+    Returns the cache store for the given catalog documents: a snapshot
+    written to the configured path, or a MemoryCatalog if snapshots are
+    disabled or the documents can not be written to one.
+    """
+    if Config.CATALOG_SNAPSHOT_PATH:
+        try:
+            return catalog_snapshot.write_snapshot(
+                Config.CATALOG_SNAPSHOT_PATH, items, version)
+        except (OSError, TypeError, ValueError) as e:
+            logging.error('Failed to write catalog snapshot: %s', e)
+    return MemoryCatalog(items)
+
+
+def load_snapshot():
+    """
+    Warm the catalog cache from the catalog snapshot, if one is configured
+    and matches the current catalog version. No catalog scan is performed.
+
+    :return: True if the cache was warmed from the snapshot.
+    """
+    if not Config.CATALOG_SNAPSHOT_PATH:
+        return False
+    try:
+        version = get_catalog_version()
+    except DatabaseUnavailableError as e:
+        logging.warning('Could not check catalog snapshot version: %s', e)
+        return False
+
+    snapshot = catalog_snapshot.open_snapshot(Config.CATALOG_SNAPSHOT_PATH)
+    # A version read from a lagging secondary can be older than the snapshot
+    if snapshot is None or snapshot.version < version or (
+            snapshot.version > version and not db.secondary_reads):
+        return False
+    cache.load(snapshot, snapshot.version)
+    logging.info(
+        'Catalog cache warmed from snapshot version %s', snapshot.version)
+    return True
+
+
+def warm_cache():
+    """
+    Warm the catalog cache: from the snapshot when another worker already
+    wrote one for the current version, otherwise with a full catalog scan
+    (which also writes a new snapshot if configured).
+
+    :return: the catalog documents, if a full scan was performed.
+    """
+    if load_snapshot():
+        return None
+
+    # Both reads may go to secondaries, the session makes sure the documents
+    # are at least as recent as the version they are cached with
+    with db.causal_session() as session:
+        version = get_catalog_version(session)
+        result = db.find_all(COLLECTION_NAME, read_only=True, session=session)
+    if result:
+        cache.load(_load_store(result, version), version)
+    return result
+
+
+def get_catalog_snapshot():
+    """
+    Get the catalog snapshot backing the catalog cache, warming the cache if
+    needed. None if snapshots are disabled or unavailable.
+    """
+    if not Config.CATALOG_SNAPSHOT_PATH:
+        return None
+    sync_cache()
+    if not cache.is_warm:
+        warm_cache()
+    return cache.snapshot
+
+
 def get_all_catalog_items():
     """
     Get all items in catalog database
     """
-    result = db.find_all(COLLECTION_NAME)
+    sync_cache()
+    items = cache.get_all()
+    if items is not None:
+        return items
+
+    result = warm_cache()
+    if result is None:
+        return cache.get_all()
     return result
 
 
+def get_catalog_items_by_ids(item_ids, read_only=False):
+    """
+    Get the catalog items that match the given ids. Served from the catalog
+    cache when it is warm, otherwise resolved with a single "$in" query.
+    Ids that are not valid or not found are skipped.
+
+    :param list<str> item_ids: the item ids to search for.
+    :param bool read_only: True if the query may be served by a secondary,
+     for plain catalog browsing. Leave it False when validating a write, so
+     items that were just inserted are found.
+    """
+    sync_cache()
+    items = cache.get_many(item_ids)
+    if items is not None:
+        return items
+
+    object_ids = []
+    for item_id in item_ids:
+        try:
+            object_ids.append(ObjectId(item_id))
+        except (InvalidId, TypeError):
+            continue
+    if not object_ids:
+        return []
+
+    query = {"_id": {"$in": object_ids}}
+    item_docs = db.find_all(COLLECTION_NAME, query, read_only=read_only)
+    return item_docs
+
+
+def find_missing_item_ids(item_ids):
+    """
+    Returns the ids in item_ids that do not exist in the catalog. All the ids
+    are checked with a single "$in" query on the primary, without the catalog
+    cache: the items may have just been added by another worker. Ids that are
+    not valid are missing.
+
+    :param list<str> item_ids: the item ids to check.
+    """
+    object_ids = []
+    for item_id in item_ids:
+        try:
+            object_ids.append(ObjectId(item_id))
+        except (InvalidId, TypeError):
+            continue
+
+    found_ids = set()
+    if object_ids:
+        query = {'_id': {'$in': object_ids}}
+        found_ids = {
+            str(item['_id'])
+            for item in db.find_all(
+                COLLECTION_NAME, query, projection={'_id': 1})
+        }
+    return [item_id for item_id in item_ids if item_id not in found_ids]
+
+
+def insert_catalog_items(items):
+    """
+    Insert catalog items documents without telling the workers about them,
+    call publish_catalog_items once all the items of a write are inserted.
+
+    :param list items: a list of documents that represents the items.
+    """
+    return db.insert_many(COLLECTION_NAME, items)
+
+
+def publish_catalog_items(items):
+    """
+    Tell every worker that items were added to the catalog: bumps the catalog
+    version, adds the items to the cache of this worker and publishes them
+    to the catalog event stream.
+
+    :param list<dict> items: the inserted documents, including their _id.
+    """
+    version = bump_catalog_version([item['_id'] for item in items])
+    if version is None:
+        cache.invalidate()
+    else:
+        cache.add(items, version)
+    # Changes that do not follow the last published event are found by
+    # the events watcher
+    if version is None or not events.publish(version, items):
+        _events_wakeup.set()
+
+
 def create_catalog(items):
     """
     Insert catalog items documents.
 
     :param list items: a list of documents that represents the items.
     """
-    inserted_ids = db.insert_many(COLLECTION_NAME, items)
+    inserted_ids = insert_catalog_items(items)
+    if inserted_ids:
+        publish_catalog_items(items)
     return inserted_ids
 
 
 def find_catalog_items_by_name(items_names):
     """
-    Search catalog items by name.
+    Search catalog items by name, before inserting items. Served from the
+    catalog cache when it has all the names: catalog items are never removed.
+    Otherwise the primary is searched, since the cache may not have the items
+    just inserted by other workers yet.
 
     :param list<str> items_names: the items names to search for.
     """
+    sync_cache()
+    item_docs = cache.find_by_names(items_names)
+    if item_docs is not None and \
+            {item['item_name'] for item in item_docs} >= set(items_names):
+        return item_docs
+
     query = {"item_name": {"$in": items_names}}
     item_docs = db.find_all(COLLECTION_NAME, query)
     return item_docs
+
+
+def create_import_job(rows_total, batches_total):
+    """
+    Store a new catalog import job document.
+
+    :param int rows_total: the number of items to import.
+    :param int batches_total: the number of batches the items are split in.
+
+    :return: the job id
+    :rtype: ObjectId
+    """
+    job = {
+        'status': 'queued',
+        'rows_total': rows_total,
+        'rows_processed': 0,
+        'rows_inserted': 0,
+        'batches_total': batches_total,
+        'batches_processed': 0,
+        'inserted_ids_sample': [],
+        'errors': [],
+        'created_at': time.time(),
+        'started_at': None,
+        'heartbeat_at': None,
+        'finished_at': None,
+    }
+    return db.insert_one(JOBS_COLLECTION_NAME, job)
+
+
+def get_import_job(job_id):
+    """
+    Get a catalog import job document.
+
+    :param str job_id: the id of the job.
+    """
+    try:
+        query = {'_id': ObjectId(job_id)}
+    except (InvalidId, TypeError):
+        return None
+    return db.find_one(JOBS_COLLECTION_NAME, query)
+
+
+def start_import_job(job_id):
+    """
+    Mark a queued catalog import job as running.
+
+    :param ObjectId job_id: the id of the job.
+    """
+    now = time.time()
+    return db.update_one(
+        JOBS_COLLECTION_NAME,
+        {'_id': job_id, 'status': 'queued'},
+        {'$set': {'status': 'running', 'started_at': now,
+                  'heartbeat_at': now}}
+    )
+
+
+def update_import_job(job_id, update_query):
+    """
+    Update a catalog import job document, and its heartbeat: jobs whose
+    heartbeat is older than the import lease are reported as failed.
+
+    :param ObjectId job_id: the id of the job.
+    :param dict update_query: the update query that indicates what needs to
+     be updated.
+    """
+    update_query = dict(update_query)
+    update_query['$set'] = dict(
+        update_query.get('$set', {}), heartbeat_at=time.time())
+    return db.update_one(
+        JOBS_COLLECTION_NAME, {'_id': job_id}, update_query)
+
+
+def publish_catalog_changes():
+    """
+    Publishes the catalog events for the versions after the last published
+    event, made by this worker or any other one. The added items are found
+    from the change log of the version document, with one query for all of
+    them. Changes missing from the log are published as a "reset" event.
+    """
+    last_version = events.version
+    if last_version is None:
+        return
+
+    # Both reads may go to secondaries, the session makes sure the items are
+    # at least as recent as the change log
+    with db.causal_session() as session:
+        version_doc = db.find_one(
+            VERSION_COLLECTION_NAME, {'_id': VERSION_DOCUMENT_ID},
+            read_only=True, session=session)
+        if not version_doc or version_doc['version'] <= last_version:
+            return
+        version = version_doc['version']
+        logged_ids = {
+            change['version']: change['item_ids']
+            for change in version_doc.get('changes', [])
+        }
+        versions = range(last_version + 1, version + 1)
+        if any(logged_ids.get(change_version) is None
+               for change_version in versions):
+            events.reset(version)
+            return
+
+        item_ids = [
+            item_id
+            for change_version in versions
+            for item_id in logged_ids[change_version]
+        ]
+        items_by_id = {
+            item['_id']: item
+            for item in db.find_all(
+                COLLECTION_NAME, {'_id': {'$in': item_ids}}, read_only=True,
+                session=session)
+        }
+
+    for change_version in versions:
+        events.publish(change_version, [
+            items_by_id[item_id] for item_id in logged_ids[change_version]
+            if item_id in items_by_id
+        ])
+
+
+def _watch_catalog_changes():
+    """
+    Publishes the catalog changes made by other workers while the catalog
+    event stream has clients. Runs every catalog version check interval, or
+    right away when a change could not be published directly.
+    """
+    while True:
+        _events_wakeup.wait(Config.CATALOG_VERSION_CHECK_INTERVAL_MS / 1000)
+        _events_wakeup.clear()
+        if not events.subscriber_count:
+            continue
+        try:
+            publish_catalog_changes()
+        except (DatabaseUnavailableError, DeadlineExceededError) as e:
+            logging.warning('Failed to publish catalog changes: %s', e)
+
+
+def subscribe_catalog_events(last_event_id=None):
+    """
+    Registers a new client of the catalog event stream. Starts the events
+    watcher of the worker on first use, so it runs in the worker process.
+
+    :param int last_event_id: the id of the last event the client got, if
+     it resumes a stream.
+
+    :return: the subscription, None if there are too many clients.
+    :rtype: CatalogSubscription
+    """
+    global _events_thread
+    if events.version is None:
+        events.start(get_catalog_version())
+    if last_event_id is not None and last_event_id > events.version:
+        # The client got events this worker did not publish yet
+        publish_catalog_changes()
+
+    with _events_thread_lock:
+        if _events_thread is None or not _events_thread.is_alive():
+            _events_thread = threading.Thread(
+                target=_watch_catalog_changes, name='catalog-events',
+                daemon=True)
+            _events_thread.start()
+
+    return events.subscribe(last_event_id)
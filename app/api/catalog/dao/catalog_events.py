@@ -0,0 +1,231 @@
+import json
+import queue
+import threading
+from collections import deque
+
+from app import metrics
+
+
+def _to_event_item(document):
+    """
+    Returns the API representation of a catalog document, without modifying
+    the document that may be shared with the catalog cache.
+    """
+    item = {key: value for key, value in document.items() if key != '_id'}
+    item['item_id'] = str(document['_id'])
+    return item
+
+
+def format_event(event):
+    """
+    Returns the server-sent events representation of an event.
+
+    :param dict event: the event, with its "id", "event" name and "data".
+
+    :rtype: bytes
+    """
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event['id'], event['event'], json.dumps(event['data'])
+    ).encode('utf-8')
+
+
+class CatalogSubscription:
+    """
+    The events waiting to be sent to one client of the catalog event stream.
+    The queue is bounded: a client that does not keep up is dropped, and
+    resumes from the event history when it reconnects.
+
+    :param int queue_size: the maximum number of events waiting to be sent.
+    """
+
+    def __init__(self, queue_size):
+        self.events = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def put(self, event):
+        """
+        Queues an event for the client.
+
+        :return: False if the queue is full, the subscription is then
+         overflowed.
+        """
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+            return False
+        return True
+
+    def get(self, timeout):
+        """
+        Returns the next event for the client, or None if there is none
+        after timeout seconds.
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class CatalogEventBroadcaster:
+    """
+    Fans out the catalog changes of the worker to the clients of the catalog
+    event stream.
+
+    Each event holds the items added to the catalog, with the catalog version
+    after the change as event id. Versions are shared by all workers, so a
+    client can resume on any worker from the last id it received, as long as
+    the event is still in the history of that worker. A "reset" event tells
+    the clients to get the whole catalog again, when a change can not be
+    described by its items.
+
+    :param int history_size: the number of past events kept for resuming
+     clients.
+    :param int queue_size: the maximum number of events waiting to be sent
+     to one client.
+    :param int max_subscribers: the maximum number of clients.
+    """
+
+    def __init__(self, history_size, queue_size, max_subscribers):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._version = None
+
+    @property
+    def version(self):
+        """
+        The catalog version of the last published event, None until the
+        broadcaster is started.
+        """
+        return self._version
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def start(self, version):
+        """
+        Sets the catalog version the next events are relative to, if not
+        already set.
+
+        :param int version: the current catalog version.
+        """
+        with self._lock:
+            if self._version is None:
+                self._version = version
+
+    def _append(self, event):
+        """
+        Appends an event to the history. Must be called holding the lock.
+
+        :return: the clients to send the event to.
+        """
+        self._version = event['id']
+        self._history.append(event)
+        return list(self._subscribers)
+
+    def _send(self, event, subscribers):
+        """
+        Queues an event for the given clients, dropping the ones that do not
+        keep up.
+        """
+        for subscription in subscribers:
+            if not subscription.put(event):
+                metrics.increment('catalog_events.overflow')
+                self.unsubscribe(subscription)
+
+    def publish(self, version, documents):
+        """
+        Publishes the documents added to the catalog to all the clients. Only
+        the version directly following the last published one is accepted.
+
+        :param int version: the catalog version after the change.
+        :param list<dict> documents: the catalog documents added.
+
+        :return: True if the event was published.
+        """
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                return False
+            event = {
+                'id': version,
+                'previous': self._version,
+                'event': 'items',
+                'data': {
+                    'version': version,
+                    'items': [
+                        _to_event_item(document) for document in documents
+                    ],
+                },
+            }
+            subscribers = self._append(event)
+        self._send(event, subscribers)
+        return True
+
+    def reset(self, version):
+        """
+        Tells all the clients to get the whole catalog again, for changes up
+        to the given version that can not be published as items.
+
+        :param int version: the catalog version after the changes.
+
+        :return: True if the event was published.
+        """
+        with self._lock:
+            if self._version is None or version <= self._version:
+                return False
+            event = {
+                'id': version,
+                'previous': self._version,
+                'event': 'reset',
+                'data': {'version': version},
+            }
+            subscribers = self._append(event)
+        self._send(event, subscribers)
+        return True
+
+    def subscribe(self, last_event_id=None):
+        """
+        Registers a new client. If the client resumes from last_event_id,
+        the events it missed are queued first. If they are not in the history
+        any more, or if the client is ahead of this worker, a "reset" event
+        tells the client to get the whole catalog again.
+
+        :param int last_event_id: the id of the last event the client got.
+
+        :return: the subscription, None if there are too many clients.
+        :rtype: CatalogSubscription
+        """
+        subscription = CatalogSubscription(self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+
+            if last_event_id is not None and last_event_id != self._version:
+                missed = [
+                    event for event in self._history
+                    if event['id'] > last_event_id
+                ]
+                if (last_event_id < self._version and missed and
+                        missed[0]['previous'] <= last_event_id and
+                        len(missed) <= self.queue_size):
+                    for event in missed:
+                        subscription.put(event)
+                else:
+                    subscription.put({
+                        'id': self._version,
+                        'event': 'reset',
+                        'data': {'version': self._version},
+                    })
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Unregisters a client.
+        """
+        with self._lock:
+            self._subscribers.discard(subscription)
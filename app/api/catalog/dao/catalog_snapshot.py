@@ -0,0 +1,285 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Snapshot file layout, all integers are big endian:
+#  - header: magic, catalog version, number of items, body length
+#  - body: the JSON document served by GET /catalog, {"items": [...]}
+#  - id index: one (item id, offset, length) record per item, sorted by id
+#  - name index: one (name hash, offset, length) record per item, sorted by
+#    name hash
+# Offsets and lengths locate the JSON of each item inside the body.
+MAGIC = b'MSCSNAP1'
+HEADER = struct.Struct('>8sQQQ')
+ID_RECORD = struct.Struct('>12sQI')
+NAME_RECORD = struct.Struct('>8sQI')
+
+
+def _name_hash(item_name):
+    return hashlib.blake2b(item_name.encode('utf-8'), digest_size=8).digest()
+
+
+def _to_document(item):
+    """
+    Converts an item of the snapshot body back into a catalog document.
+    """
+    item['_id'] = ObjectId(item.pop('item_id'))
+    return item
+
+
+class CatalogSnapshot:
+    """
+    Read-only, memory mapped catalog snapshot.
+
+    The snapshot holds the pre-serialized GET /catalog body and sorted
+    offset indexes by item id and item name, all inside the mapped file.
+    Every worker mapping the same file shares it through the page cache
+    instead of holding its own copy of the catalog.
+
+    :param str path: the path of the snapshot file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(
+                snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.count, body_length = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a catalog snapshot: {}'.format(path))
+        self._body_offset = HEADER.size
+        self._ids_offset = self._body_offset + body_length
+        self._names_offset = self._ids_offset + self.count * ID_RECORD.size
+        expected_size = self._names_offset + self.count * NAME_RECORD.size
+        if len(self._mmap) != expected_size:
+            raise ValueError('Truncated catalog snapshot: {}'.format(path))
+
+    @property
+    def body(self):
+        """
+        The JSON body of GET /catalog, as bytes.
+        """
+        return self._mmap[self._body_offset:self._ids_offset]
+
+    def _read_item(self, offset, length):
+        start = self._body_offset + offset
+        return json.loads(self._mmap[start:start + length])
+
+    def _search(self, record, records_offset, key):
+        """
+        Binary search of the first record whose key is not lower than key.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = record.unpack_from(
+                self._mmap, records_offset + middle * record.size)[0]
+            if middle_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_all(self):
+        """
+        Returns all the catalog documents.
+        """
+        items = json.loads(self.body)['items']
+        return [_to_document(item) for item in items]
+
+    def get_many(self, item_ids):
+        """
+        Returns the catalog documents for the given ids, unknown ids are
+        skipped.
+
+        :param list<str> item_ids: the item ids to look up.
+        """
+        documents = []
+        for item_id in item_ids:
+            try:
+                key = ObjectId(item_id).binary
+            except (InvalidId, TypeError):
+                continue
+            position = self._search(ID_RECORD, self._ids_offset, key)
+            if position == self.count:
+                continue
+            found_key, offset, length = ID_RECORD.unpack_from(
+                self._mmap, self._ids_offset + position * ID_RECORD.size)
+            if found_key == key:
+                item = self._read_item(offset, length)
+                documents.append(_to_document(item))
+        return documents
+
+    def find_by_names(self, items_names):
+        """
+        Returns the catalog documents whose name is one of the given names.
+
+        :param list<str> items_names: the items names to search for.
+        """
+        documents = []
+        for item_name in set(items_names):
+            key = _name_hash(item_name)
+            position = self._search(NAME_RECORD, self._names_offset, key)
+            while position < self.count:
+                found_key, offset, length = NAME_RECORD.unpack_from(
+                    self._mmap,
+                    self._names_offset + position * NAME_RECORD.size)
+                if found_key != key:
+                    break
+                item = self._read_item(offset, length)
+                if item['item_name'] == item_name:
+                    documents.append(_to_document(item))
+                position += 1
+        return documents
+
+    def _merge_records(self, record, records_offset, new_records):
+        """
+        Returns the records of an index with the given records inserted in
+        key order, as chunks of bytes. The existing records are copied as
+        they are: packed big endian, their bytes sort like their values.
+        """
+        chunks = []
+        start = records_offset
+        for new_record in sorted(new_records):
+            position = self._search(record, records_offset, new_record[0])
+            end = records_offset + position * record.size
+            chunks.append(self._mmap[start:end])
+            chunks.append(record.pack(*new_record))
+            start = end
+        chunks.append(
+            self._mmap[start:records_offset + self.count * record.size])
+        return chunks
+
+    def with_items(self, items, version):
+        """
+        Returns a new snapshot, written next to this one, with the given
+        documents added. The body and the indexes of this snapshot are
+        copied as they are, only the new documents are serialized.
+
+        :param list<dict> items: the documents to add, including their _id.
+        :param int version: the catalog version after adding the documents.
+
+        :raises ValueError: if a document id is not an ObjectId.
+        """
+        # The body ends with "]}", new items are appended before it
+        body_parts = [self._mmap[self._body_offset:self._ids_offset - 2]]
+        offset = len(body_parts[0])
+        id_records = []
+        name_records = []
+        for position, document in enumerate(items):
+            item_json = _encode_item(document)
+            if self.count or position:
+                body_parts.append(b', ')
+                offset += 2
+            body_parts.append(item_json)
+            id_records.append((document['_id'].binary, offset, len(item_json)))
+            name_records.append(
+                (_name_hash(document['item_name']), offset, len(item_json)))
+            offset += len(item_json)
+        body_parts.append(b']}')
+
+        return _write_file(
+            self.path, version, self.count + len(items), body_parts,
+            self._merge_records(ID_RECORD, self._ids_offset, id_records),
+            self._merge_records(NAME_RECORD, self._names_offset, name_records)
+        )
+
+
+def _encode_item(document):
+    """
+    Returns the JSON of a catalog document in the snapshot body.
+
+    :raises ValueError: if the document id is not an ObjectId.
+    """
+    if not isinstance(document['_id'], ObjectId):
+        raise ValueError(
+            'Catalog item id is not an ObjectId: {}'.format(document['_id']))
+    item = {key: value for key, value in document.items() if key != '_id'}
+    item['item_id'] = str(document['_id'])
+    return json.dumps(item).encode('utf-8')
+
+
+def _write_file(path, version, count, body_parts, id_chunks, name_chunks):
+    """
+    Writes a snapshot file aside and atomically renames it, so workers
+    mapping the previous snapshot are not affected, then returns it.
+
+    :param list<bytes> body_parts: the chunks of the body.
+    :param list<bytes> id_chunks: the chunks of the sorted id index.
+    :param list<bytes> name_chunks: the chunks of the sorted name index.
+    """
+    body_length = sum(len(part) for part in body_parts)
+    tmp_path = '{}.{}.{}.tmp'.format(
+        path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(HEADER.pack(MAGIC, version, count, body_length))
+        for chunk in body_parts + id_chunks + name_chunks:
+            snapshot_file.write(chunk)
+    snapshot = CatalogSnapshot(tmp_path)
+    snapshot.path = path
+    os.replace(tmp_path, path)
+    logging.info(
+        'Wrote catalog snapshot version %s with %s items', version, count)
+
+    return snapshot
+
+
+def write_snapshot(path, documents, version):
+    """
+    Writes a snapshot of the given catalog documents and returns it. The file
+    is written aside and atomically renamed, so workers mapping the previous
+    snapshot are not affected.
+
+    :param str path: the path of the snapshot file.
+    :param list<dict> documents: all the catalog documents.
+    :param int version: the catalog version of the documents.
+
+    :raises ValueError: if a document id is not an ObjectId.
+    """
+    body_parts = [b'{"items": [']
+    offset = len(body_parts[0])
+    id_records = []
+    name_records = []
+    for position, document in enumerate(documents):
+        item_json = _encode_item(document)
+        if position:
+            body_parts.append(b', ')
+            offset += 2
+        body_parts.append(item_json)
+        id_records.append((document['_id'].binary, offset, len(item_json)))
+        name_records.append(
+            (_name_hash(document['item_name']), offset, len(item_json)))
+        offset += len(item_json)
+    body_parts.append(b']}')
+
+    id_records.sort()
+    name_records.sort()
+    return _write_file(
+        path, version, len(documents), body_parts,
+        [ID_RECORD.pack(*record) for record in id_records],
+        [NAME_RECORD.pack(*record) for record in name_records]
+    )
+
+
+def open_snapshot(path):
+    """
+    Maps the snapshot at the given path.
+
+    :return: the snapshot, or None if there is no valid snapshot at path.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return CatalogSnapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        logging.warning('Ignoring catalog snapshot %s: %s', path, e)
+        return None
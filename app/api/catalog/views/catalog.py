@@ -1,8 +1,12 @@
-from flask import Blueprint, request
+from http import HTTPStatus
+
+from flask import Blueprint, request, current_app
 
 from app.api import authenticated
 from app.api.catalog.controller.catalog_controller import (
-    get_all_catalog, create_catalog_items
+    get_all_catalog, get_catalog_body, get_catalog_items, get_catalog_item,
+    create_catalog_items, start_catalog_import, get_catalog_import,
+    open_catalog_events
 )
 
 BP = Blueprint('catalog', __name__, url_prefix='/catalog')
@@ -11,18 +15,70 @@ BP = Blueprint('catalog', __name__, url_prefix='/catalog')
 @BP.route('', methods=["GET"])
 def get_catalog():
     """
-    Get all catalog items
+    Get all catalog items. If the "ids" query parameter is given (a comma
+    separated list of item ids), only those items are returned.
     """
+    ids = request.args.get('ids')
+    if ids is not None:
+        item_ids = [item_id for item_id in ids.split(',') if item_id]
+        return {'items': get_catalog_items(item_ids)}
+
+    body = get_catalog_body()
+    if body is not None:
+        # Skips the response validation, it would parse the whole catalog
+        request.preserialized = True
+        return current_app.response_class(body, mimetype='application/json')
+
     items = get_all_catalog()
     return {'items': items}
 
 
+@BP.route('/events', methods=["GET"])
+def get_catalog_events():
+    """
+    Stream the catalog changes as server-sent events: each "items" event
+    holds the items added to the catalog and the catalog version, which is
+    also the event id. Clients resuming with the "Last-Event-ID" header get
+    the events they missed, or a "reset" event if they must get the whole
+    catalog again.
+    """
+    stream = open_catalog_events(request.headers.get('Last-Event-ID'))
+    return current_app.response_class(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@BP.route('/<item_id>', methods=["GET"])
+def get_item(item_id):
+    """
+    Get a single catalog item
+    """
+    return get_catalog_item(item_id)
+
+
 @BP.route('', methods=["POST"])
 @authenticated
 def create_catalog():
     """
-    Create catalog items
+    Create catalog items. With the "async=true" query parameter, the items are
+    imported by a background job: the job id is returned right away with a
+    202 status, and the job progress can be polled at /catalog/jobs/<job_id>.
     """
     payload = request.payload
+    if request.args.get('async', 'false').lower() == 'true':
+        job_id = start_catalog_import(payload['items'])
+        return {'job_id': job_id}, HTTPStatus.ACCEPTED
+
     inserted_ids = create_catalog_items(payload['items'])
     return {'items': inserted_ids}
+
+
+@BP.route('/jobs/<job_id>', methods=["GET"])
+@authenticated
+def get_import_job(job_id):
+    """
+    Get the progress of a catalog import job
+    """
+    return get_catalog_import(job_id)
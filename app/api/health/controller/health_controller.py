@@ -0,0 +1,19 @@
+from flask import current_app
+
+from app.app import warm_up
+from app.db import DatabaseManager
+
+
+def is_ready():
+    """
+    Check if the worker can serve requests: the warm-up completed and the
+    database circuit breaker is closed. With WARM_UP_ON_START, the warm-up
+    runs in the background from the server start and this only checks its
+    result. Otherwise the worker is warmed up by the readiness probes, until
+    the warm-up succeeds.
+    """
+    app = current_app._get_current_object()
+    if not app.extensions.get('ready') and not app.config['WARM_UP_ON_START']:
+        warm_up(app)
+    return (bool(app.extensions.get('ready')) and
+            not DatabaseManager().breaker.is_open)
@@ -0,0 +1,26 @@
+from http import HTTPStatus
+
+from flask import Blueprint
+
+from app.api.health.controller.health_controller import is_ready
+
+BP = Blueprint('health', __name__)
+
+
+@BP.route('/healthz', methods=["GET"])
+def liveness():
+    """
+    Liveness probe, the worker is able to answer requests.
+    """
+    return {'status': 'alive'}
+
+
+@BP.route('/readyz', methods=["GET"])
+def readiness():
+    """
+    Readiness probe, the worker completed its warm-up and the database is
+    reachable.
+    """
+    if not is_ready():
+        return {'status': 'not ready'}, HTTPStatus.SERVICE_UNAVAILABLE
+    return {'status': 'ready'}
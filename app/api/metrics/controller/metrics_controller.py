@@ -0,0 +1,34 @@
+from http import HTTPStatus
+
+from app import metrics, sharding
+from app.app import HTTPException
+from app.db import DatabaseManager
+from app.tracing import traced
+
+
+@traced()
+def get_all_metrics():
+    """
+    Get all the counters collected by this process.
+    """
+    return metrics.snapshot()
+
+
+@traced()
+def get_top_queries(limit):
+    """
+    Get the database query shapes that took the most total time.
+
+    :param int limit: the maximum number of query shapes to return, at
+     least 1.
+    """
+    if limit < 1:
+        raise HTTPException(
+            reason='Invalid limit: {}, must be at least 1'.format(limit),
+            status_code=HTTPStatus.BAD_REQUEST
+        )
+    shapes = []
+    for database in [DatabaseManager()] + sharding.get_shards():
+        shapes.extend(database.profiler.top(limit))
+    shapes.sort(key=lambda stats: stats['total_ms'], reverse=True)
+    return shapes[:limit]
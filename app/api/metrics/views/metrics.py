@@ -0,0 +1,29 @@
+from flask import Blueprint, request
+
+from app.api import admin_only
+from app.api.metrics.controller.metrics_controller import (
+    get_all_metrics, get_top_queries
+)
+
+BP = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+
+@BP.route('', methods=["GET"])
+@admin_only
+def get_metrics():
+    """
+    Get the counters collected by the worker that handles the request.
+    """
+    return {'counters': get_all_metrics()}
+
+
+@BP.route('/queries', methods=["GET"])
+@admin_only
+def get_queries():
+    """
+    Get the database query shapes that took the most total time in the worker
+    that handles the request. Use the "limit" query parameter to set how many
+    shapes to return (20 by default).
+    """
+    limit = request.args.get('limit', 20, type=int)
+    return {'queries': get_top_queries(limit)}
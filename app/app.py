@@ -1,15 +1,22 @@
 import os
+import math
+import time
 import atexit
 import logging
 import importlib
+import threading
 from http import HTTPStatus
 
-from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, current_app
 
+from app import deadline, manifest, metrics, sharding, tracing
+from app.admission import AdmissionController
 from app.config import Config
-from app.db import DatabaseManager
-from app.schema import validate_schema, SchemaError
+from app.db import (
+    DatabaseManager, DatabaseUnavailableError, make_read_preference
+)
+from app.deadline import DeadlineExceededError
+from app.schema import validate_schema, precompile_schemas, SchemaError
 
 
 logging.basicConfig(level=logging.INFO,
@@ -17,8 +24,11 @@ logging.basicConfig(level=logging.INFO,
                         [%(filename)s:%(funcName)s] %(message)s',
                     handlers=[logging.StreamHandler()])
 
-# Load environment variables from .flaskenv
-load_dotenv()
+# Load environment variables from .flaskenv, the flask command already did
+# it before importing the app
+if not os.environ.get('FLASK_RUN_FROM_CLI'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 
 class HTTPException(Exception):
@@ -44,19 +54,19 @@ class HTTPException(Exception):
 
 def register_blueprints(app):
     """
-    This will iterate over all API folders located under "api" folder and
+    This will iterate over all API folders listed in the blueprint manifest,
+    or located under "api" folder if the manifest is disabled or missing, and
     register each of their blueprints to flask.
 
     :param Flask app: the flask object that represents the app.
     """
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    api_file_path = os.path.join(current_directory, 'api')
-    api_names = [
-        folder
-        for folder in os.listdir(api_file_path)
-        if os.path.isdir(os.path.join(api_file_path, folder)) and
-        '__' not in folder
-    ]
+    api_names = None
+    if app.config['API_MANIFEST_ENABLED']:
+        api_names = manifest.read_manifest()
+        if api_names is None:
+            logging.warning('Blueprint manifest not found, scanning APIs')
+    if api_names is None:
+        api_names = manifest.discover_api_names()
     logging.info('Found APIs to register: %s', api_names)
 
     for api in api_names:
@@ -69,6 +79,19 @@ def register_blueprints(app):
             logging.error(
                 "Error importing Blueprint in folder '%s': %s", api, e)
 
+    api_module = importlib.import_module('app.api')
+    app.config['DEFAULT_LATENCY_BUDGET_MS'] = \
+        api_module.DEFAULT_LATENCY_BUDGET_MS
+    app.config['LATENCY_BUDGETS_MS'] = api_module.LATENCY_BUDGETS_MS
+    app.config['UNMONITORED_ENDPOINTS'] = api_module.UNMONITORED_ENDPOINTS
+    app.config['STREAMING_ENDPOINTS'] = api_module.STREAMING_ENDPOINTS
+    if app.config['ADMISSION_CONTROL_ENABLED']:
+        app.extensions['admission'] = AdmissionController(
+            api_module.ENDPOINT_CLASSES_SETTINGS,
+            api_module.ENDPOINT_CLASSES,
+            api_module.DEFAULT_ENDPOINT_CLASS
+        )
+
 
 def validate_input_payload_schema():
     """
@@ -113,6 +136,67 @@ def validate_server_response(response_dict):
         logging.warning('Server returned an invalid response: %s', e)
 
 
+_warm_up_lock = threading.Lock()
+
+
+def warm_up(app):
+    """
+    Prepares the worker to serve requests: opens the database connections,
+    compiles the schemas, primes the catalog cache and creates the cart TTL
+    index. The worker reports ready once the warm-up succeeded.
+
+    :param Flask app: the flask object that represents the app.
+
+    :return: True if the warm-up succeeded.
+    :rtype: bool
+    """
+    # Imported here since the API modules import this module
+    from app.api.cart.controller import cart_controller
+    from app.api.catalog.dao import catalog_dao
+
+    started_at = time.monotonic()
+    precompile_schemas()
+    try:
+        if not DatabaseManager().warm_up():
+            logging.warning('Warm-up failed: database did not answer')
+            return False
+        catalog_dao.warm_cache()
+        if not cart_controller.ensure_cart_indexes():
+            logging.warning('Failed to create the cart indexes')
+    except (DatabaseUnavailableError, DeadlineExceededError) as e:
+        logging.warning('Warm-up failed: %s', e)
+        return False
+
+    app.extensions['ready'] = True
+    logging.info(
+        'Warm-up completed in %.0fms', (time.monotonic() - started_at) * 1000)
+    return True
+
+
+def start_warm_up(app):
+    """
+    Starts the warm-up of the worker in the background when the server
+    starts, if WARM_UP_ON_START is enabled. It is attempted again every
+    WARM_UP_RETRY_INTERVAL seconds until it succeeds, the worker reports
+    ready from then on. Only the first call starts the warm-up.
+
+    :param Flask app: the flask object that represents the app.
+    """
+    if (not app.config['WARM_UP_ON_START'] or
+            app.extensions.get('warm_up_started')):
+        return
+    with _warm_up_lock:
+        if app.extensions.get('warm_up_started'):
+            return
+        app.extensions['warm_up_started'] = True
+
+    def run():
+        while not warm_up(app):
+            time.sleep(app.config['WARM_UP_RETRY_INTERVAL'])
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+
 def create_app():
     """
     Create and returns the flask application object.
@@ -121,16 +205,33 @@ def create_app():
 
     config = Config()
     app.config.update(config.to_dict())
+    tracing.configure(config)
 
     # Initialize database connection
     DatabaseManager(
         config.DATABASE_HOST,
         config.DATABASE_PORT,
-        config.DATABASE_NAME
+        config.DATABASE_NAME,
+        connect_timeout_ms=config.DATABASE_CONNECT_TIMEOUT_MS,
+        server_selection_timeout_ms=(
+            config.DATABASE_SERVER_SELECTION_TIMEOUT_MS),
+        socket_timeout_ms=config.DATABASE_SOCKET_TIMEOUT_MS,
+        failure_threshold=config.DATABASE_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=config.DATABASE_BREAKER_RESET_TIMEOUT,
+        slow_query_threshold_ms=config.SLOW_QUERY_THRESHOLD_MS,
+        explain_queries=config.QUERY_EXPLAIN_ENABLED,
+        min_pool_size=config.DATABASE_MIN_POOL_SIZE,
+        read_preference=make_read_preference(
+            config.DATABASE_READ_PREFERENCE,
+            config.DATABASE_READ_MAX_STALENESS_SECONDS)
     )
+    sharding.configure(config)
 
     register_blueprints(app)
 
+    # Set by the warm-up, see start_warm_up() and the readiness probe
+    app.extensions['ready'] = False
+
     return app
 
 
@@ -138,19 +239,76 @@ app = create_app()
 
 
 @app.before_request
+def start_warm_up_on_first_request():
+    """
+    Flask middleware that starts the warm-up on the first request, for the
+    servers that import the app instead of running this module (flask run,
+    WSGI servers). Until it completes, the readiness probe fails.
+    """
+    start_warm_up(current_app._get_current_object())
+
+
+@app.before_request
+def start_request_trace():
+    """
+    Flask middleware that will be executed first for each request. Starts the
+    trace of the request if it is sampled, continuing the trace given in the
+    "traceparent" header if any.
+    """
+    if request.endpoint in current_app.config['UNMONITORED_ENDPOINTS']:
+        return
+
+    request.trace = tracing.start_trace(
+        '{} {}'.format(request.method, request.endpoint),
+        request.headers.get('traceparent')
+    )
+
+
+@app.before_request
+@tracing.traced('middleware.before_request')
 def before_request_middleware():
     """
     Flask middleware that will be executed before each request.
     Validations performed in here:
      - Check that the route have an assigned endpoint to receive it
+     - Shed the request if its class of endpoints is overloaded.
+     - Start the latency budget of the request.
      - If request is POST, PUT or PATCH, check the payload schema.
+    Unmonitored endpoints (health checks) skip all of them, streaming
+    endpoints skip the admission control and the latency budget.
     """
+    if request.endpoint in current_app.config['UNMONITORED_ENDPOINTS']:
+        return
+
     logging.info('Received %s request to: %s', request.method, request.url)
 
     if request.endpoint is None:
         response = {'error': 'Unknow route'}
         return jsonify(response), HTTPStatus.BAD_REQUEST
 
+    streaming = request.endpoint in current_app.config['STREAMING_ENDPOINTS']
+
+    admission = current_app.extensions.get('admission')
+    if admission is not None and not streaming:
+        request.admission_slot = admission.admit(request.endpoint)
+        if request.admission_slot is None:
+            metrics.increment('load_shed.{}'.format(request.endpoint))
+            response = {'error': 'Service overloaded, retry later'}
+            headers = {
+                'Retry-After': str(
+                    current_app.config['ADMISSION_RETRY_AFTER_SECONDS'])
+            }
+            return jsonify(response), HTTPStatus.SERVICE_UNAVAILABLE, headers
+
+    request.started_at = time.monotonic()
+    if not streaming:
+        # Sub-requests of a batch can not outlive the batch request
+        deadline.start(
+            current_app.config['LATENCY_BUDGETS_MS'].get(
+                request.endpoint,
+                current_app.config['DEFAULT_LATENCY_BUDGET_MS']),
+            not_after=request.environ.get(deadline.ENVIRON_KEY))
+
     # All APIs that expects a payload should be validated first
     if request.method in ['POST', 'PUT', 'PATCH']:
         response = validate_input_payload_schema()
@@ -159,6 +317,7 @@ def before_request_middleware():
 
 
 @app.after_request
+@tracing.traced('middleware.after_request')
 def after_request_middleware(response):
     """
     Flask middleware that will be executed after each request.
@@ -167,15 +326,34 @@ def after_request_middleware(response):
      - Validate that the server returned a valid response (that is according
        to the expected schema)
     """
+    if request.endpoint in current_app.config['UNMONITORED_ENDPOINTS']:
+        return response
+
     logging.info('Returning response for %s %s', request.method, request.url)
-    if response.status_code != HTTPStatus.OK:
+    if getattr(request, 'trace', None) is not None:
+        request.trace.set_attribute('status_code', response.status_code)
+
+    if deadline.is_expired():
+        logging.warning(
+            'Request %s %s ran over its latency budget: %.0fms',
+            request.method, request.url,
+            (time.monotonic() - request.started_at) * 1000)
+        metrics.increment('latency_budget_overrun.{}'.format(request.endpoint))
+
+    # Streamed responses are sent as they are produced, bodies serialized
+    # ahead of time (the catalog snapshot) are not parsed again
+    if (response.status_code != HTTPStatus.OK or response.is_streamed or
+            getattr(request, 'preserialized', False)):
         return response
 
     response_data = response.get_json()
-    if response_data is None:
-        response_data_bytes = response.get_data()
-        response_data_text = response_data_bytes.decode('utf-8')
-        response_data = {'message': response_data_text}
+    if response_data is not None:
+        validate_server_response(response_data)
+        return response
+
+    response_data_bytes = response.get_data()
+    response_data_text = response_data_bytes.decode('utf-8')
+    response_data = {'message': response_data_text}
 
     validate_server_response(response_data)
 
@@ -192,6 +370,47 @@ def http_error_handler(e):
     return jsonify(response), e.status_code
 
 
+@app.errorhandler(DatabaseUnavailableError)
+def database_unavailable_handler(e):
+    """
+    This function will be executed every time the database can not be reached
+    It will answer with a 503 so clients know they can retry later.
+    """
+    response = {'error': 'Service Unavailable - {}'.format(e.reason)}
+    headers = {}
+    if e.retry_after is not None:
+        headers['Retry-After'] = str(max(math.ceil(e.retry_after), 1))
+    return jsonify(response), HTTPStatus.SERVICE_UNAVAILABLE, headers
+
+
+@app.errorhandler(DeadlineExceededError)
+def deadline_exceeded_handler(e):
+    """
+    This function will be executed every time a request runs out of its
+    latency budget. It will answer with a 504.
+    """
+    logging.warning('Aborting %s %s: %s', request.method, request.url, e)
+    metrics.increment('deadline_exceeded.{}'.format(request.endpoint))
+    response = {'error': 'Gateway Timeout - {}'.format(e.reason)}
+    return jsonify(response), HTTPStatus.GATEWAY_TIMEOUT
+
+
+@app.teardown_request
+def teardown_request_middleware(exception):
+    """
+    Flask middleware that will be executed at the end of each request, even
+    if it failed. Clears the latency budget of the request, releases its
+    admission slot and finishes its trace.
+    """
+    deadline.clear()
+    slot = getattr(request, 'admission_slot', None)
+    if slot is not None:
+        current_app.extensions['admission'].release(slot)
+    trace = getattr(request, 'trace', None)
+    if trace is not None:
+        tracing.end_trace(trace, exception)
+
+
 @app.errorhandler(Exception)
 def error_handler(e):
     """
@@ -208,8 +427,13 @@ def close_app():
     This code will be executed at application exit. Perform some cleaning.
     """
     logging.info('Closing flask application')
+    # Imported here since the API modules import this module
+    from app.api.cart.dao import cart_dao
+    cart_dao.close()
+
     db = DatabaseManager()
     db.close()
+    sharding.close()
 
 
 atexit.register(close_app)
@@ -217,4 +441,5 @@ atexit.register(close_app)
 
 if __name__ == '__main__':
     config = Config()
+    start_warm_up(app)
     app.run(host=config.APP_HOST, port=config.APP_PORT)
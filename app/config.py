@@ -6,8 +6,94 @@ class Config:
     DATABASE_HOST = os.environ.get("DATABASE_HOST", "host.docker.internal")
     DATABASE_PORT = int(os.environ.get("DATABASE_PORT", "27017"))
     DATABASE_NAME = os.environ.get("DATABASE_NAME", "music_store")
+    DATABASE_CONNECT_TIMEOUT_MS = int(
+        os.environ.get("DATABASE_CONNECT_TIMEOUT_MS", "2000"))
+    DATABASE_SERVER_SELECTION_TIMEOUT_MS = int(
+        os.environ.get("DATABASE_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+    DATABASE_SOCKET_TIMEOUT_MS = int(
+        os.environ.get("DATABASE_SOCKET_TIMEOUT_MS", "5000"))
+    DATABASE_MIN_POOL_SIZE = int(
+        os.environ.get("DATABASE_MIN_POOL_SIZE", "4"))
+    DATABASE_BREAKER_FAILURE_THRESHOLD = int(
+        os.environ.get("DATABASE_BREAKER_FAILURE_THRESHOLD", "5"))
+    DATABASE_BREAKER_RESET_TIMEOUT = float(
+        os.environ.get("DATABASE_BREAKER_RESET_TIMEOUT", "10"))
+    DATABASE_READ_PREFERENCE = os.environ.get(
+        "DATABASE_READ_PREFERENCE", "primary")
+    DATABASE_READ_MAX_STALENESS_SECONDS = int(
+        os.environ.get("DATABASE_READ_MAX_STALENESS_SECONDS", "-1"))
+    DATABASE_SHARDS = os.environ.get("DATABASE_SHARDS", "")
+    DATABASE_PREVIOUS_SHARDS = os.environ.get("DATABASE_PREVIOUS_SHARDS", "")
+    DATABASE_SHARD_VIRTUAL_NODES = int(
+        os.environ.get("DATABASE_SHARD_VIRTUAL_NODES", "100"))
+
+    ADMISSION_CONTROL_ENABLED = os.environ.get(
+        "ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+    ADMISSION_RETRY_AFTER_SECONDS = int(
+        os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+    SLOW_QUERY_THRESHOLD_MS = float(
+        os.environ.get("SLOW_QUERY_THRESHOLD_MS", "100"))
+    QUERY_EXPLAIN_ENABLED = os.environ.get(
+        "QUERY_EXPLAIN_ENABLED", "true").lower() == "true"
+
+    CART_WRITE_BEHIND = os.environ.get(
+        "CART_WRITE_BEHIND", "false").lower() == "true"
+    CART_FLUSH_INTERVAL_MS = int(
+        os.environ.get("CART_FLUSH_INTERVAL_MS", "200"))
+    CART_FLUSH_MAX_ATTEMPTS = int(
+        os.environ.get("CART_FLUSH_MAX_ATTEMPTS", "5"))
+    CART_RETENTION_DAYS = float(os.environ.get("CART_RETENTION_DAYS", "30"))
+    CART_ARCHIVE_AFTER_DAYS = float(
+        os.environ.get("CART_ARCHIVE_AFTER_DAYS", "7"))
+    CART_ARCHIVE_BATCH_SIZE = int(
+        os.environ.get("CART_ARCHIVE_BATCH_SIZE", "500"))
+
+    CATALOG_VERSION_CHECK_INTERVAL_MS = int(
+        os.environ.get("CATALOG_VERSION_CHECK_INTERVAL_MS", "100"))
+    CATALOG_SNAPSHOT_PATH = os.environ.get("CATALOG_SNAPSHOT_PATH", "")
+    CATALOG_EVENTS_HISTORY_SIZE = int(
+        os.environ.get("CATALOG_EVENTS_HISTORY_SIZE", "256"))
+    CATALOG_EVENTS_QUEUE_SIZE = int(
+        os.environ.get("CATALOG_EVENTS_QUEUE_SIZE", "64"))
+    CATALOG_EVENTS_MAX_CONNECTIONS = int(
+        os.environ.get("CATALOG_EVENTS_MAX_CONNECTIONS", "100"))
+    CATALOG_EVENTS_KEEPALIVE_SECONDS = float(
+        os.environ.get("CATALOG_EVENTS_KEEPALIVE_SECONDS", "15"))
+    CATALOG_CHANGE_LOG_SIZE = int(
+        os.environ.get("CATALOG_CHANGE_LOG_SIZE", "64"))
+    CATALOG_CHANGE_LOG_MAX_ITEMS = int(
+        os.environ.get("CATALOG_CHANGE_LOG_MAX_ITEMS", "1000"))
+    CATALOG_IMPORT_PARALLELISM = int(
+        os.environ.get("CATALOG_IMPORT_PARALLELISM", "2"))
+    CATALOG_IMPORT_BATCH_SIZE = int(
+        os.environ.get("CATALOG_IMPORT_BATCH_SIZE", "500"))
+    CATALOG_IMPORT_MAX_PENDING_BATCHES = int(
+        os.environ.get("CATALOG_IMPORT_MAX_PENDING_BATCHES", "1000"))
+    CATALOG_IMPORT_ID_SAMPLE_SIZE = int(
+        os.environ.get("CATALOG_IMPORT_ID_SAMPLE_SIZE", "100"))
+    CATALOG_IMPORT_MAX_ERRORS = int(
+        os.environ.get("CATALOG_IMPORT_MAX_ERRORS", "100"))
+    CATALOG_IMPORT_LEASE_SECONDS = float(
+        os.environ.get("CATALOG_IMPORT_LEASE_SECONDS", "300"))
+
+    TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", "0"))
+    TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "jsonl")
+    TRACING_FILE = os.environ.get("TRACING_FILE", "traces.jsonl")
+
+    BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+
+    WARM_UP_ON_START = os.environ.get(
+        "WARM_UP_ON_START", "false").lower() == "true"
+    WARM_UP_RETRY_INTERVAL = float(
+        os.environ.get("WARM_UP_RETRY_INTERVAL", "5"))
+    API_MANIFEST_ENABLED = os.environ.get(
+        "API_MANIFEST_ENABLED", "true").lower() == "true"
 
     SECRET_KEY = os.environ.get('SECRET_KEY', 'my_secret_key')
+    # Emails of the users allowed to use the admin endpoints, separated by
+    # commas
+    ADMIN_USERS = os.environ.get('ADMIN_USERS', '')
 
     APP_HOST = os.environ.get('APP_HOST', '0.0.0.0')
     APP_PORT = int(os.environ.get('APP_PORT', '5000'))
@@ -1,6 +1,159 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
 import pymongo
+from pymongo.errors import (
+    PyMongoError, ConnectionFailure, OperationFailure,
+    ServerSelectionTimeoutError
+)
+from pymongo.read_preferences import (
+    Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+)
 
-import logging
+from app import deadline, metrics, tracing
+from app.deadline import DeadlineExceededError
+from app.query_profiler import QueryProfiler
+
+READ_OPERATIONS = ('find_all', 'find_one')
+
+# Error code of creating an index that exists with other options
+INDEX_OPTIONS_CONFLICT = 85
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+
+def make_read_preference(mode, max_staleness_seconds=-1):
+    """
+    Returns the pymongo read preference for the given mode.
+
+    :param str mode: the read preference mode, e.g. "secondaryPreferred".
+    :param int max_staleness_seconds: secondaries lagging behind the primary
+     by more than this are not read from, -1 for no limit. Ignored for the
+     "primary" mode.
+
+    :raises ValueError: if the mode is unknown.
+    """
+    if mode not in READ_PREFERENCES:
+        raise ValueError('Unknown read preference: {}'.format(mode))
+    if mode == 'primary':
+        return Primary()
+    return READ_PREFERENCES[mode](max_staleness=max_staleness_seconds)
+
+
+class DatabaseUnavailableError(Exception):
+    """
+    Typed exception raised when the database can not be reached, either
+    because the operation failed to connect or because the circuit breaker
+    is open and the operation was not even attempted.
+
+    :param str reason: a message describing why the database is unavailable.
+    :param float retry_after: seconds after which the caller may retry.
+    """
+
+    def __init__(self, reason, retry_after=None):
+        self.reason = reason
+        self.retry_after = retry_after
+
+        super().__init__('Database unavailable: {}'.format(reason))
+
+
+def _count_documents(result):
+    """
+    Returns the number of documents an operation returned or wrote, given
+    the value returned by the DatabaseManager method.
+    """
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, int):
+        return result
+    return 1
+
+
+class CircuitBreaker:
+    """
+    A thread safe circuit breaker.
+
+    The breaker opens after failure_threshold consecutive failures. While it
+    is open, requests are rejected right away. Once reset_timeout seconds
+    have passed, a single trial request is let through: if it succeeds the
+    breaker closes again, if it fails the breaker stays open for another
+    reset_timeout seconds.
+
+    :param int failure_threshold: consecutive failures that open the breaker.
+    :param float reset_timeout: seconds to wait before letting a trial request
+     through an open breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self):
+        """
+        True if the breaker is currently rejecting requests.
+        """
+        return self._opened_at is not None
+
+    def allow_request(self):
+        """
+        Returns True if a request can be performed.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Let one trial request through, keep rejecting the rest.
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def retry_after(self):
+        """
+        Returns the seconds left until the breaker lets a request through.
+        """
+        opened_at = self._opened_at
+        if opened_at is None:
+            return 0
+        elapsed = time.monotonic() - opened_at
+        return max(self.reset_timeout - elapsed, 0)
+
+    def record_success(self):
+        """
+        Records a successful request, closing the breaker.
+        """
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """
+        Records a failed request, opening the breaker if the threshold of
+        consecutive failures is reached.
+        """
+        with self._lock:
+            self._failures += 1
+            if (self._opened_at is not None or
+                    self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    logging.error(
+                        'Opening database circuit breaker after %s failures',
+                        self._failures)
+                self._opened_at = time.monotonic()
 
 
 class DatabaseManager:
@@ -11,27 +164,220 @@ class DatabaseManager:
     connections to a MongoDB database. It encapsulates common database
     operations and connection handling, making it easier to work with MongoDB
     in your application.
+
+    Operations that can not reach the database raise DatabaseUnavailableError
+    instead of returning an empty result. After several consecutive failures
+    a circuit breaker opens and operations fail right away without waiting
+    for the database timeouts.
     """
     _instance = None
 
-    def __new__(cls, host="", port=27017, db_name=""):
+    def __new__(cls, host="", port=27017, db_name="",
+                connect_timeout_ms=None, server_selection_timeout_ms=None,
+                socket_timeout_ms=None, failure_threshold=5,
+                reset_timeout=10, slow_query_threshold_ms=100,
+                explain_queries=True, min_pool_size=0, read_preference=None):
         """
         Returns an instance of the class. Uses a singleton design pattern to
         ensure that all application uses just one connection to the database
-        and not create multiple.
+        and not create multiple. The parameters are the ones of create(), they
+        are only used the first time.
+
+        :return: an instance of the DatabaseManager class.
+        :rtype: DatabaseManager
+        """
+        if cls._instance is None:
+            cls._instance = cls.create(
+                host, port, db_name,
+                connect_timeout_ms=connect_timeout_ms,
+                server_selection_timeout_ms=server_selection_timeout_ms,
+                socket_timeout_ms=socket_timeout_ms,
+                failure_threshold=failure_threshold,
+                reset_timeout=reset_timeout,
+                slow_query_threshold_ms=slow_query_threshold_ms,
+                explain_queries=explain_queries,
+                min_pool_size=min_pool_size,
+                read_preference=read_preference
+            )
+        return cls._instance
+
+    @classmethod
+    def create(cls, host="", port=27017, db_name="",
+               connect_timeout_ms=None, server_selection_timeout_ms=None,
+               socket_timeout_ms=None, failure_threshold=5,
+               reset_timeout=10, slow_query_threshold_ms=100,
+               explain_queries=True, min_pool_size=0, read_preference=None):
+        """
+        Returns a new instance of the class, with its own client, circuit
+        breaker and query profiler. Used for databases other than the one
+        shared by the application, e.g. the shards of the user data.
 
         :param str host: host url where the database is.
         :param int port: the port number to use to connect to the db.
         :param db_name: the name of the database to use.
+        :param int connect_timeout_ms: milliseconds to wait for a connection
+         to be opened. Uses the pymongo default if not given.
+        :param int server_selection_timeout_ms: milliseconds to wait for a
+         suitable server to be found. Uses the pymongo default if not given.
+        :param int socket_timeout_ms: milliseconds to wait for a response on
+         an open connection. Uses the pymongo default if not given.
+        :param int failure_threshold: consecutive connection failures that
+         open the circuit breaker.
+        :param float reset_timeout: seconds the circuit breaker stays open
+         before trying the database again.
+        :param float slow_query_threshold_ms: operations slower than this are
+         logged as slow queries.
+        :param bool explain_queries: if True, the explain plan of each read
+         query shape is captured the first time the shape is seen.
+        :param int min_pool_size: the number of connections the client keeps
+         open to the database.
+        :param read_preference: the pymongo read preference of the read-only
+         operations, see make_read_preference(). Other operations always go
+         to the primary. Defaults to the primary.
 
-        :return: an instance of the DatabaseManager class.
         :rtype: DatabaseManager
         """
-        if cls._instance is None:
-            cls._instance = super(DatabaseManager, cls).__new__(cls)
-            cls._instance.client = pymongo.MongoClient(host, port)
-            cls._instance.db = cls._instance.client[db_name]
-        return cls._instance
+        client_options = {
+            'connectTimeoutMS': connect_timeout_ms,
+            'serverSelectionTimeoutMS': server_selection_timeout_ms,
+            'socketTimeoutMS': socket_timeout_ms,
+            'minPoolSize': min_pool_size,
+        }
+        client_options = {
+            option: value
+            for option, value in client_options.items()
+            if value is not None
+        }
+        instance = super(DatabaseManager, cls).__new__(cls)
+        # The client connects on the first operation (or the warm-up), so
+        # processes that never use the database do not pay for it
+        instance.client = pymongo.MongoClient(
+            host, port, connect=False, **client_options)
+        instance.db = instance.client[db_name]
+        instance.min_pool_size = min_pool_size
+        instance.read_preference = read_preference or Primary()
+        instance.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        instance.profiler = QueryProfiler(
+            slow_query_threshold_ms,
+            instance.explain if explain_queries else None
+        )
+        return instance
+
+    @property
+    def secondary_reads(self):
+        """
+        True if read-only operations may be served by secondaries, and so
+        return data older than the last writes.
+        """
+        return not isinstance(self.read_preference, Primary)
+
+    def _collection(self, collection_name, read_only=False):
+        """
+        Returns the collection to run an operation on: read-only operations
+        use the configured read preference, other ones go to the primary.
+        Counts the operations sent to each read preference, by collection.
+
+        :param str collection_name: the name of the collection.
+        :param bool read_only: True if the operation only reads data and can
+         be served by a secondary.
+        """
+        if not read_only:
+            metrics.increment('db_route.primary.{}'.format(collection_name))
+            return self.db[collection_name]
+
+        metrics.increment('db_route.{}.{}'.format(
+            self.read_preference.mongos_mode, collection_name))
+        return self.db.get_collection(
+            collection_name, read_preference=self.read_preference)
+
+    @contextmanager
+    def causal_session(self):
+        """
+        Context manager returning a causally consistent session: reads made
+        with it see at least the data seen by its previous reads, even when
+        they are served by different secondaries. Returns None when all the
+        reads go to the primary, as they already are.
+        """
+        if not self.secondary_reads:
+            yield None
+            return
+        with self.client.start_session(causal_consistency=True) as session:
+            yield session
+
+    def _execute(self, operation_name, collection_name, operation, default,
+                 error_message, query=None):
+        """
+        Runs a database operation through the circuit breaker, bounded by the
+        time left in the deadline of the current request (if any), inside a
+        span of the current trace. Successful operations are recorded in the
+        query profiler.
+
+        :param str operation_name: the name of the operation, e.g. "find_all".
+        :param str collection_name: the collection the operation runs on.
+        :param callable operation: function performing the operation.
+        :param default: value to return if the operation fails for a reason
+         other than the database being unreachable.
+        :param str error_message: message to log when the operation fails.
+        :param dict query: the filter query of the operation, if any.
+
+        :raises DatabaseUnavailableError: if the circuit breaker is open or
+         the database could not be reached.
+        :raises DeadlineExceededError: if the request deadline passed before
+         or while running the operation.
+        """
+        with tracing.span('db.{}'.format(operation_name),
+                          collection=collection_name):
+            return self._execute_operation(
+                operation_name, collection_name, operation, default,
+                error_message, query)
+
+    def _execute_operation(self, operation_name, collection_name, operation,
+                           default, error_message, query):
+        """
+        Runs the operation of _execute() once its span is started.
+        """
+        seconds_left = deadline.remaining()
+        if seconds_left is not None and seconds_left <= 0:
+            raise DeadlineExceededError('latency budget exhausted')
+
+        if not self.breaker.allow_request():
+            raise DatabaseUnavailableError(
+                'circuit breaker is open',
+                retry_after=self.breaker.retry_after()
+            )
+
+        try:
+            # The client side timeout also sends maxTimeMS to the server, so
+            # queries are not left running after the request gave up.
+            started_at = time.perf_counter()
+            with pymongo.timeout(seconds_left):
+                result = operation()
+            duration_ms = (time.perf_counter() - started_at) * 1000
+        except PyMongoError as e:
+            deadline_exceeded = e.timeout and deadline.is_expired()
+            if (isinstance(e, ServerSelectionTimeoutError) or
+                    (isinstance(e, ConnectionFailure) and
+                     not deadline_exceeded)):
+                self.breaker.record_failure()
+            logging.error(f"{error_message}: {e}")
+            if deadline_exceeded:
+                raise DeadlineExceededError('latency budget exhausted') from e
+            if isinstance(e, ConnectionFailure):
+                raise DatabaseUnavailableError(
+                    'database could not be reached',
+                    retry_after=self.breaker.retry_after()
+                ) from e
+            return default
+        except Exception as e:
+            logging.error(f"{error_message}: {e}")
+            return default
+
+        self.breaker.record_success()
+        self.profiler.record(
+            operation_name, collection_name, query, duration_ms,
+            _count_documents(result), operation_name in READ_OPERATIONS
+        )
+        return result
 
     def insert_one(self, collection_name, document):
         """
@@ -44,13 +390,12 @@ class DatabaseManager:
         :return: the inserted object id
         :rtype: ObjectId
         """
-        try:
-            collection = self.db[collection_name]
-            result = collection.insert_one(document)
-            return result.inserted_id
-        except Exception as e:
-            logging.error(f"Error inserting document: {e}")
-            return None
+        collection = self._collection(collection_name)
+        return self._execute(
+            'insert_one', collection_name,
+            lambda: collection.insert_one(document).inserted_id,
+            None, 'Error inserting document'
+        )
 
     def insert_many(self, collection_name, documents):
         """
@@ -63,15 +408,15 @@ class DatabaseManager:
         :return: the inserted object ids
         :rtype: list<ObjectId>
         """
-        try:
-            collection = self.db[collection_name]
-            result = collection.insert_many(documents)
-            return result.inserted_ids
-        except Exception as e:
-            logging.error(f"Error inserting documents: {e}")
-            return None
+        collection = self._collection(collection_name)
+        return self._execute(
+            'insert_many', collection_name,
+            lambda: collection.insert_many(documents).inserted_ids,
+            None, 'Error inserting documents'
+        )
 
-    def find_all(self, collection_name, query=None):
+    def find_all(self, collection_name, query=None, read_only=False,
+                 session=None, limit=0, sort=None, projection=None):
         """
         Retrieves all documents in a specific collection that matches a query
         filter (optional).
@@ -79,19 +424,30 @@ class DatabaseManager:
         :param str collection_name: the name of the collection where to search
          the documents.
         :param dict query: the filter query dict.
+        :param bool read_only: True if the result may be slightly stale, so
+         the query can be served by a secondary. Leave it False when reading
+         data that was just written.
+        :param ClientSession session: the session to run the query in, see
+         causal_session().
+        :param int limit: the maximum number of documents to return, 0 for no
+         limit.
+        :param list sort: the (field, direction) pairs to sort the documents
+         by, if any.
+        :param dict projection: the fields to return, all of them if None.
 
         :return: the list of documents found.
         :rtype: list<dict>
         """
-        try:
-            collection = self.db[collection_name]
-            cursor = collection.find(query)
-            return list(cursor)
-        except Exception as e:
-            logging.error(f"Error finding documents: {e}")
-            return []
+        collection = self._collection(collection_name, read_only)
+        return self._execute(
+            'find_all', collection_name,
+            lambda: list(collection.find(
+                query, projection, session=session, limit=limit, sort=sort)),
+            [], 'Error finding documents', query
+        )
 
-    def find_one(self, collection_name, query=None):
+    def find_one(self, collection_name, query=None, read_only=False,
+                 session=None, projection=None):
         """
         Retrieves a document in a specific collection that matches a query
         filter (optional).
@@ -99,17 +455,22 @@ class DatabaseManager:
         :param str collection_name: the name of the collection where to search
          the document.
         :param dict query: the filter query dict.
+        :param bool read_only: True if the result may be slightly stale, so
+         the query can be served by a secondary. Leave it False when reading
+         data that was just written.
+        :param ClientSession session: the session to run the query in, see
+         causal_session().
+        :param dict projection: the fields to return, all of them if None.
 
         :return: the document found.
         :rtype: dict
         """
-        try:
-            collection = self.db[collection_name]
-            cursor = collection.find_one(query)
-            return cursor
-        except Exception as e:
-            logging.error(f"Error finding document: {e}")
-            return None
+        collection = self._collection(collection_name, read_only)
+        return self._execute(
+            'find_one', collection_name,
+            lambda: collection.find_one(query, projection, session=session),
+            None, 'Error finding document', query
+        )
 
     def update_one(self, collection_name, filter_query, update_query):
         """
@@ -125,13 +486,40 @@ class DatabaseManager:
         :return: 1 if document was modified, 0 if no documents were found
         :rtype: integer
         """
-        try:
-            collection = self.db[collection_name]
-            result = collection.update_one(filter_query, update_query)
-            return result.modified_count
-        except Exception as e:
-            logging.error(f"Error updating document: {e}")
-            return 0
+        collection = self._collection(collection_name)
+        return self._execute(
+            'update_one', collection_name,
+            lambda: collection.update_one(
+                filter_query, update_query).modified_count,
+            0, 'Error updating document', filter_query
+        )
+
+    def find_one_and_update(self, collection_name, filter_query,
+                            update_query, upsert=False, projection=None):
+        """
+        Atomically update one document in a specific collection that matches
+        a query filter and return it as it is after the update.
+
+        :param str collection_name: the name of the collection where to search
+         the document.
+        :param dict filter_query: the filter query dict.
+        :param update_query: the update query that indicates what needs to be
+         updated, a dict or an update pipeline (list of stages).
+        :param bool upsert: if True, insert the document when no document
+         matches the filter.
+        :param dict projection: the fields to return, all of them if None.
+
+        :return: the updated document, None if no document was found
+        :rtype: dict
+        """
+        collection = self._collection(collection_name)
+        return self._execute(
+            'find_one_and_update', collection_name,
+            lambda: collection.find_one_and_update(
+                filter_query, update_query, projection, upsert=upsert,
+                return_document=pymongo.ReturnDocument.AFTER),
+            None, 'Error updating document', filter_query
+        )
 
     def delete_one(self, collection_name, filter_query):
         """
@@ -145,13 +533,137 @@ class DatabaseManager:
         :return: 1 if document was deleted, 0 if no documents were found
         :rtype: integer
         """
-        try:
-            collection = self.db[collection_name]
-            result = collection.delete_one(filter_query)
-            return result.deleted_count
-        except Exception as e:
-            logging.error(f"Error deleting document: {e}")
-            return 0
+        collection = self._collection(collection_name)
+        return self._execute(
+            'delete_one', collection_name,
+            lambda: collection.delete_one(filter_query).deleted_count,
+            0, 'Error deleting document', filter_query
+        )
+
+    def delete_many(self, collection_name, filter_query):
+        """
+        Delete all the documents in a specific collection that match a query
+        filter.
+
+        :param str collection_name: the name of the collection where to search
+         the documents.
+        :param dict filter_query: the filter query dict.
+
+        :return: the number of deleted documents, None if the delete failed
+        :rtype: integer
+        """
+        collection = self._collection(collection_name)
+        return self._execute(
+            'delete_many', collection_name,
+            lambda: collection.delete_many(filter_query).deleted_count,
+            None, 'Error deleting documents', filter_query
+        )
+
+    def bulk_write(self, collection_name, operations, ordered=True):
+        """
+        Perform a list of write operations in a specific collection in one
+        round trip.
+
+        :param str collection_name: the name of the collection where to
+         perform the operations.
+        :param list operations: the pymongo write operations (InsertOne,
+         UpdateOne, DeleteOne, ...) to perform.
+        :param bool ordered: if False, the operations may be applied in any
+         order and a failed operation does not stop the rest.
+
+        :return: the number of modified documents, None if the write failed
+        :rtype: integer
+        """
+        collection = self._collection(collection_name)
+        return self._execute(
+            'bulk_write', collection_name,
+            lambda: collection.bulk_write(
+                operations, ordered=ordered).modified_count,
+            None, 'Error writing documents'
+        )
+
+    def ensure_ttl_index(self, collection_name, field, expire_after_seconds):
+        """
+        Creates a TTL index on a date field: MongoDB deletes the documents
+        whose field is older than expire_after_seconds. If the index already
+        exists with another expiration, the expiration is updated.
+
+        :param str collection_name: the name of the collection to index.
+        :param str field: the name of the date field.
+        :param int expire_after_seconds: the age after which the documents
+         are deleted.
+
+        :return: the name of the index, None if it could not be created.
+        :rtype: str
+        """
+        collection = self._collection(collection_name)
+
+        def create_index():
+            try:
+                return collection.create_index(
+                    field, expireAfterSeconds=expire_after_seconds)
+            except OperationFailure as e:
+                if e.code != INDEX_OPTIONS_CONFLICT:
+                    raise
+            self.db.command(
+                'collMod', collection_name,
+                index={
+                    'keyPattern': {field: 1},
+                    'expireAfterSeconds': expire_after_seconds,
+                }
+            )
+            return '{}_1'.format(field)
+
+        return self._execute(
+            'create_index', collection_name, create_index,
+            None, 'Error creating TTL index'
+        )
+
+    def explain(self, collection_name, query=None):
+        """
+        Returns the explain("executionStats") result of a find query. It does
+        not go through the circuit breaker nor the request deadline.
+
+        :param str collection_name: the name of the collection the query runs
+         on.
+        :param dict query: the filter query dict.
+
+        :return: the explain command result.
+        :rtype: dict
+        """
+        return self.db.command(
+            'explain',
+            {'find': collection_name, 'filter': query or {}},
+            verbosity='executionStats'
+        )
+
+    def ping(self):
+        """
+        Checks that the database can be reached.
+
+        :return: True if the database answered.
+        :rtype: bool
+        """
+        return self._execute(
+            'ping', 'admin',
+            lambda: bool(self.client.admin.command('ping').get('ok')),
+            False, 'Error pinging database'
+        )
+
+    def warm_up(self):
+        """
+        Opens min_pool_size connections to the database (at least one) by
+        pinging it concurrently, so the first requests do not pay for the
+        connection handshakes and server selection.
+
+        :return: True if all the pings succeeded.
+        :rtype: bool
+        """
+        connections = max(self.min_pool_size or 0, 1)
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            results = list(executor.map(
+                lambda _: self.ping(), range(connections)))
+        return all(results)
 
     def close(self):
         """
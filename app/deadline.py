@@ -0,0 +1,75 @@
+import time
+import contextvars
+
+
+# WSGI environ key holding the deadline of the request that dispatched an
+# in-process sub-request, see start()
+ENVIRON_KEY = 'app.parent_deadline'
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceededError(Exception):
+    """
+    Typed exception raised when the time budget of the current request was
+    consumed before an operation could complete.
+
+    :param str reason: a message describing which operation ran out of time.
+    """
+
+    def __init__(self, reason):
+        self.reason = reason
+
+        super().__init__('Deadline exceeded: {}'.format(reason))
+
+
+def start(budget_ms, not_after=None):
+    """
+    Sets the deadline of the current context to budget_ms milliseconds from
+    now. A budget of None removes the deadline.
+
+    :param int budget_ms: the time budget in milliseconds.
+    :param float not_after: a deadline, as returned by get(), the new one can
+     not be later than. E.g. the deadline of the parent request.
+    """
+    new_deadline = None
+    if budget_ms is not None:
+        new_deadline = time.monotonic() + budget_ms / 1000
+    if not_after is not None:
+        new_deadline = min(new_deadline or not_after, not_after)
+    _deadline.set(new_deadline)
+
+
+def get():
+    """
+    Returns the deadline of the current context, in time.monotonic() seconds,
+    or None if there is no deadline.
+    """
+    return _deadline.get()
+
+
+def clear():
+    """
+    Removes the deadline of the current context.
+    """
+    _deadline.set(None)
+
+
+def remaining():
+    """
+    Returns the seconds left before the deadline of the current context, or
+    None if there is no deadline. The value is negative once the deadline has
+    passed.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def is_expired():
+    """
+    True if the current context has a deadline and it has already passed.
+    """
+    seconds_left = remaining()
+    return seconds_left is not None and seconds_left <= 0
@@ -0,0 +1,132 @@
+"""
+Import-time profiling check.
+
+Imports the app in a fresh interpreter with "-X importtime" and reports the
+modules and packages that take the most time to import. Run it with:
+
+    python -m app.importtime [--budget-ms 500] [--top 20] [--write-manifest]
+
+It exits with status 1 when the whole import is slower than the budget or
+when the blueprint manifest is out of date, so it can be used as a check.
+"""
+import sys
+import argparse
+import subprocess
+from collections import defaultdict
+
+from app import manifest
+
+
+def profile_import(module):
+    """
+    Imports a module in a fresh interpreter with "-X importtime" and returns
+    the import time of every module it loaded. The interpreter gets the same
+    environment as this process, so the production configuration is
+    measured.
+
+    :param str module: the name of the module to import.
+
+    :return: (name, depth, self microseconds, cumulative microseconds) tuples,
+     in import order.
+    :rtype: list<tuple>
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            'Failed to import {}: {}'.format(module, result.stderr))
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append(
+            (name.strip(), depth, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def report(imports, top):
+    """
+    Prints the import time breakdown by top-level package and the slowest
+    modules.
+
+    :param list<tuple> imports: the result of profile_import.
+    :param int top: the number of entries to show in each section.
+
+    :return: the total import time in milliseconds.
+    :rtype: float
+    """
+    total_us = sum(
+        cumulative_us for _, depth, _, cumulative_us in imports if depth == 0)
+
+    packages = defaultdict(int)
+    for name, _, self_us, _ in imports:
+        packages[name.split('.')[0]] += self_us
+
+    print('Total import time: {:.1f}ms'.format(total_us / 1000))
+    print('\nBy top-level package (self time):')
+    for package, self_us in sorted(
+            packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print('  {:>8.1f}ms  {}'.format(self_us / 1000, package))
+
+    print('\nSlowest modules (cumulative time):')
+    slowest = sorted(imports, key=lambda item: item[3], reverse=True)[:top]
+    for name, _, _, cumulative_us in slowest:
+        print('  {:>8.1f}ms  {}'.format(cumulative_us / 1000, name))
+
+    return total_us / 1000
+
+
+def check_manifest():
+    """
+    Checks that the blueprint manifest lists the API folders found on disk.
+
+    :return: True if the manifest is up to date.
+    :rtype: bool
+    """
+    api_names = manifest.discover_api_names()
+    manifest_names = manifest.read_manifest()
+    if manifest_names is None:
+        print('\nBlueprint manifest is missing: {}'.format(
+            manifest.MANIFEST_PATH))
+        return False
+    if sorted(manifest_names) != api_names:
+        print('\nBlueprint manifest is out of date: lists {}, found {}'.format(
+            manifest_names, api_names))
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Report the import time of the app.')
+    parser.add_argument('--module', default='app.app',
+                        help='module to import (default: app.app)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='number of entries to show (default: 20)')
+    parser.add_argument('--budget-ms', type=float,
+                        help='fail if the import takes longer than this')
+    parser.add_argument('--write-manifest', action='store_true',
+                        help='regenerate the blueprint manifest first')
+    args = parser.parse_args(argv)
+
+    if args.write_manifest:
+        print('Wrote blueprint manifest: {}'.format(
+            manifest.write_manifest()))
+
+    total_ms = report(profile_import(args.module), args.top)
+
+    success = check_manifest()
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print('\nImport time {:.1f}ms is over the budget of {:.1f}ms'.format(
+            total_ms, args.budget_ms))
+        success = False
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import os
+import json
+
+API_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+
+# Precomputed list of the API folders whose blueprint is registered at
+# startup, so the app does not need to scan the "api" folder. Regenerate it
+# with "python -m app.importtime --write-manifest" after adding an API.
+MANIFEST_PATH = os.path.join(API_PATH, 'manifest.json')
+
+
+def discover_api_names():
+    """
+    Returns the names of the API folders located under the "api" folder.
+    """
+    return sorted(
+        folder
+        for folder in os.listdir(API_PATH)
+        if os.path.isdir(os.path.join(API_PATH, folder)) and
+        '__' not in folder
+    )
+
+
+def read_manifest():
+    """
+    Returns the API names listed in the blueprint manifest.
+
+    :return: the API names, or None if there is no valid manifest.
+    """
+    try:
+        with open(MANIFEST_PATH) as manifest_file:
+            return json.load(manifest_file)['apis']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_manifest():
+    """
+    Writes the blueprint manifest from the API folders found on disk.
+
+    :return: the API names written to the manifest.
+    """
+    api_names = discover_api_names()
+    with open(MANIFEST_PATH, 'w') as manifest_file:
+        json.dump({'apis': api_names}, manifest_file, indent=4)
+        manifest_file.write('\n')
+    return api_names
@@ -0,0 +1,25 @@
+import threading
+from collections import Counter
+
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def increment(name, amount=1):
+    """
+    Increments a process wide counter.
+
+    :param str name: the name of the counter.
+    :param int amount: how much to add to the counter.
+    """
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot():
+    """
+    Returns a copy of all the counters as a dict.
+    """
+    with _lock:
+        return dict(_counters)
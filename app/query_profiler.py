@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+
+
+def normalize_query(query):
+    """
+    Returns the shape of a query: the same structure with every value
+    replaced by "?", so queries that only differ by their values share the
+    same shape. Lists of values are collapsed into a single "?".
+
+    :param dict query: the filter query dict.
+
+    :return: the JSON representation of the shape.
+    :rtype: str
+    """
+
+    def shape(value):
+        if isinstance(value, dict):
+            return {key: shape(value[key]) for key in sorted(value)}
+        if isinstance(value, (list, tuple)):
+            if any(isinstance(element, dict) for element in value):
+                return [shape(element) for element in value]
+            return ['?']
+        return '?'
+
+    return json.dumps(shape(query or {}), sort_keys=True)
+
+
+def summarize_explain(explain_result):
+    """
+    Returns the relevant parts of an explain("executionStats") result: the
+    stages of the winning plan and how many keys and documents were examined.
+
+    :param dict explain_result: the result of the explain command.
+    """
+    stages = []
+    plan = explain_result.get('queryPlanner', {}).get('winningPlan', {})
+    while plan:
+        stages.append(plan.get('stage'))
+        plan = plan.get('inputStage') or plan.get('queryPlan', {})
+    stats = explain_result.get('executionStats', {})
+    return {
+        'stages': [stage for stage in stages if stage],
+        'collection_scan': 'COLLSCAN' in stages,
+        'keys_examined': stats.get('totalKeysExamined'),
+        'documents_examined': stats.get('totalDocsExamined'),
+        'documents_returned': stats.get('nReturned'),
+        'execution_time_ms': stats.get('executionTimeMillis'),
+    }
+
+
+class QueryProfiler:
+    """
+    Aggregates the database operations per query shape and logs the slow
+    ones.
+
+    The first time a read query shape is seen, its explain plan is captured
+    in a background thread so that collection scans show up without manual
+    investigation.
+
+    :param float slow_threshold_ms: operations slower than this are logged.
+    :param callable explain: function receiving a collection name and a query
+     and returning the explain("executionStats") result, None to disable the
+     explain capture.
+    """
+
+    def __init__(self, slow_threshold_ms, explain=None):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._shapes = {}
+
+    def record(self, operation_name, collection_name, query, duration_ms,
+               documents, is_read):
+        """
+        Records one database operation.
+
+        :param str operation_name: the name of the operation.
+        :param str collection_name: the collection the operation ran on.
+        :param dict query: the filter query of the operation, if any.
+        :param float duration_ms: the time the operation took.
+        :param int documents: documents returned (reads) or written (writes).
+        :param bool is_read: True if the operation is a read query that can
+         be explained.
+        """
+        shape = normalize_query(query)
+        key = (operation_name, collection_name, shape)
+        with self._lock:
+            stats = self._shapes.get(key)
+            first_seen = stats is None
+            if first_seen:
+                stats = self._shapes[key] = {
+                    'operation': operation_name,
+                    'collection': collection_name,
+                    'shape': shape,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'documents': 0,
+                    'slow_count': 0,
+                    'explain': None,
+                }
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['documents'] += documents
+            if duration_ms >= self.slow_threshold_ms:
+                stats['slow_count'] += 1
+
+        if duration_ms >= self.slow_threshold_ms:
+            logging.warning(
+                'Slow query: %s on %s, shape %s, %.1fms, %s documents',
+                operation_name, collection_name, shape, duration_ms,
+                documents)
+
+        if first_seen and is_read and self.explain is not None:
+            threading.Thread(
+                target=self._capture_explain,
+                args=(key, collection_name, query),
+                daemon=True
+            ).start()
+
+    def _capture_explain(self, key, collection_name, query):
+        try:
+            summary = summarize_explain(self.explain(collection_name, query))
+        except Exception as e:
+            logging.warning('Error explaining query %s: %s', key, e)
+            return
+
+        if summary['collection_scan']:
+            logging.warning(
+                'Query runs a collection scan: %s on %s, shape %s',
+                key[0], collection_name, key[2])
+        with self._lock:
+            self._shapes[key]['explain'] = summary
+
+    def top(self, limit=20):
+        """
+        Returns the query shapes that took the most total time.
+
+        :param int limit: the maximum number of shapes to return.
+        """
+        with self._lock:
+            shapes = [
+                dict(stats, explain=dict(stats['explain'])
+                     if stats['explain'] else None)
+                for stats in self._shapes.values()
+            ]
+        shapes.sort(key=lambda stats: stats['total_ms'], reverse=True)
+        return shapes[:limit]
@@ -1,5 +1,3 @@
-from cerberus import Validator
-
 # ------  Authentication Schemas ------
 SCHEMA_REQUEST_LOGIN = {
     'user': {
@@ -119,6 +117,14 @@ SCHEMA_RESPONSE_GET_CATALOG = {
 }
 
 
+SCHEMA_RESPONSE_GET_CATALOG_ITEM = {
+    'item_id': {'type': 'string', 'required': True},
+    'item_name': {'type': 'string', 'required': True},
+    'description': {'type': 'string', 'required': False},
+    'price': {'type': 'integer', 'required': True, 'min': 1},
+}
+
+
 SCHEMA_REQUEST_CREATE_CATALOG = {
     'items': {
         'required': True,
@@ -146,6 +152,118 @@ SCHEMA_RESPONSE_CREATE_CATALOG = {
 }
 
 
+SCHEMA_RESPONSE_GET_IMPORT_JOB = {
+    'job_id': {'type': 'string', 'required': True},
+    'status': {
+        'type': 'string',
+        'required': True,
+        'allowed': ['queued', 'running', 'completed', 'failed']
+    },
+    'rows_total': {'type': 'integer', 'required': True},
+    'rows_processed': {'type': 'integer', 'required': True},
+    'rows_inserted': {'type': 'integer', 'required': True},
+    'rows_per_second': {'type': 'number', 'required': True},
+    'batches_total': {'type': 'integer', 'required': True},
+    'batches_processed': {'type': 'integer', 'required': True},
+    'inserted_ids_sample': {
+        'type': 'list', 'required': True, 'schema': {'type': 'string'}
+    },
+    'errors': {
+        'type': 'list',
+        'required': True,
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'batch': {'type': 'integer', 'required': True},
+                'error': {'type': 'string', 'required': True},
+            }
+        }
+    },
+    'created_at': {'type': 'number', 'required': True},
+    'started_at': {'type': 'number', 'nullable': True, 'required': True},
+    'heartbeat_at': {'type': 'number', 'nullable': True, 'required': True},
+    'finished_at': {'type': 'number', 'nullable': True, 'required': True},
+}
+
+
+# ------ Batch Schemas ------
+SCHEMA_REQUEST_BATCH = {
+    'requests': {
+        'required': True,
+        'type': 'list',
+        'minlength': 1,
+        'maxlength': 20,
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'method': {
+                    'type': 'string',
+                    'required': True,
+                    'allowed': ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+                },
+                'path': {
+                    'type': 'string', 'required': True, 'regex': r'/\S*'
+                },
+                'body': {'type': 'dict', 'nullable': True},
+                'headers': {
+                    'type': 'dict',
+                    'keysrules': {'type': 'string'},
+                    'valuesrules': {'type': 'string'}
+                },
+            }
+        }
+    }
+}
+
+
+SCHEMA_RESPONSE_BATCH = {
+    'responses': {
+        'required': True,
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'status': {'type': 'integer', 'required': True},
+                'body': {'type': 'dict', 'nullable': True, 'required': True},
+            }
+        }
+    }
+}
+
+
+# ------ Metrics Schemas ------
+SCHEMA_RESPONSE_GET_METRICS = {
+    'counters': {
+        'required': True,
+        'type': 'dict',
+        'keysrules': {'type': 'string'},
+        'valuesrules': {'type': 'integer'}
+    }
+}
+
+
+SCHEMA_RESPONSE_GET_QUERIES = {
+    'queries': {
+        'required': True,
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'operation': {'type': 'string', 'required': True},
+                'collection': {'type': 'string', 'required': True},
+                'shape': {'type': 'string', 'required': True},
+                'count': {'type': 'integer', 'required': True},
+                'total_ms': {'type': 'number', 'required': True},
+                'max_ms': {'type': 'number', 'required': True},
+                'documents': {'type': 'integer', 'required': True},
+                'slow_count': {'type': 'integer', 'required': True},
+                'explain': {'type': 'dict', 'nullable': True},
+            }
+        }
+    }
+}
+
+
 SCHEMAS_REGISTRY = {
     # Authentication schemas
     'request_authentication.authenticate': SCHEMA_REQUEST_LOGIN,
@@ -163,11 +281,28 @@ SCHEMAS_REGISTRY = {
 
     # Catalog schemas
     'response_catalog.get_catalog': SCHEMA_RESPONSE_GET_CATALOG,
+    'response_catalog.get_item': SCHEMA_RESPONSE_GET_CATALOG_ITEM,
     'request_catalog.create_catalog': SCHEMA_REQUEST_CREATE_CATALOG,
     'response_catalog.create_catalog': SCHEMA_RESPONSE_CREATE_CATALOG,
+    'response_catalog.get_import_job': SCHEMA_RESPONSE_GET_IMPORT_JOB,
+
+    # Batch schemas
+    'request_batch.batch': SCHEMA_REQUEST_BATCH,
+    'response_batch.batch': SCHEMA_RESPONSE_BATCH,
+
+    # Metrics schemas
+    'response_metrics.get_metrics': SCHEMA_RESPONSE_GET_METRICS,
+    'response_metrics.get_queries': SCHEMA_RESPONSE_GET_QUERIES,
 }
 
 
+# Schema definitions already normalized and checked by Cerberus, keyed by
+# schema id. Validators built from them skip the schema compilation.
+_COMPILED_SCHEMAS = {}
+# The cerberus Validator class, imported on first use
+_validator_class = None
+
+
 class SchemaError(Exception):
     """
     Typed exception raised when some data failed to validate against a schema.
@@ -181,6 +316,40 @@ class SchemaError(Exception):
         )
 
 
+def _get_validator_class():
+    """
+    Returns the cerberus Validator class, importing cerberus the first time:
+    it is slow to load.
+    """
+    global _validator_class
+    if _validator_class is None:
+        from cerberus import Validator
+        _validator_class = Validator
+    return _validator_class
+
+
+def compile_schema(schema_id):
+    """
+    Returns the compiled definition of a registered schema, compiling it the
+    first time.
+
+    :param str schema_id: Identifier of the schema to compile.
+    """
+    compiled = _COMPILED_SCHEMAS.get(schema_id)
+    if compiled is None:
+        compiled = _get_validator_class()(SCHEMAS_REGISTRY[schema_id]).schema
+        _COMPILED_SCHEMAS[schema_id] = compiled
+    return compiled
+
+
+def precompile_schemas():
+    """
+    Compiles all the registered schemas, so no request pays for it.
+    """
+    for schema_id in SCHEMAS_REGISTRY:
+        compile_schema(schema_id)
+
+
 def validate_schema(schema_id, data):
     """
     Generic schema validation function.
@@ -197,7 +366,8 @@ def validate_schema(schema_id, data):
     if schema_id not in SCHEMAS_REGISTRY:
         raise ValueError('Unknown schema "{}"'.format(schema_id))
 
-    validator = Validator(SCHEMAS_REGISTRY[schema_id])
+    compiled = compile_schema(schema_id)
+    validator = _get_validator_class()(compiled)
     validated = validator.validated(data)
 
     if validator.errors:
@@ -0,0 +1,383 @@
+"""
+Sharding of the user data.
+
+The collections keyed by user email (users and cart) can be partitioned over
+several MongoDB databases, listed in the DATABASE_SHARDS setting as
+"host:port/database" targets separated by commas. Each user is assigned to a
+target by a consistent hash ring, so adding a target only moves the users
+that the new target takes over. The catalog stays in the main database.
+
+To add a target, set DATABASE_PREVIOUS_SHARDS to the current targets and
+add the new one to DATABASE_SHARDS. While DATABASE_PREVIOUS_SHARDS is set, a
+user whose documents are still stored in its previous target is served from
+there. Then move the users the new target took over with:
+
+    python -m app.sharding rebalance
+
+and unset DATABASE_PREVIOUS_SHARDS once it moved every document.
+"""
+import sys
+import bisect
+import hashlib
+import logging
+
+from pymongo import DeleteMany, ReplaceOne
+
+from app.config import Config
+from app.db import DatabaseManager
+
+# Collections partitioned by user email, with the field holding the email
+SHARDED_COLLECTIONS = {
+    'users': 'user',
+    'cart': 'user',
+}
+# Times the documents changed while being moved are copied again
+MOVE_ATTEMPTS = 3
+
+_router = None
+
+
+def _hash(value):
+    return int.from_bytes(
+        hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring. Each target is placed at several points of the
+    ring (virtual nodes) to spread the keys evenly, a key belongs to the
+    first target found clockwise from the hash of the key.
+
+    :param list<str> targets: the names of the targets.
+    :param int virtual_nodes: the number of points of each target.
+    """
+
+    def __init__(self, targets=(), virtual_nodes=100):
+        self.virtual_nodes = virtual_nodes
+        self._hashes = []
+        self._targets = []
+        for target in targets:
+            self.add(target)
+
+    def add(self, target):
+        """
+        Adds a target to the ring.
+
+        :param str target: the name of the target.
+        """
+        for node in range(self.virtual_nodes):
+            node_hash = _hash('{}#{}'.format(target, node))
+            position = bisect.bisect(self._hashes, node_hash)
+            self._hashes.insert(position, node_hash)
+            self._targets.insert(position, target)
+
+    def get(self, key):
+        """
+        Returns the name of the target the key belongs to.
+
+        :param str key: the key to look up.
+        """
+        if not self._hashes:
+            raise ValueError('The hash ring has no targets')
+        position = bisect.bisect(self._hashes, _hash(key))
+        return self._targets[position % len(self._targets)]
+
+
+class ShardRouter:
+    """
+    Routes the operations on the user data to the database of the shard the
+    user belongs to.
+
+    :param dict<str, DatabaseManager> databases: the database of each
+     target, by target name.
+    :param int virtual_nodes: the number of points of each target in the
+     hash ring.
+    :param list<str> previous_targets: the targets before the last targets
+     were added, while their users are being moved. None if no rebalance is
+     in progress.
+    """
+
+    def __init__(self, databases, virtual_nodes=100, previous_targets=None):
+        self.databases = dict(databases)
+        self.ring = HashRing(self.databases, virtual_nodes)
+        self.previous_ring = None
+        if previous_targets:
+            unknown_targets = set(previous_targets) - set(self.databases)
+            if unknown_targets:
+                raise ValueError(
+                    'Previous database shards must still be shards: '
+                    '{}'.format(sorted(unknown_targets)))
+            self.previous_ring = HashRing(previous_targets, virtual_nodes)
+
+    def get_database(self, key, collection_name=None):
+        """
+        Returns the database of the shard the key belongs to. While a
+        rebalance is in progress, returns the previous shard of the key
+        instead if it still holds the document of the key.
+
+        :param str key: the user email.
+        :param str collection_name: the collection of the document of the
+         key, one of SHARDED_COLLECTIONS.
+        """
+        database = self.databases[self.ring.get(key)]
+        if self.previous_ring is None or collection_name is None:
+            return database
+
+        previous = self.databases[self.previous_ring.get(key)]
+        if previous is not database and previous.find_one(
+                collection_name,
+                {SHARDED_COLLECTIONS[collection_name]: key},
+                projection={'_id': 1}):
+            return previous
+        return database
+
+    def add_target(self, name, database):
+        """
+        Adds a target to the router. Keys it takes over are not moved, call
+        rebalance() for that. Until then they are served by their previous
+        target.
+
+        :param str name: the name of the target.
+        :param DatabaseManager database: the database of the target.
+        """
+        if self.previous_ring is None:
+            self.previous_ring = HashRing(
+                self.databases, self.ring.virtual_nodes)
+        self.databases[name] = database
+        self.ring.add(name)
+
+    def _move(self, collection_name, key_field, source_name, target_name,
+              ids):
+        """
+        Moves documents from a shard to another one. Each document is copied
+        to the target, replacing any document of the same key created there,
+        then deleted from the source unless it changed since it was read.
+        Changed documents are copied again, up to MOVE_ATTEMPTS times.
+
+        :return: the number of documents moved, and the number of documents
+         left in the source.
+        :rtype: tuple<int, int>
+        """
+        source = self.databases[source_name]
+        target = self.databases[target_name]
+        moved = 0
+        left = 0
+        for _ in range(MOVE_ATTEMPTS):
+            documents = source.find_all(collection_name, {'_id': {'$in': ids}})
+            if not documents:
+                left = 0
+                break
+
+            # The _id is kept, buffered cart updates address carts by _id
+            operations = []
+            for document in documents:
+                operations.append(DeleteMany({
+                    key_field: document[key_field],
+                    '_id': {'$ne': document['_id']},
+                }))
+                operations.append(ReplaceOne(
+                    {'_id': document['_id']}, document, upsert=True))
+            if target.bulk_write(collection_name, operations) is None:
+                logging.error(
+                    'Failed to copy %s documents of %s from %s to %s',
+                    len(documents), collection_name, source_name,
+                    target_name)
+                return moved, len(documents)
+
+            # Only the documents unchanged since they were read match
+            deleted = source.delete_many(collection_name, {'$or': documents})
+            if deleted is None:
+                logging.error(
+                    'Failed to delete %s moved documents of %s from %s',
+                    len(documents), collection_name, source_name)
+                return moved, len(documents)
+            moved += deleted
+            left = len(documents) - deleted
+            if not left:
+                break
+
+        if left:
+            logging.warning(
+                '%s documents of %s changed while moved from %s to %s',
+                left, collection_name, source_name, target_name)
+        logging.info(
+            'Moved %s documents of %s from %s to %s',
+            moved, collection_name, source_name, target_name)
+        return moved, left
+
+    def rebalance(self, collections=None, batch_size=500):
+        """
+        Moves every document stored in another shard than the one its key
+        belongs to. Each shard is scanned in batches of batch_size keys, by
+        ascending _id, and only the misplaced documents are read in full.
+        Documents are copied to their shard before being deleted from the
+        previous one, and they are not deleted if they changed in between, so
+        no write is lost. Keys are served by their previous shard until their
+        document is deleted from it. An interrupted rebalance can be run
+        again.
+
+        :param dict<str, str> collections: the collections to rebalance, with
+         the field holding the key of their documents. Defaults to
+         SHARDED_COLLECTIONS.
+        :param int batch_size: the number of documents scanned at once.
+
+        :return: the number of documents moved by collection, and the number
+         of documents that could not be moved.
+        :rtype: tuple<dict<str, int>, int>
+        """
+        collections = collections or SHARDED_COLLECTIONS
+        moved = {}
+        left = 0
+        for collection_name, key_field in collections.items():
+            moved[collection_name] = 0
+            for name, database in self.databases.items():
+                query = None
+                while True:
+                    keys = database.find_all(
+                        collection_name, query, limit=batch_size,
+                        sort=[('_id', 1)], projection={key_field: 1})
+                    if not keys:
+                        break
+                    misplaced = {}
+                    for document in keys:
+                        target = self.ring.get(document[key_field])
+                        if target != name:
+                            misplaced.setdefault(target, []).append(
+                                document['_id'])
+                    for target, ids in misplaced.items():
+                        target_moved, target_left = self._move(
+                            collection_name, key_field, name, target, ids)
+                        moved[collection_name] += target_moved
+                        left += target_left
+                    query = {'_id': {'$gt': keys[-1]['_id']}}
+        if not left:
+            self.previous_ring = None
+        return moved, left
+
+
+def parse_targets(value):
+    """
+    Parses the DATABASE_SHARDS setting.
+
+    :param str value: "host:port/database" targets separated by commas.
+
+    :return: (name, host, port, database name) tuples.
+    :rtype: list<tuple>
+    """
+    targets = []
+    for target in value.split(','):
+        target = target.strip()
+        if not target:
+            continue
+        address, _, db_name = target.partition('/')
+        host, _, port = address.partition(':')
+        if not host or not db_name:
+            raise ValueError('Invalid database shard: {}'.format(target))
+        targets.append((target, host, int(port or 27017), db_name))
+    return targets
+
+
+def configure(config):
+    """
+    Creates the shard router from the configuration. Sharding is disabled
+    when no shard is configured.
+
+    :param Config config: the application configuration.
+    """
+    global _router
+    targets = parse_targets(config.DATABASE_SHARDS)
+    if not targets:
+        _router = None
+        return
+    previous_targets = [
+        name
+        for name, _, _, _ in parse_targets(config.DATABASE_PREVIOUS_SHARDS)
+    ]
+
+    databases = {
+        name: DatabaseManager.create(
+            host, port, db_name,
+            connect_timeout_ms=config.DATABASE_CONNECT_TIMEOUT_MS,
+            server_selection_timeout_ms=(
+                config.DATABASE_SERVER_SELECTION_TIMEOUT_MS),
+            socket_timeout_ms=config.DATABASE_SOCKET_TIMEOUT_MS,
+            failure_threshold=config.DATABASE_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=config.DATABASE_BREAKER_RESET_TIMEOUT,
+            slow_query_threshold_ms=config.SLOW_QUERY_THRESHOLD_MS,
+            explain_queries=config.QUERY_EXPLAIN_ENABLED,
+            min_pool_size=config.DATABASE_MIN_POOL_SIZE
+        )
+        for name, host, port, db_name in targets
+    }
+    _router = ShardRouter(
+        databases, config.DATABASE_SHARD_VIRTUAL_NODES, previous_targets)
+    logging.info('Sharding user data over: %s', list(databases))
+
+
+def get_database(key, collection_name=None):
+    """
+    Returns the database holding the data of the given user: its shard if
+    sharding is enabled, the main database otherwise.
+
+    :param str key: the user email.
+    :param str collection_name: the collection the data is read from or
+     written to, so users not moved yet by a rebalance are served from their
+     previous shard.
+
+    :rtype: DatabaseManager
+    """
+    if _router is None:
+        return DatabaseManager()
+    return _router.get_database(key, collection_name)
+
+
+def get_shards():
+    """
+    Returns the databases of all the shards, empty if sharding is disabled.
+
+    :rtype: list<DatabaseManager>
+    """
+    if _router is None:
+        return []
+    return list(_router.databases.values())
+
+
+def get_user_databases():
+    """
+    Returns all the databases holding user data: the shards if sharding is
+    enabled, the main database otherwise.
+
+    :rtype: list<DatabaseManager>
+    """
+    return get_shards() or [DatabaseManager()]
+
+
+def close():
+    """
+    Closes the connections to the shards.
+    """
+    for database in get_shards():
+        database.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ['rebalance']:
+        print('Usage: python -m app.sharding rebalance')
+        return 2
+
+    configure(Config())
+    if _router is None:
+        print('Sharding is disabled, set DATABASE_SHARDS first')
+        return 1
+    moved, left = _router.rebalance()
+    print('Moved documents: {}'.format(moved))
+    close()
+    if left:
+        print('{} documents changed while moved, run it again'.format(left))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import re
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from functools import wraps
+
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_tracer = None
+
+# version-trace id-parent id-flags, see https://www.w3.org/TR/trace-context/
+_TRACEPARENT_RE = re.compile(
+    r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+def parse_traceparent(traceparent):
+    """
+    Parses a W3C "traceparent" header.
+
+    :param str traceparent: the value of the header.
+
+    :return: (trace id, parent id, sampled) tuple, or None if the header is
+     not valid: wrong format, version "ff", or all-zero trace or parent id.
+    :rtype: tuple
+    """
+    match = _TRACEPARENT_RE.match(traceparent.strip())
+    if not match:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if (version == 'ff' or trace_id == '0' * 32 or
+            parent_id == '0' * 16):
+        return None
+    return trace_id, parent_id, int(flags, 16) & 1 == 1
+
+
+class JsonLinesExporter:
+    """
+    Span exporter that appends each finished span as a JSON line to a file.
+
+    :param str path: the path of the file to write the spans to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span_record):
+        """
+        Writes a finished span.
+
+        :param dict span_record: the dict representation of the span.
+        """
+        line = json.dumps(span_record, default=str)
+        with self._lock:
+            with open(self.path, 'a') as trace_file:
+                trace_file.write(line + '\n')
+
+
+# Available span exporters, keyed by the name used in the configuration. Each
+# value is a callable receiving the Config and returning an object with an
+# export(span_record) method.
+EXPORTERS = {
+    'jsonl': lambda config: JsonLinesExporter(config.TRACING_FILE),
+}
+
+
+class Span:
+    """
+    A timed operation within a trace.
+
+    :param Tracer tracer: the tracer the span is exported through.
+    :param str trace_id: the 32 hex chars id of the trace.
+    :param str parent_id: the 16 hex chars id of the parent span, if any.
+    :param str name: the name of the operation.
+    :param dict attributes: extra data describing the operation.
+    """
+
+    def __init__(self, tracer, trace_id, parent_id, name, attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = '{:016x}'.format(random.getrandbits(64))
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.error = None
+        self._start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = None
+
+    def set_attribute(self, key, value):
+        """
+        Adds an attribute to the span.
+        """
+        self.attributes[key] = value
+
+    def child(self, name, attributes=None):
+        """
+        Returns a new span whose parent is this span.
+        """
+        return Span(self.tracer, self.trace_id, self.span_id, name, attributes)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_span.reset(self._token)
+        if exc_value is not None:
+            self.error = repr(exc_value)
+        self.end()
+
+    def end(self):
+        """
+        Finishes the span and exports it.
+        """
+        self.tracer.export({
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self._start_time,
+            'duration_ms': (time.perf_counter() - self._start) * 1000,
+            'attributes': self.attributes,
+            'error': self.error,
+        })
+
+
+class Tracer:
+    """
+    Decides which requests are traced and exports their spans.
+
+    :param float sample_rate: the fraction (0 to 1) of requests without a
+     sampled parent trace that are traced.
+    :param exporter: the object receiving the finished spans.
+    """
+
+    def __init__(self, sample_rate, exporter):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def export(self, span_record):
+        try:
+            self.exporter.export(span_record)
+        except Exception as e:
+            logging.error('Error exporting span: %s', e)
+
+    def start_trace(self, name, traceparent=None):
+        """
+        Starts the root span of a request, continuing the trace given in the
+        W3C "traceparent" header if any.
+
+        :param str name: the name of the root span.
+        :param str traceparent: the value of the incoming traceparent header.
+
+        :return: the root span, or None if the request is not sampled.
+        """
+        trace_id = parent_id = None
+        sampled = random.random() < self.sample_rate
+        # An invalid header is ignored and a new trace is started
+        parent = parse_traceparent(traceparent) if traceparent else None
+        if parent is not None:
+            trace_id, parent_id, parent_sampled = parent
+            sampled = sampled or parent_sampled
+
+        if not sampled:
+            return None
+        if trace_id is None:
+            trace_id = '{:032x}'.format(random.getrandbits(128))
+        return Span(self, trace_id, parent_id, name)
+
+
+class _NoopSpan:
+    """
+    Span used when the current request is not traced.
+    """
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def configure(config):
+    """
+    Sets up tracing from the application configuration. Tracing stays off
+    if the sample rate is 0 or no exporter is configured.
+
+    :param Config config: the application configuration.
+    """
+    global _tracer
+    if config.TRACING_SAMPLE_RATE <= 0 or not config.TRACING_EXPORTER:
+        _tracer = None
+        return
+    exporter = EXPORTERS[config.TRACING_EXPORTER](config)
+    _tracer = Tracer(config.TRACING_SAMPLE_RATE, exporter)
+
+
+def start_trace(name, traceparent=None):
+    """
+    Starts the root span of a request and makes it the current span.
+
+    :return: the root span, or None if tracing is off or the request is not
+     sampled. A returned span must be finished with end_trace().
+    """
+    if _tracer is None:
+        return None
+    root = _tracer.start_trace(name, traceparent)
+    if root is not None:
+        root.__enter__()
+    return root
+
+
+def end_trace(root, error=None):
+    """
+    Finishes a root span returned by start_trace().
+    """
+    root.__exit__(None, error, None)
+
+
+def span(name, **attributes):
+    """
+    Returns a context manager timing a child span of the current span. It
+    does nothing if the current request is not traced.
+
+    :param str name: the name of the operation.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    return parent.child(name, attributes)
+
+
+def traced(name=None):
+    """
+    Decorator running the function inside a child span of the current span.
+
+    :param str name: the name of the span, defaults to the module and name of
+     the function.
+    """
+
+    def decorator(func):
+        span_name = name or '{}.{}'.format(
+            func.__module__.rsplit('.', 1)[-1], func.__qualname__)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None:
+                return func(*args, **kwargs)
+            with parent.child(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from app.db import DatabaseManager
+
+requires_mongomock = unittest.skipIf(
+    mongomock is None, 'mongomock is not installed')
+
+
+def make_database(db_name='test'):
+    """
+    Returns a DatabaseManager backed by an in-memory mongomock client,
+    separate from the one shared by the application.
+
+    :param str db_name: the name of the database to use.
+    """
+    client = mongomock.MongoClient()
+    with mock.patch('app.db.pymongo.MongoClient', return_value=client):
+        return DatabaseManager.create(db_name=db_name, explain_queries=False)
+
+
+def use_database(test_case, database):
+    """
+    Makes the application use the given database until the end of the test,
+    with an empty catalog cache.
+
+    :param unittest.TestCase test_case: the running test.
+    :param DatabaseManager database: the database to use.
+    """
+    # Imported here, the API modules import the app
+    from app.api.catalog.dao import catalog_dao
+
+    patchers = [
+        mock.patch.object(DatabaseManager, '_instance', database),
+        mock.patch.object(catalog_dao, 'db', database),
+        mock.patch.object(catalog_dao, 'cache', catalog_dao.CatalogCache(0)),
+    ]
+    for patcher in patchers:
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+def auth_headers(app, user='a@b.com'):
+    """
+    Returns the headers authenticating requests as the given user.
+
+    :param Flask app: the flask application.
+    :param str user: the user email.
+    """
+    # Imported here, the API modules import the app
+    from app.api.authentication.controller.authentication_controller import \
+        generate_token
+
+    with app.app_context():
+        return {'Authorization': 'Bearer {}'.format(generate_token(user))}
@@ -0,0 +1,79 @@
+import time
+import unittest
+
+from app.admission import AdaptiveLimiter, AdmissionController
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_sheds_requests_over_the_limit(self):
+        limiter = AdaptiveLimiter('test', initial_limit=2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        self.assertEqual(limiter.in_flight, 2)
+
+    def test_grows_when_fast_and_in_use(self):
+        limiter = AdaptiveLimiter('test', initial_limit=4, max_limit=5,
+                                  latency_target_ms=100)
+        for _ in range(100):
+            for _ in range(4):
+                limiter.try_acquire()
+            for _ in range(4):
+                limiter.release(1)
+        self.assertEqual(limiter.limit, 5)
+
+    def test_does_not_grow_when_idle(self):
+        limiter = AdaptiveLimiter('test', initial_limit=10,
+                                  latency_target_ms=100)
+        for _ in range(50):
+            limiter.try_acquire()
+            limiter.release(1)
+        self.assertEqual(limiter.limit, 10)
+
+    def test_burst_of_slow_requests_shrinks_the_limit_once(self):
+        limiter = AdaptiveLimiter('test', initial_limit=20, min_limit=1,
+                                  latency_target_ms=10, backoff=0.5)
+        for _ in range(10):
+            limiter.try_acquire()
+        for _ in range(10):
+            limiter.release(1000)
+        self.assertEqual(limiter.limit, 10)
+
+    def test_shrinks_again_after_a_round_trip(self):
+        limiter = AdaptiveLimiter('test', initial_limit=20, min_limit=1,
+                                  latency_target_ms=10, backoff=0.5)
+        limiter.try_acquire()
+        limiter.release(20)
+        time.sleep(0.03)
+        limiter.try_acquire()
+        limiter.release(20)
+        self.assertEqual(limiter.limit, 5)
+
+    def test_never_goes_below_min_limit(self):
+        limiter = AdaptiveLimiter('test', initial_limit=2, min_limit=2,
+                                  latency_target_ms=10, backoff=0.1)
+        limiter.try_acquire()
+        limiter.release(20)
+        self.assertEqual(limiter.limit, 2)
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def test_classes_are_limited_separately(self):
+        controller = AdmissionController(
+            {'login': {'initial_limit': 1}, 'default': {'initial_limit': 1}},
+            {'authentication.authenticate': 'login'},
+            'default'
+        )
+        login_slot = controller.admit('authentication.authenticate')
+        self.assertIsNotNone(login_slot)
+        self.assertIsNone(controller.admit('authentication.authenticate'))
+        self.assertIsNotNone(controller.admit('cart.get_cart'))
+
+        controller.release(login_slot)
+        self.assertIsNotNone(controller.admit('authentication.authenticate'))
+
+
+if __name__ == '__main__':
+    unittest.main()
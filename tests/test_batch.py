@@ -0,0 +1,94 @@
+import time
+import unittest
+from unittest import mock
+
+# The API modules import the app, it must be created first
+from app.app import app
+from app import deadline
+from app.api.batch.controller import batch_controller
+from tests.helpers import (
+    auth_headers, make_database, requires_mongomock, use_database)
+
+
+@requires_mongomock
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        use_database(self, make_database())
+        self.client = app.test_client()
+        self.headers = auth_headers(app)
+
+    def run_batch(self, sub_requests):
+        response = self.client.post(
+            '/batch', headers=self.headers, json={'requests': sub_requests})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['responses']
+
+    def test_reads_are_dispatched_concurrently(self):
+        with mock.patch.object(
+                batch_controller.executor, 'submit',
+                wraps=batch_controller.executor.submit) as submit:
+            responses = self.run_batch([
+                {'method': 'GET', 'path': '/auth'},
+                {'method': 'GET', 'path': '/catalog'},
+            ])
+
+        self.assertEqual(submit.call_count, 2)
+        self.assertEqual(responses, [
+            {'status': 200, 'body': {'user': 'a@b.com'}},
+            {'status': 200, 'body': {'items': []}},
+        ])
+
+    def test_reads_see_the_previous_writes(self):
+        responses = self.run_batch([
+            {'method': 'POST', 'path': '/catalog',
+             'body': {'items': [{'item_name': 'a', 'price': 1}]}},
+            {'method': 'GET', 'path': '/catalog'},
+        ])
+
+        self.assertEqual(responses[0]['status'], 200)
+        self.assertEqual(
+            [item['item_name'] for item in responses[1]['body']['items']],
+            ['a'])
+
+    def test_sub_requests_are_authenticated(self):
+        self.headers = {}
+        responses = self.run_batch([{'method': 'GET', 'path': '/auth'}])
+        self.assertEqual(responses[0]['status'], 401)
+
+    def test_nested_batches_are_rejected(self):
+        responses = self.run_batch([
+            {'method': 'POST', 'path': '/batch?nested=true',
+             'body': {'requests': []}},
+        ])
+        self.assertEqual(responses[0], {
+            'status': 400,
+            'body': {'error': 'Batch requests can not be nested'}})
+
+    def test_sub_requests_end_with_the_batch(self):
+        remaining = []
+
+        def get_catalog_items(item_ids):
+            remaining.append(deadline.remaining())
+            return []
+
+        with mock.patch.dict(
+                app.config['LATENCY_BUDGETS_MS'], {'batch.batch': 100}), \
+                mock.patch(
+                    'app.api.catalog.views.catalog.get_catalog_items',
+                    get_catalog_items):
+            self.run_batch([{'method': 'GET', 'path': '/catalog?ids=x'}])
+
+        self.assertEqual(len(remaining), 1)
+        self.assertLessEqual(remaining[0], 0.1)
+
+    def test_sub_requests_after_the_batch_deadline_time_out(self):
+        with app.test_request_context('/batch'):
+            response = batch_controller.dispatch_request(
+                app, {'method': 'GET', 'path': '/catalog'}, {},
+                'http://localhost/', time.monotonic() - 1)
+        self.assertEqual(response['status'], 504)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import datetime
+import unittest
+from unittest import mock
+
+# The API modules import the app, it must be created first
+from app.app import app
+from app.api.cart.dao import cart_dao
+from tests.helpers import make_database, requires_mongomock
+
+
+@requires_mongomock
+class CartArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        self.now = datetime.datetime.utcnow()
+        self.idle_since = self.now - datetime.timedelta(days=7)
+        old = self.now - datetime.timedelta(days=10)
+        self.db.insert_many(cart_dao.COLLECTION_NAME, [
+            {'user': 'idle{}@b.com'.format(index), 'cart_items': ['x'],
+             'updated_at': old}
+            for index in range(3)
+        ] + [
+            {'user': 'active@b.com', 'cart_items': ['y'],
+             'updated_at': self.now},
+        ])
+
+    def get_users(self, collection_name):
+        return sorted(
+            cart['user'] for cart in self.db.find_all(collection_name))
+
+    def test_idle_carts_are_moved_to_the_archive(self):
+        archived = cart_dao.archive_carts(self.db, self.idle_since, 2)
+
+        self.assertEqual(archived, 3)
+        self.assertEqual(
+            self.get_users(cart_dao.COLLECTION_NAME), ['active@b.com'])
+        self.assertEqual(
+            self.get_users(cart_dao.ARCHIVE_COLLECTION_NAME),
+            ['idle0@b.com', 'idle1@b.com', 'idle2@b.com'])
+
+    def test_carts_updated_while_archived_are_kept(self):
+        bulk_write = self.db.bulk_write
+
+        def update_after_copy(*args, **kwargs):
+            result = bulk_write(*args, **kwargs)
+            self.db.update_one(
+                cart_dao.COLLECTION_NAME, {'user': 'idle0@b.com'},
+                {'$set': {'updated_at': self.now}})
+            return result
+
+        with mock.patch.object(self.db, 'bulk_write', update_after_copy):
+            archived = cart_dao.archive_carts(self.db, self.idle_since, 10)
+
+        self.assertEqual(archived, 2)
+        self.assertEqual(
+            self.get_users(cart_dao.COLLECTION_NAME),
+            ['active@b.com', 'idle0@b.com'])
+        self.assertEqual(
+            self.get_users(cart_dao.ARCHIVE_COLLECTION_NAME),
+            ['idle1@b.com', 'idle2@b.com'])
+
+    def test_invalid_batch_size_is_rejected(self):
+        with self.assertRaises(ValueError):
+            cart_dao.archive_carts(self.db, self.idle_since, 0)
+
+    def test_carts_without_update_date_get_one(self):
+        self.db.insert_many(cart_dao.COLLECTION_NAME, [
+            {'user': 'legacy@b.com', 'cart_items': []},
+        ])
+
+        self.assertEqual(cart_dao.backfill_updated_at(self.db), 1)
+        legacy = self.db.find_one(
+            cart_dao.COLLECTION_NAME, {'user': 'legacy@b.com'})
+        self.assertGreater(legacy['updated_at'], self.idle_since)
+        self.assertEqual(cart_dao.backfill_updated_at(self.db), 0)
+
+    def test_migrate_command_creates_the_ttl_index(self):
+        self.db.insert_many(cart_dao.COLLECTION_NAME, [
+            {'user': 'legacy@b.com', 'cart_items': []},
+        ])
+        with mock.patch(
+                'app.sharding.get_user_databases', return_value=[self.db]):
+            result = app.test_cli_runner().invoke(args=['cart', 'migrate'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.output, 'Migrated 1 carts\n')
+        indexes = self.db.db[cart_dao.COLLECTION_NAME].index_information()
+        self.assertTrue(any(
+            'expireAfterSeconds' in index for index in indexes.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
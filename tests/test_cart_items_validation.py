@@ -0,0 +1,102 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+# The API modules import the app, it must be created first
+from app.app import HTTPException, app
+from app.api.cart.controller.cart_controller import validate_cart_items
+from app.api.cart.dao import cart_dao
+from app.api.catalog.dao import catalog_dao
+from tests.helpers import (
+    auth_headers, make_database, requires_mongomock, use_database)
+
+
+@requires_mongomock
+class CartItemsValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        self.item_id = str(self.db.insert_many(
+            catalog_dao.COLLECTION_NAME, [{'item_name': 'a'}])[0])
+        # The cache of this worker does not have the item yet
+        cache = catalog_dao.CatalogCache(check_interval_ms=60000)
+        cache.load(catalog_dao.MemoryCatalog([]), 0)
+        for name, value in (('db', self.db), ('cache', cache)):
+            patcher = mock.patch.object(catalog_dao, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_existing_items_are_valid(self):
+        with mock.patch.object(
+                self.db, 'find_all', wraps=self.db.find_all) as find_all:
+            validate_cart_items([self.item_id, self.item_id])
+        find_all.assert_called_once()
+        self.assertNotIn('read_only', find_all.call_args.kwargs)
+
+    def test_missing_items_are_listed_in_the_error(self):
+        missing_id = str(ObjectId())
+        with self.assertRaises(HTTPException) as raised:
+            validate_cart_items([self.item_id, missing_id, 'bad'])
+
+        self.assertEqual(raised.exception.status_code, 400)
+        self.assertEqual(
+            raised.exception.reason,
+            'Invalid cart items: {} do not exist in catalog'.format(
+                sorted([missing_id, 'bad'])))
+
+
+@requires_mongomock
+class CartItemsEndpointsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        use_database(self, self.db)
+        self.client = app.test_client()
+        self.headers = auth_headers(app)
+        self.item_ids = [
+            str(item_id) for item_id in self.db.insert_many(
+                catalog_dao.COLLECTION_NAME,
+                [{'item_name': str(index), 'price': 1}
+                 for index in range(20)])
+        ]
+
+    def get_cart_items(self):
+        cart = self.db.find_one(cart_dao.COLLECTION_NAME, {'user': 'a@b.com'})
+        return cart and cart['cart_items']
+
+    def test_all_the_items_are_validated_with_one_query(self):
+        with mock.patch.object(
+                self.db, 'find_all', wraps=self.db.find_all) as find_all:
+            response = self.client.post(
+                '/cart/items', headers=self.headers,
+                json={'cart_items': self.item_ids})
+
+        self.assertEqual(response.status_code, 200)
+        find_all.assert_called_once()
+        self.assertEqual(self.get_cart_items(), self.item_ids)
+
+    def test_carts_with_unknown_items_are_not_created(self):
+        missing_id = str(ObjectId())
+        response = self.client.post(
+            '/cart/items', headers=self.headers,
+            json={'cart_items': [self.item_ids[0], missing_id, missing_id]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str([missing_id]), response.get_json()['error'])
+        self.assertIsNone(self.get_cart_items())
+
+    def test_carts_are_not_updated_with_unknown_items(self):
+        self.client.post(
+            '/cart/items', headers=self.headers,
+            json={'cart_items': self.item_ids[:1]})
+        response = self.client.patch(
+            '/cart/items', headers=self.headers,
+            json={'cart_items': [self.item_ids[1], 'bad']})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_cart_items(), self.item_ids[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
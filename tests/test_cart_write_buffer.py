@@ -0,0 +1,118 @@
+import threading
+import unittest
+from unittest import mock
+
+from app.db import DatabaseUnavailableError
+
+# The API modules import the app, it must be created first
+import app.app  # noqa: F401
+from app.api.cart.dao.cart_dao import CartWriteBuffer
+
+
+class CartWriteBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.Mock()
+        self.db.find_one.return_value = {
+            '_id': 'cart', 'user': 'a@b.com', 'cart_items': ['x', 'y']
+        }
+        patcher = mock.patch(
+            'app.sharding.get_database', return_value=self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = CartWriteBuffer(
+            flush_interval_ms=60000, max_flush_attempts=2)
+        self.addCleanup(self.buffer._stop.set)
+
+    def get_updates(self):
+        """
+        Returns the update documents of the last bulk write.
+        """
+        operations = self.db.bulk_write.call_args.args[1]
+        return [operation._doc for operation in operations]
+
+    def test_removing_a_missing_item_does_not_buffer_the_cart(self):
+        self.assertEqual(self.buffer.remove_cart_item('a@b.com', 'z'), 0)
+        self.assertIsNone(self.buffer.get_cart('a@b.com'))
+
+    def test_reads_see_the_buffered_mutations(self):
+        self.assertEqual(self.buffer.remove_cart_item('a@b.com', 'x'), 1)
+        self.assertEqual(
+            self.buffer.get_cart('a@b.com')['cart_items'], ['y'])
+        self.db.bulk_write.assert_not_called()
+
+    def test_removals_are_sent_as_one_pull(self):
+        self.buffer.remove_cart_item('a@b.com', 'x')
+        self.buffer.remove_cart_item('a@b.com', 'y')
+        self.buffer.flush()
+
+        updates = self.get_updates()
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            updates[0]['$pull'], {'cart_items': {'$in': ['x', 'y']}})
+        self.assertIsNone(self.buffer.get_cart('a@b.com'))
+
+    def test_removals_after_setting_the_items_are_folded_into_the_set(self):
+        self.buffer.update_cart_items('a@b.com', ['x', 'y', 'z'])
+        self.buffer.remove_cart_item('a@b.com', 'y')
+        self.buffer.flush()
+
+        updates = self.get_updates()
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('$pull', updates[0])
+        self.assertEqual(updates[0]['$set']['cart_items'], ['x', 'z'])
+
+    def test_entries_mutated_during_a_flush_are_kept(self):
+        self.buffer.remove_cart_item('a@b.com', 'x')
+
+        def mutate(*args, **kwargs):
+            self.buffer.update_cart_items('a@b.com', ['z'])
+            return 1
+
+        self.db.bulk_write.side_effect = mutate
+        self.buffer.flush()
+        self.assertEqual(
+            self.buffer.get_cart('a@b.com')['cart_items'], ['z'])
+
+        self.db.bulk_write.side_effect = None
+        self.buffer.flush()
+        self.assertEqual(self.get_updates()[0]['$set']['cart_items'], ['z'])
+        self.assertIsNone(self.buffer.get_cart('a@b.com'))
+
+    def test_discarded_mutations_are_not_sent(self):
+        self.buffer.remove_cart_item('a@b.com', 'x')
+        self.buffer.discard('a@b.com')
+        self.buffer.flush()
+
+        self.assertIsNone(self.buffer.get_cart('a@b.com'))
+        self.db.bulk_write.assert_not_called()
+
+    def test_mutations_are_dropped_after_failed_flushes(self):
+        self.buffer.remove_cart_item('a@b.com', 'x')
+        self.db.bulk_write.side_effect = DatabaseUnavailableError('down')
+
+        self.buffer.flush()
+        self.assertIsNotNone(self.buffer.get_cart('a@b.com'))
+        with self.assertLogs(level='ERROR'):
+            self.buffer.flush()
+        self.assertIsNone(self.buffer.get_cart('a@b.com'))
+
+    def test_a_single_flusher_thread_is_started(self):
+        barrier = threading.Barrier(8)
+
+        def start():
+            barrier.wait()
+            self.buffer._start()
+
+        callers = [threading.Thread(target=start) for _ in range(8)]
+        with mock.patch(
+                'threading.Thread', wraps=threading.Thread) as thread_class:
+            for caller in callers:
+                caller.start()
+            for caller in callers:
+                caller.join()
+        self.assertEqual(thread_class.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+# The API modules import the app, it must be created first
+import app.app  # noqa: F401
+from app.api.catalog.dao import catalog_dao
+from app.api.catalog.dao.catalog_dao import CatalogCache, MemoryCatalog
+from app.db import DatabaseUnavailableError
+from tests.helpers import make_database, requires_mongomock
+
+
+def make_item(name):
+    return {'_id': ObjectId(), 'item_name': name}
+
+
+class CatalogCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CatalogCache(check_interval_ms=0)
+        self.cache.load(MemoryCatalog([make_item('a')]), 3)
+
+    def test_cold_cache_needs_no_version_check(self):
+        self.assertFalse(CatalogCache(0).needs_version_check())
+        self.assertIsNone(CatalogCache(0).get_all())
+
+    def test_version_is_checked_once_per_interval(self):
+        cache = CatalogCache(check_interval_ms=60000)
+        cache.load(MemoryCatalog([]), 1)
+        self.assertFalse(cache.needs_version_check())
+        self.assertTrue(self.cache.needs_version_check())
+
+    def test_same_version_keeps_the_cache(self):
+        self.cache.check_version(3)
+        self.assertTrue(self.cache.is_warm)
+
+    def test_other_version_drops_the_cache(self):
+        self.cache.check_version(4)
+        self.assertFalse(self.cache.is_warm)
+
+    def test_older_version_from_a_secondary_keeps_the_cache(self):
+        self.cache.check_version(2, stale_reads=True)
+        self.assertTrue(self.cache.is_warm)
+        self.cache.check_version(2)
+        self.assertFalse(self.cache.is_warm)
+
+    def test_items_of_the_next_version_are_added(self):
+        self.cache.add([make_item('b')], 4)
+        self.assertEqual(self.cache.version, 4)
+        self.assertEqual(
+            sorted(item['item_name'] for item in self.cache.get_all()),
+            ['a', 'b'])
+
+    def test_items_after_a_missed_version_drop_the_cache(self):
+        self.cache.add([make_item('b')], 5)
+        self.assertFalse(self.cache.is_warm)
+
+
+@requires_mongomock
+class CatalogCacheCoherenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        self.db.insert_many(catalog_dao.COLLECTION_NAME, [make_item('a')])
+        # Each cache stands for the cache of a worker
+        self.caches = [CatalogCache(0), CatalogCache(0)]
+        patcher = mock.patch.object(catalog_dao, 'db', self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_names(self, worker):
+        with mock.patch.object(catalog_dao, 'cache', self.caches[worker]):
+            return sorted(
+                item['item_name']
+                for item in catalog_dao.get_all_catalog_items())
+
+    def test_writes_of_a_worker_reach_the_other_workers(self):
+        self.assertEqual(self.get_names(0), ['a'])
+        self.assertEqual(self.get_names(1), ['a'])
+
+        with mock.patch.object(catalog_dao, 'cache', self.caches[0]):
+            catalog_dao.create_catalog([{'item_name': 'b'}])
+
+        self.assertEqual(self.caches[0].version, 1)
+        self.assertEqual(self.get_names(1), ['a', 'b'])
+        self.assertEqual(self.caches[1].version, 1)
+
+    def test_cache_is_served_when_the_version_can_not_be_read(self):
+        self.assertEqual(self.get_names(0), ['a'])
+        with mock.patch.object(
+                self.db, 'find_one',
+                side_effect=DatabaseUnavailableError('down')):
+            self.assertEqual(self.get_names(0), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+
+from bson import ObjectId
+
+from app.api.catalog.dao.catalog_events import (
+    CatalogEventBroadcaster, format_event
+)
+
+
+def make_items(count):
+    return [
+        {'_id': ObjectId(), 'item_name': 'item', 'price': 1}
+        for _ in range(count)
+    ]
+
+
+def drain(subscription):
+    events = []
+    while True:
+        event = subscription.get(timeout=0)
+        if event is None:
+            return events
+        events.append(event)
+
+
+class CatalogEventBroadcasterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = CatalogEventBroadcaster(
+            history_size=3, queue_size=10, max_subscribers=2)
+        self.events.start(10)
+
+    def test_publishes_to_the_subscribers(self):
+        subscription = self.events.subscribe()
+        items = make_items(2)
+        self.assertTrue(self.events.publish(11, items))
+
+        event, = drain(subscription)
+        self.assertEqual(event['id'], 11)
+        self.assertEqual(event['event'], 'items')
+        self.assertEqual(
+            [item['item_id'] for item in event['data']['items']],
+            [str(item['_id']) for item in items])
+        self.assertIn('_id', items[0])
+
+    def test_only_publishes_the_next_version(self):
+        self.assertFalse(self.events.publish(12, make_items(1)))
+        self.assertFalse(self.events.publish(10, make_items(1)))
+        self.assertTrue(self.events.publish(11, make_items(1)))
+        self.assertEqual(self.events.version, 11)
+
+    def test_replays_the_missed_events(self):
+        for version in (11, 12, 13):
+            self.events.publish(version, make_items(1))
+
+        subscription = self.events.subscribe(last_event_id=11)
+        self.assertEqual(
+            [event['id'] for event in drain(subscription)], [12, 13])
+
+    def test_up_to_date_client_gets_nothing(self):
+        self.events.publish(11, make_items(1))
+        self.assertEqual(drain(self.events.subscribe(last_event_id=11)), [])
+
+    def test_resets_a_client_older_than_the_history(self):
+        for version in (11, 12, 13, 14):
+            self.events.publish(version, make_items(1))
+
+        event, = drain(self.events.subscribe(last_event_id=10))
+        self.assertEqual(event['event'], 'reset')
+        self.assertEqual(event['id'], 14)
+
+    def test_resets_a_client_ahead_of_the_worker(self):
+        self.events.publish(11, make_items(1))
+
+        event, = drain(self.events.subscribe(last_event_id=15))
+        self.assertEqual(event['event'], 'reset')
+        self.assertEqual(event['id'], 11)
+
+    def test_reset_event_is_replayed(self):
+        self.events.publish(11, make_items(1))
+        self.assertTrue(self.events.reset(13))
+        self.assertFalse(self.events.reset(13))
+
+        events = drain(self.events.subscribe(last_event_id=10))
+        self.assertEqual([(event['id'], event['event']) for event in events],
+                         [(11, 'items'), (13, 'reset')])
+        self.assertTrue(self.events.publish(14, make_items(1)))
+
+    def test_drops_the_clients_that_do_not_keep_up(self):
+        events = CatalogEventBroadcaster(
+            history_size=3, queue_size=1, max_subscribers=2)
+        events.start(0)
+        subscription = events.subscribe()
+        events.publish(1, make_items(1))
+        events.publish(2, make_items(1))
+
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(events.subscriber_count, 0)
+
+    def test_limits_the_subscribers(self):
+        self.assertIsNotNone(self.events.subscribe())
+        subscription = self.events.subscribe()
+        self.assertIsNone(self.events.subscribe())
+
+        self.events.unsubscribe(subscription)
+        self.assertIsNotNone(self.events.subscribe())
+
+    def test_format_event(self):
+        self.assertEqual(
+            format_event({'id': 3, 'event': 'reset', 'data': {'version': 3}}),
+            b'id: 3\nevent: reset\ndata: {"version": 3}\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# The API modules import the app, it must be created first
+from app.app import HTTPException
+from app.api.catalog.controller import catalog_controller
+from app.api.catalog.dao import catalog_dao
+from app.api.catalog.dao.catalog_events import CatalogEventBroadcaster
+from app.config import Config
+from tests.helpers import make_database, requires_mongomock
+
+
+@requires_mongomock
+class CatalogImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        patchers = [
+            mock.patch.object(catalog_dao, 'db', self.db),
+            mock.patch.object(
+                catalog_dao, 'cache', catalog_dao.CatalogCache(0)),
+            mock.patch.object(
+                catalog_dao, 'events', CatalogEventBroadcaster(16, 16, 4)),
+            mock.patch.object(
+                catalog_controller, 'import_executor', self.executor),
+            mock.patch.object(Config, 'CATALOG_IMPORT_BATCH_SIZE', 2),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_import(self, names):
+        job_id = catalog_controller.start_catalog_import(
+            [{'item_name': name} for name in names])
+        self.executor.shutdown(wait=True)
+        return catalog_controller.get_catalog_import(job_id)
+
+    def test_all_batches_are_imported_and_published(self):
+        job = self.run_import(['a', 'b', 'c', 'd', 'e'])
+
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['rows_inserted'], 5)
+        self.assertEqual(job['batches_processed'], 3)
+        self.assertEqual(len(job['inserted_ids_sample']), 5)
+        self.assertEqual(job['errors'], [])
+        # Each batch bumps the catalog version
+        self.assertEqual(catalog_dao.get_catalog_version(), 3)
+
+    def test_existing_names_are_skipped(self):
+        catalog_dao.create_catalog([{'item_name': 'a'}])
+        job = self.run_import(['a', 'b'])
+
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['rows_inserted'], 1)
+        self.assertEqual(
+            job['errors'], [{'batch': 0, 'error': "['a'] already exists"}])
+
+    def test_names_inserted_by_other_workers_are_found(self):
+        # The cache of this worker does not have the item yet
+        catalog_dao.cache.load(catalog_dao.MemoryCatalog([]), 0)
+        self.db.insert_many(catalog_dao.COLLECTION_NAME, [{'item_name': 'a'}])
+
+        job = self.run_import(['a'])
+        self.assertEqual(job['rows_inserted'], 0)
+
+    def test_a_job_without_inserted_rows_fails(self):
+        catalog_dao.create_catalog([{'item_name': 'a'}])
+        job = self.run_import(['a'])
+        self.assertEqual(job['status'], 'failed')
+
+    def test_errors_are_capped(self):
+        catalog_dao.create_catalog(
+            [{'item_name': name} for name in 'abcd'])
+        with mock.patch.object(Config, 'CATALOG_IMPORT_MAX_ERRORS', 1):
+            job = self.run_import(['a', 'b', 'c', 'd'])
+        self.assertEqual(len(job['errors']), 1)
+
+    def test_imports_over_the_pending_batches_limit_are_rejected(self):
+        with mock.patch.object(
+                Config, 'CATALOG_IMPORT_MAX_PENDING_BATCHES', 2), \
+                self.assertRaises(HTTPException) as raised:
+            catalog_controller.start_catalog_import(
+                [{'item_name': name} for name in 'abcde'])
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(catalog_controller._pending_batches, 0)
+
+    def test_jobs_without_heartbeat_are_reported_as_failed(self):
+        job_id = catalog_dao.create_import_job(1, 1)
+        catalog_dao.start_import_job(job_id)
+        job = catalog_controller.get_catalog_import(str(job_id))
+        self.assertEqual(job['status'], 'running')
+
+        expired = time.time() + Config.CATALOG_IMPORT_LEASE_SECONDS + 1
+        with mock.patch('time.time', return_value=expired):
+            job = catalog_controller.get_catalog_import(str(job_id))
+        self.assertEqual(job['status'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
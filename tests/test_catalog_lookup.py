@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+# The API modules import the app, it must be created first
+from app.app import app
+from app.api.catalog.dao import catalog_dao
+from tests.helpers import make_database, requires_mongomock, use_database
+
+
+@requires_mongomock
+class CatalogLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        use_database(self, self.db)
+        self.client = app.test_client()
+        self.ids = [
+            str(item_id) for item_id in self.db.insert_many(
+                catalog_dao.COLLECTION_NAME,
+                [{'item_name': 'a', 'price': 1},
+                 {'item_name': 'b', 'price': 2}])
+        ]
+
+    def test_item_is_found_by_id(self):
+        response = self.client.get('/catalog/{}'.format(self.ids[1]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            'item_id': self.ids[1], 'item_name': 'b', 'price': 2})
+
+    def test_unknown_and_invalid_ids_are_not_found(self):
+        for item_id in (str(ObjectId()), 'bad'):
+            response = self.client.get('/catalog/{}'.format(item_id))
+            self.assertEqual(response.status_code, 404)
+
+    def test_items_are_returned_in_the_order_of_the_ids(self):
+        response = self.client.get('/catalog?ids={},{},{},bad'.format(
+            self.ids[1], str(ObjectId()), self.ids[0]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['item_id'] for item in response.get_json()['items']],
+            [self.ids[1], self.ids[0]])
+
+    def test_items_are_served_by_the_warm_cache(self):
+        catalog_dao.warm_cache()
+        with mock.patch.object(
+                self.db, 'find_all', side_effect=AssertionError):
+            response = self.client.get('/catalog?ids={}'.format(self.ids[0]))
+        self.assertEqual(len(response.get_json()['items']), 1)
+
+    def test_lookups_over_their_budget_time_out(self):
+        with mock.patch.dict(
+                app.config['LATENCY_BUDGETS_MS'], {'catalog.get_item': 0}):
+            response = self.client.get('/catalog/{}'.format(self.ids[0]))
+
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(
+            response.get_json(),
+            {'error': 'Gateway Timeout - latency budget exhausted'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from bson import ObjectId
+
+from app.api.catalog.dao.catalog_snapshot import open_snapshot, write_snapshot
+
+
+def make_documents(names):
+    return [
+        {'_id': ObjectId(), 'item_name': name, 'price': position}
+        for position, name in enumerate(names)
+    ]
+
+
+class CatalogSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'catalog.snap')
+
+    def assertSameDocuments(self, documents, expected):
+        def key(document):
+            return document['_id']
+        self.assertEqual(sorted(documents, key=key),
+                         sorted(expected, key=key))
+
+    def test_round_trip(self):
+        documents = make_documents(['a', 'b', 'b', 'c'])
+        write_snapshot(self.path, documents, 7)
+
+        snapshot = open_snapshot(self.path)
+        self.assertEqual(snapshot.version, 7)
+        self.assertEqual(snapshot.count, 4)
+        self.assertSameDocuments(snapshot.get_all(), documents)
+        self.assertEqual(
+            [item['item_id'] for item in json.loads(snapshot.body)['items']],
+            [str(document['_id']) for document in documents])
+
+    def test_lookups(self):
+        documents = make_documents(['a', 'b', 'b', 'c'])
+        snapshot = write_snapshot(self.path, documents, 1)
+
+        self.assertEqual(
+            snapshot.get_many([str(documents[2]['_id']), 'invalid',
+                               str(ObjectId())]),
+            [documents[2]])
+        self.assertSameDocuments(
+            snapshot.find_by_names(['b', 'unknown']), documents[1:3])
+
+    def test_empty_catalog(self):
+        snapshot = write_snapshot(self.path, [], 0)
+        self.assertEqual(json.loads(snapshot.body), {'items': []})
+        self.assertEqual(snapshot.get_many([str(ObjectId())]), [])
+
+    def test_with_items_matches_a_full_write(self):
+        documents = make_documents(['a', 'b', 'c', 'd'])
+        snapshot = write_snapshot(self.path, documents[:2], 1)
+        snapshot = snapshot.with_items(documents[2:], 2)
+
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(snapshot.count, 4)
+        self.assertEqual(snapshot.body,
+                         write_snapshot(self.path, documents, 2).body)
+        self.assertSameDocuments(open_snapshot(self.path).get_all(), documents)
+        for document in documents:
+            self.assertEqual(snapshot.get_many([str(document['_id'])]),
+                             [document])
+            self.assertEqual(snapshot.find_by_names([document['item_name']]),
+                             [document])
+
+    def test_with_items_on_an_empty_catalog(self):
+        documents = make_documents(['a', 'a'])
+        snapshot = write_snapshot(self.path, [], 0).with_items(documents, 1)
+        self.assertSameDocuments(snapshot.find_by_names(['a']), documents)
+        self.assertEqual(len(json.loads(snapshot.body)['items']), 2)
+
+    def test_rejects_an_invalid_file(self):
+        with open(self.path, 'wb') as snapshot_file:
+            snapshot_file.write(b'not a snapshot')
+        self.assertIsNone(open_snapshot(self.path))
+        self.assertIsNone(open_snapshot(self.path + '.missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import threading
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+# The API modules import the app, it must be created first
+import app.app  # noqa: F401
+from app.api.catalog.dao import catalog_dao
+from app.api.catalog.dao.catalog_events import CatalogEventBroadcaster
+from app.config import Config
+from tests.helpers import make_database, mongomock, requires_mongomock
+
+
+@requires_mongomock
+class CatalogVersionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        self.cache = catalog_dao.CatalogCache(check_interval_ms=0)
+        self.events = CatalogEventBroadcaster(16, 16, 4)
+        for name, value in (('db', self.db), ('cache', self.cache),
+                            ('events', self.events)):
+            patcher = mock.patch.object(catalog_dao, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_changes(self):
+        return self.db.find_one(
+            catalog_dao.VERSION_COLLECTION_NAME,
+            {'_id': catalog_dao.VERSION_DOCUMENT_ID})['changes']
+
+    def test_each_bump_logs_its_version_and_items(self):
+        first_ids, second_ids = [ObjectId()], [ObjectId(), ObjectId()]
+        self.assertEqual(catalog_dao.bump_catalog_version(first_ids), 1)
+        self.assertEqual(catalog_dao.bump_catalog_version(second_ids), 2)
+        self.assertEqual(catalog_dao.get_catalog_version(), 2)
+        self.assertEqual(self.get_changes(), [
+            {'version': 1, 'item_ids': first_ids},
+            {'version': 2, 'item_ids': second_ids},
+        ])
+
+    def test_the_change_log_keeps_the_last_changes(self):
+        with mock.patch.object(Config, 'CATALOG_CHANGE_LOG_SIZE', 2):
+            for _ in range(3):
+                catalog_dao.bump_catalog_version([ObjectId()])
+        self.assertEqual(
+            [change['version'] for change in self.get_changes()], [2, 3])
+
+    def test_large_changes_are_logged_without_their_items(self):
+        with mock.patch.object(Config, 'CATALOG_CHANGE_LOG_MAX_ITEMS', 1):
+            catalog_dao.bump_catalog_version([ObjectId(), ObjectId()])
+        self.assertEqual(
+            self.get_changes(), [{'version': 1, 'item_ids': None}])
+
+    def test_concurrent_bumps_get_distinct_versions(self):
+        # Single document updates are atomic on the server, not in mongomock
+        lock = threading.Lock()
+        find_one_and_update = mongomock.collection.Collection.\
+            find_one_and_update
+
+        def atomic_find_one_and_update(*args, **kwargs):
+            with lock:
+                return find_one_and_update(*args, **kwargs)
+
+        patcher = mock.patch.object(
+            mongomock.collection.Collection, 'find_one_and_update',
+            atomic_find_one_and_update)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        versions = []
+        barrier = threading.Barrier(8)
+
+        def bump():
+            barrier.wait()
+            for _ in range(10):
+                versions.append(
+                    catalog_dao.bump_catalog_version([ObjectId()]))
+
+        threads = [threading.Thread(target=bump) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(versions), list(range(1, 81)))
+        self.assertEqual(catalog_dao.get_catalog_version(), 80)
+        self.assertEqual(
+            [change['version'] for change in self.get_changes()],
+            list(range(81 - Config.CATALOG_CHANGE_LOG_SIZE, 81)))
+
+    def test_changes_of_other_workers_are_published_from_the_log(self):
+        self.events.start(0)
+        items = [{'_id': ObjectId(), 'item_name': 'a'}]
+        self.db.insert_many(catalog_dao.COLLECTION_NAME, items)
+        catalog_dao.bump_catalog_version([items[0]['_id']])
+
+        catalog_dao.publish_catalog_changes()
+        self.assertEqual(self.events.version, 1)
+
+    def test_changes_missing_from_the_log_reset_the_stream(self):
+        self.events.start(0)
+        with mock.patch.object(Config, 'CATALOG_CHANGE_LOG_MAX_ITEMS', 0):
+            catalog_dao.bump_catalog_version([ObjectId()])
+
+        with mock.patch.object(self.events, 'reset') as reset:
+            catalog_dao.publish_catalog_changes()
+        reset.assert_called_once_with(1)
+
+    def test_a_failed_bump_drops_the_cache(self):
+        self.cache.load(catalog_dao.MemoryCatalog([]), 0)
+        with mock.patch.object(
+                self.db, 'find_one_and_update', return_value=None):
+            catalog_dao.publish_catalog_items([{'_id': ObjectId()}])
+        self.assertFalse(self.cache.is_warm)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import subprocess
+import unittest
+from unittest import mock
+
+import cerberus
+
+from app import manifest, schema
+
+
+class ValidatorClassTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(schema, '_validator_class', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_validator_class_is_imported_once(self):
+        validator_class = schema._get_validator_class()
+        self.assertIs(validator_class, cerberus.Validator)
+
+        with mock.patch.object(cerberus, 'Validator', object):
+            self.assertIs(schema._get_validator_class(), validator_class)
+
+    def test_schemas_are_compiled_once(self):
+        with mock.patch.dict(schema._COMPILED_SCHEMAS, clear=True):
+            compiled = schema.compile_schema('request_batch.batch')
+            self.assertIs(
+                schema.compile_schema('request_batch.batch'), compiled)
+
+    def test_data_is_validated_with_the_cached_class(self):
+        with self.assertRaises(schema.SchemaError):
+            schema.validate_schema('request_batch.batch', {'requests': []})
+        with self.assertRaises(ValueError):
+            schema.validate_schema('unknown', {})
+
+
+class ColdStartTest(unittest.TestCase):
+
+    def test_manifest_lists_all_the_apis(self):
+        self.assertEqual(
+            sorted(manifest.read_manifest()), manifest.discover_api_names())
+
+    def test_importing_the_app_skips_the_heavy_modules(self):
+        code = (
+            'import sys, app.app; '
+            'print(sorted(name for name in ("cerberus", "jwt", "bcrypt") '
+            'if name in sys.modules))'
+        )
+        env = dict(os.environ, WARM_UP_ON_START='false')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=root, env=env,
+            capture_output=True, text=True, timeout=60, check=True).stdout
+        self.assertEqual(output.strip().splitlines()[-1], '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import time
+import unittest
+
+from pymongo import _csot
+from pymongo.errors import NetworkTimeout
+
+from app import deadline
+from app.deadline import DeadlineExceededError
+from tests.helpers import make_database, requires_mongomock
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def tearDown(self):
+        deadline.clear()
+
+    def test_no_deadline_by_default(self):
+        self.assertIsNone(deadline.remaining())
+        self.assertFalse(deadline.is_expired())
+
+    def test_budget_sets_the_deadline(self):
+        deadline.start(1000)
+        self.assertGreater(deadline.remaining(), 0.9)
+        self.assertLessEqual(deadline.remaining(), 1)
+
+        deadline.start(0)
+        self.assertTrue(deadline.is_expired())
+
+        deadline.clear()
+        self.assertIsNone(deadline.get())
+
+    def test_parent_deadline_caps_the_budget(self):
+        parent = time.monotonic() + 0.1
+        deadline.start(1000, not_after=parent)
+        self.assertEqual(deadline.get(), parent)
+
+        deadline.start(None, not_after=parent)
+        self.assertEqual(deadline.get(), parent)
+
+        deadline.start(10, not_after=parent)
+        self.assertLess(deadline.get(), parent)
+
+
+@requires_mongomock
+class DatabaseDeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        self.addCleanup(deadline.clear)
+
+    def test_operations_fail_once_the_deadline_passed(self):
+        deadline.start(0)
+        with self.assertRaises(DeadlineExceededError):
+            self.db.find_all('catalog')
+        self.assertFalse(self.db.breaker.is_open)
+
+    def test_time_left_is_passed_down_to_the_driver(self):
+        deadline.start(500)
+        timeout = self.db._execute(
+            'find_all', 'catalog', _csot.get_timeout, None, 'Error')
+        self.assertGreater(timeout, 0)
+        self.assertLessEqual(timeout, 0.5)
+
+        deadline.clear()
+        self.assertIsNone(self.db._execute(
+            'find_all', 'catalog', _csot.get_timeout, None, 'Error'))
+
+    def test_server_timeouts_after_the_deadline_are_not_failures(self):
+        deadline.start(10)
+
+        def slow_operation():
+            time.sleep(0.02)
+            raise NetworkTimeout('timed out')
+
+        for _ in range(self.db.breaker.failure_threshold):
+            with self.assertRaises(DeadlineExceededError):
+                self.db._execute(
+                    'find_all', 'catalog', slow_operation, None, 'Error')
+            deadline.start(10)
+        self.assertFalse(self.db.breaker.is_open)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+# The API modules import the app, it must be created first
+from app.app import app
+from tests.helpers import make_database, requires_mongomock, use_database
+
+
+@requires_mongomock
+class HealthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = make_database()
+        use_database(self, self.db)
+        self.client = app.test_client()
+        patchers = [
+            mock.patch.dict(app.extensions, {'ready': False}),
+            # The background warm-up is started by the tests that need it
+            mock.patch.dict(app.extensions, {'warm_up_started': True}),
+            mock.patch.dict(app.config, {'WARM_UP_ON_START': True}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_liveness(self):
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'status': 'alive'})
+
+    def test_not_ready_until_warmed_up(self):
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json(), {'status': 'not ready'})
+
+        app.extensions['ready'] = True
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'status': 'ready'})
+
+    def test_not_ready_when_the_breaker_is_open(self):
+        app.extensions['ready'] = True
+        for _ in range(self.db.breaker.failure_threshold):
+            self.db.breaker.record_failure()
+
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        # Liveness does not depend on the database
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+
+    def test_readiness_probe_warms_up_without_warm_up_on_start(self):
+        app.config['WARM_UP_ON_START'] = False
+        with mock.patch(
+                'app.api.health.controller.health_controller.warm_up',
+                wraps=lambda flask_app: flask_app.extensions.update(
+                    ready=True)) as warm_up:
+            self.assertEqual(self.client.get('/readyz').status_code, 200)
+            self.assertEqual(self.client.get('/readyz').status_code, 200)
+        warm_up.assert_called_once()
+
+    def test_warm_up_makes_the_worker_ready(self):
+        app.config['WARM_UP_ON_START'] = False
+        with mock.patch(
+                'app.api.cart.controller.cart_controller.sharding.'
+                'get_user_databases', return_value=[self.db]):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+from unittest import mock
+
+# The API modules import the app, it must be created first
+from app.app import app
+from tests.helpers import auth_headers
+
+
+class MetricsAccessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        patcher = mock.patch.dict(
+            app.config, {'ADMIN_USERS': 'ops@b.com, admin@b.com'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_without_token_are_rejected(self):
+        for path in ('/metrics', '/metrics/queries'):
+            self.assertEqual(self.client.get(path).status_code, 401)
+
+    def test_non_admin_users_are_rejected(self):
+        headers = auth_headers(app, 'a@b.com')
+        for path in ('/metrics', '/metrics/queries'):
+            response = self.client.get(path, headers=headers)
+            self.assertEqual(response.status_code, 403)
+
+    def test_admin_users_get_the_metrics(self):
+        headers = auth_headers(app, 'admin@b.com')
+        response = self.client.get('/metrics', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('counters', response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from unittest import mock
+
+# The API modules import the app, it must be created first
+from app.app import app
+from tests.helpers import make_database, requires_mongomock, use_database
+
+
+@requires_mongomock
+class CatalogResponseValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        use_database(self, make_database())
+        self.client = app.test_client()
+        patcher = mock.patch('app.app.validate_server_response')
+        self.validate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snapshot_body_is_not_validated(self):
+        with mock.patch(
+                'app.api.catalog.views.catalog.get_catalog_body',
+                return_value=b'{"items": []}'):
+            response = self.client.get('/catalog')
+
+        self.assertEqual(response.get_json(), {'items': []})
+        self.validate.assert_not_called()
+
+    def test_catalog_without_snapshot_is_validated(self):
+        response = self.client.get('/catalog')
+
+        self.assertEqual(response.status_code, 200)
+        self.validate.assert_called_once_with({'items': []})
+
+    def test_catalog_items_by_id_are_validated(self):
+        response = self.client.get('/catalog?ids=x')
+
+        self.assertEqual(response.status_code, 200)
+        self.validate.assert_called_once_with({'items': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+from unittest import mock
+
+from app.sharding import HashRing, ShardRouter, parse_targets
+from tests.helpers import make_database, requires_mongomock
+
+KEYS = ['user{}@example.com'.format(number) for number in range(2000)]
+
+
+class HashRingTest(unittest.TestCase):
+
+    def test_requires_a_target(self):
+        with self.assertRaises(ValueError):
+            HashRing().get('user@example.com')
+
+    def test_is_deterministic(self):
+        ring = HashRing(['a', 'b', 'c'])
+        other_ring = HashRing(['c', 'b', 'a'])
+        for key in KEYS:
+            self.assertEqual(ring.get(key), other_ring.get(key))
+
+    def test_spreads_the_keys(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = {}
+        for key in KEYS:
+            target = ring.get(key)
+            counts[target] = counts.get(target, 0) + 1
+        self.assertEqual(set(counts), {'a', 'b', 'c', 'd'})
+        for count in counts.values():
+            self.assertGreater(count, len(KEYS) / 4 / 2)
+
+    def test_adding_a_target_only_moves_keys_to_it(self):
+        ring = HashRing(['a', 'b', 'c'])
+        before = {key: ring.get(key) for key in KEYS}
+        ring.add('d')
+
+        moved = [key for key in KEYS if ring.get(key) != before[key]]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), len(KEYS) / 2)
+        for key in moved:
+            self.assertEqual(ring.get(key), 'd')
+
+
+class ParseTargetsTest(unittest.TestCase):
+
+    def test_parses_targets(self):
+        self.assertEqual(
+            parse_targets('db1:27018/shop, db2/shop,'),
+            [('db1:27018/shop', 'db1', 27018, 'shop'),
+             ('db2/shop', 'db2', 27017, 'shop')])
+        self.assertEqual(parse_targets(''), [])
+
+    def test_rejects_a_target_without_database(self):
+        with self.assertRaises(ValueError):
+            parse_targets('db1:27017')
+
+
+@requires_mongomock
+class ShardRouterRebalanceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.first, self.second = make_database(), make_database()
+        self.router = ShardRouter({'a': self.first}, virtual_nodes=10)
+        self.users = KEYS[:50]
+        self.first.insert_many('users', [
+            {'user': user, 'password': 'x'} for user in self.users])
+        self.first.insert_many('cart', [
+            {'user': user, 'cart_items': [user]} for user in self.users])
+        self.router.add_target('b', self.second)
+        self.moved_users = [
+            user for user in self.users if self.router.ring.get(user) == 'b']
+
+    def get_carts(self, database, user):
+        return database.find_all('cart', {'user': user})
+
+    def test_users_not_moved_yet_are_served_by_their_previous_shard(self):
+        user = self.moved_users[0]
+        self.assertIs(self.router.get_database(user), self.second)
+        self.assertIs(self.router.get_database(user, 'cart'), self.first)
+
+        self.first.delete_many('cart', {'user': user})
+        self.assertIs(self.router.get_database(user, 'cart'), self.second)
+
+    def test_documents_are_moved_to_their_shard(self):
+        moved, left = self.router.rebalance(batch_size=7)
+
+        self.assertTrue(self.moved_users)
+        self.assertEqual(moved, {
+            'users': len(self.moved_users), 'cart': len(self.moved_users)})
+        self.assertEqual(left, 0)
+        self.assertIsNone(self.router.previous_ring)
+        for user in self.users:
+            database = self.router.get_database(user, 'cart')
+            self.assertEqual(
+                [cart['cart_items'] for cart in
+                 self.get_carts(database, user)], [[user]])
+        self.assertEqual(
+            len(self.second.find_all('cart')), len(self.moved_users))
+
+    def test_documents_created_in_the_new_shard_are_replaced(self):
+        user = self.moved_users[0]
+        self.second.insert_many('cart', [{'user': user, 'cart_items': []}])
+
+        self.router.rebalance()
+        self.assertEqual(
+            [cart['cart_items'] for cart in
+             self.get_carts(self.second, user)], [[user]])
+
+    def test_documents_changed_while_moved_are_copied_again(self):
+        user = self.moved_users[0]
+        delete_many = self.first.delete_many
+
+        def update_then_delete(collection_name, query):
+            if collection_name == 'cart' and not self.changed:
+                self.changed = True
+                self.first.update_one(
+                    'cart', {'user': user}, {'$set': {'cart_items': ['new']}})
+            return delete_many(collection_name, query)
+
+        self.changed = False
+        with mock.patch.object(
+                self.first, 'delete_many', update_then_delete):
+            moved, left = self.router.rebalance()
+
+        self.assertEqual(left, 0)
+        self.assertEqual(self.get_carts(self.first, user), [])
+        self.assertEqual(
+            [cart['cart_items'] for cart in
+             self.get_carts(self.second, user)], [['new']])
+
+    def test_previous_targets_must_be_targets(self):
+        with self.assertRaises(ValueError):
+            ShardRouter({'a': self.first}, previous_targets=['c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
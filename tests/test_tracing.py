@@ -0,0 +1,70 @@
+import unittest
+
+from app.tracing import Tracer, parse_traceparent
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class RecordingExporter:
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span_record):
+        self.spans.append(span_record)
+
+
+class ParseTraceparentTest(unittest.TestCase):
+
+    def test_parses_a_valid_header(self):
+        self.assertEqual(
+            parse_traceparent('00-{}-{}-01'.format(TRACE_ID, PARENT_ID)),
+            (TRACE_ID, PARENT_ID, True))
+        self.assertEqual(
+            parse_traceparent(' 00-{}-{}-00 '.format(TRACE_ID, PARENT_ID)),
+            (TRACE_ID, PARENT_ID, False))
+
+    def test_rejects_invalid_headers(self):
+        invalid = [
+            '',
+            'garbage',
+            '00-{}-{}-zz'.format(TRACE_ID, PARENT_ID),
+            '00-{}-{}-1'.format(TRACE_ID, PARENT_ID),
+            '0-{}-{}-01'.format(TRACE_ID, PARENT_ID),
+            'ff-{}-{}-01'.format(TRACE_ID, PARENT_ID),
+            '00-{}-{}-01'.format('0' * 32, PARENT_ID),
+            '00-{}-{}-01'.format(TRACE_ID, '0' * 16),
+            '00-{}-{}-01'.format(TRACE_ID[:-1], PARENT_ID),
+            '00-{}-{}-01'.format(TRACE_ID.upper(), PARENT_ID),
+            '00-{}-{}-01-extra'.format(TRACE_ID, PARENT_ID),
+        ]
+        for traceparent in invalid:
+            self.assertIsNone(parse_traceparent(traceparent), traceparent)
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = Tracer(0, RecordingExporter())
+
+    def test_continues_a_sampled_parent_trace(self):
+        span = self.tracer.start_trace(
+            'GET', '00-{}-{}-01'.format(TRACE_ID, PARENT_ID))
+        self.assertEqual(span.trace_id, TRACE_ID)
+        self.assertEqual(span.parent_id, PARENT_ID)
+
+    def test_does_not_sample_an_unsampled_parent_trace(self):
+        self.assertIsNone(self.tracer.start_trace(
+            'GET', '00-{}-{}-00'.format(TRACE_ID, PARENT_ID)))
+
+    def test_starts_a_new_trace_on_an_invalid_header(self):
+        tracer = Tracer(1, RecordingExporter())
+        span = tracer.start_trace(
+            'GET', '00-{}-{}-zz'.format(TRACE_ID, PARENT_ID))
+        self.assertNotEqual(span.trace_id, TRACE_ID)
+        self.assertIsNone(span.parent_id)
+
+
+if __name__ == '__main__':
+    unittest.main()